@@ -14,8 +14,8 @@ from pathlib import Path
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.utils.logger import logger
-from src.config import config
+# Configuration, logging and ML frameworks are imported after argument
+# parsing (and only by the commands that need them) to keep startup fast
 
 def main():
     """Main application entry point"""
@@ -50,8 +50,41 @@ def main():
         help='Model to train (default: all)'
     )
     
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Parallel environment workers for PPO training (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--preload',
+        action='store_true',
+        help='Import ML frameworks and load models up front instead of on first use'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Print a per-phase timing profile of the simulation run'
+    )
+    
+    parser.add_argument(
+        '--trace',
+        metavar='PATH',
+        help='Write a Chrome trace-event JSON of the simulation run (implies --profile)'
+    )
+    
     args = parser.parse_args()
     
+    from src.utils.logger import logger
+    from src.config import config
+    
+    if args.preload:
+        from src.services.warmup import preload
+        timings = preload(include_rl=args.command == 'train')
+        logger.info(f"🔥 Preloaded in {sum(timings.values()):.2f}s ({', '.join(timings)})")
+    
     logger.info("=" * 60)
     logger.info("🌞 SOLAR SWARM INTELLIGENCE")
     logger.info("   IEEE PES Energy Utopia Challenge")
@@ -76,7 +109,15 @@ def main():
         from src.agents.base_agent import SwarmSimulator
         
         simulator = SwarmSimulator(num_agents=args.agents)
-        results = simulator.run(hours=args.hours)
+        if args.profile or args.trace:
+            from src.utils.profiling import profile
+            with profile(trace_path=args.trace) as profiler:
+                results = simulator.run(hours=args.hours)
+            print(profiler.format_report())
+            if args.trace:
+                logger.info(f"🧭 Chrome trace saved to {args.trace} (open in chrome://tracing or Perfetto)")
+        else:
+            results = simulator.run(hours=args.hours)
         
         # Generate report
         from src.utils.metrics import PerformanceEvaluator
@@ -197,7 +238,7 @@ def main():
                 from src.agents.rl_agent import train_rl_agents
                 
                 # Train PPO (this may take a while)
-                model = train_rl_agents(total_timesteps=100000)
+                model = train_rl_agents(total_timesteps=100000, num_workers=args.workers)
                 models_trained.append('PPO')
                 logger.info("✅ PPO training complete")
             except Exception as e:
@@ -241,8 +282,10 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
+        from src.utils.logger import logger
         logger.info("\n⚠️  Interrupted by user")
         sys.exit(0)
     except Exception as e:
+        from src.utils.logger import logger
         logger.error(f"❌ Error: {e}", exc_info=True)
         sys.exit(1)
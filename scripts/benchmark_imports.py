@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Import-Time Benchmark
+Measure cold import time of the API / CLI entry points and which ML
+frameworks they pull in
+"""
+
+import sys
+import os
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+import argparse
+import json
+import statistics
+import subprocess
+import time
+
+# Entry points: name -> statement run in a fresh interpreter
+TARGETS = {
+    'api': 'import src.api.main',
+    'routes': 'import src.api.routes',
+    'services': 'import src.services',
+    'agents': 'import src.agents',
+    'cli': 'import runpy; sys.argv = ["main.py", "--help"]; runpy.run_path("main.py", run_name="__main__")',
+}
+
+# Frameworks that should only load when a model is first used
+HEAVY_MODULES = (
+    'torch', 'sklearn', 'scipy', 'pandas', 'gym', 'gymnasium', 'stable_baselines3',
+    'prophet', 'torch_geometric', 'tensorflow', 'matplotlib',
+)
+
+PROBE = """
+import sys, time, json, io, contextlib
+start = time.perf_counter()
+try:
+    with contextlib.redirect_stdout(io.StringIO()):
+        {statement}
+except SystemExit:
+    pass
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(statement, repeat=5):
+    """Median import and process wall time over ``repeat`` fresh interpreters"""
+    imports, walls, heavy = [], [], []
+    code = PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        walls.append(time.perf_counter() - start)
+        result = json.loads(output.strip().splitlines()[-1])
+        imports.append(result['seconds'])
+        heavy = result['heavy']
+    return {
+        'import_seconds': statistics.median(imports),
+        'process_seconds': statistics.median(walls),
+        'heavy_modules': heavy,
+    }
+
+
+def slowest_imports(statement, top=15):
+    """Top modules by cumulative time from ``python -X importtime``"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=ROOT, capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold import time of entry points')
+    parser.add_argument('targets', nargs='*', default=list(TARGETS),
+                        help=f"Entry points to measure: {', '.join(TARGETS)} (default: all)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--detail', action='store_true', help='Show the slowest imports per target')
+    parser.add_argument('--output', help='Write results as JSON (to track over time)')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Fail if any import takes longer than this many seconds')
+    args = parser.parse_args()
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+
+    results = {}
+    print("=" * 72)
+    print(f"{'target':<10}{'import s':>10}{'process s':>11}  heavy modules loaded")
+    print("-" * 72)
+    for name in args.targets:
+        results[name] = measure(TARGETS[name], args.repeat)
+        result = results[name]
+        print(f"{name:<10}{result['import_seconds']:>10.3f}{result['process_seconds']:>11.3f}  "
+              f"{', '.join(result['heavy_modules']) or '-'}")
+        if args.detail:
+            for cumulative_us, self_us, module in slowest_imports(TARGETS[name]):
+                print(f"{'':<12}{cumulative_us / 1e6:>8.3f}s {module}")
+    print("=" * 72)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+
+    failed = [name for name, result in results.items()
+              if result['heavy_modules'] or (args.budget is not None and result['import_seconds'] > args.budget)]
+    if failed:
+        print(f"❌ Over budget or loading ML frameworks eagerly: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
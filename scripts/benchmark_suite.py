@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite
+Time the simulation, API and ML hot paths across community sizes, save the
+results as JSON and compare runs against a baseline
+
+Usage:
+    python scripts/benchmark_suite.py run [--quick] [--filter swarm] [--output FILE]
+    python scripts/benchmark_suite.py compare BASELINE.json CURRENT.json [--threshold 0.15]
+    python scripts/benchmark_suite.py list
+"""
+
+import sys
+import os
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+import argparse
+import asyncio
+import atexit
+import contextlib
+import io
+import json
+import math
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+DEFAULT_OUTPUT_DIR = os.path.join(ROOT, 'results', 'benchmarks')
+
+# name -> (setup, params, quick params); setup(param) returns the callable to time
+BENCHMARKS = {}
+
+
+def benchmark(name, params=(None,), quick=None):
+    """Register ``setup(param) -> callable``; only the callable is timed"""
+    def register(setup):
+        BENCHMARKS[name] = (setup, tuple(params), tuple(quick if quick is not None else params))
+        return setup
+    return register
+
+
+# ============================================================================
+# Simulation
+
+@benchmark('swarm.run', params=(50, 500, 5000), quick=(50, 500))
+def bench_swarm_run(num_agents, hours=4):
+    from src.agents.base_agent import SwarmSimulator
+
+    def run():
+        SwarmSimulator(num_agents=num_agents).run(hours=hours)
+    return run
+
+
+@benchmark('environment.step', params=(50, 500, 5000), quick=(50, 500))
+def bench_environment_step(num_houses):
+    from src.simulation.environment import SolarEnvironment
+    env = SolarEnvironment(num_houses=num_houses)
+    demands = np.random.uniform(0.5, 3.0, num_houses).tolist()
+    return lambda: env.step(demands)
+
+
+@benchmark('marl.step', params=(50, 500), quick=(50,))
+def bench_marl_step(num_agents):
+    from src.agents.multi_agent_env import MultiAgentSolarEnv
+    env = MultiAgentSolarEnv(num_agents=num_agents, grid_size=(math.ceil(num_agents / 10), 10))
+    actions = [np.array([0.5, 1.0, 1.0], dtype=np.float32)] * num_agents
+    return lambda: env.step(actions)
+
+
+@benchmark('marl.step_vectorized', params=(50, 500, 5000), quick=(50, 500))
+def bench_marl_step_vectorized(num_agents):
+    from src.agents.multi_agent_env import VectorizedMultiAgentSolarEnv
+    env = VectorizedMultiAgentSolarEnv(num_agents=num_agents, grid_size=(math.ceil(num_agents / 10), 10))
+    actions = np.tile(np.array([0.5, 1.0, 1.0], dtype=np.float32), (num_agents, 1))
+    return lambda: env.step(actions)
+
+
+@benchmark('synthetic.generate_dataset', params=(10, 50), quick=(10,))
+def bench_generate_dataset(num_houses, days=7):
+    from src.data_collection.generate_synthetic import SyntheticDataGenerator
+    generator = SyntheticDataGenerator(num_houses=num_houses, days=days)
+    return generator.generate_dataset
+
+
+# ============================================================================
+# ML services
+
+def _history(hours=24):
+    return [
+        {'hour': h, 'production': max(0.0, 5 * math.sin((h - 6) * math.pi / 12)),
+         'consumption': 1.5, 'battery_pct': 0.5}
+        for h in range(hours)
+    ]
+
+
+@benchmark('forecast.predict_24h')
+def bench_forecast(_):
+    from src.services.forecasting_service import ForecastingService
+    service = ForecastingService()
+    history = _history()
+    return lambda: service.predict_24h(historical_data=history)
+
+
+def _anomaly_columns(n):
+    return {
+        'production': np.random.uniform(0, 5, n),
+        'consumption': np.random.uniform(0.5, 4, n),
+        'battery_level': np.random.uniform(0, 10, n),
+    }
+
+
+@benchmark('anomaly.rules', params=(50, 5000), quick=(50,))
+def bench_anomaly_rules(n):
+    from src.services.anomaly_service import AnomalyDetectionService
+    service = AnomalyDetectionService()
+    columns = _anomaly_columns(n)
+    return lambda: service.detect_anomalies_array(**columns)
+
+
+@benchmark('anomaly.isolation_forest', params=(50, 5000), quick=(50,))
+def bench_anomaly_forest(n):
+    from src.services.anomaly_service import AnomalyDetectionService
+    service = AnomalyDetectionService()
+    training = _anomaly_columns(2000)
+    service.train([
+        {'production': p, 'consumption': c, 'battery_level': b, 'net_energy': p - c, 'hour': i % 24}
+        for i, (p, c, b) in enumerate(zip(training['production'], training['consumption'], training['battery_level']))
+    ])
+    columns = _anomaly_columns(n)
+    return lambda: service.detect_anomalies_array(**columns)
+
+
+@benchmark('anomaly.streaming', params=(50, 5000), quick=(50,))
+def bench_anomaly_streaming(n):
+    from src.services.streaming_anomaly import StreamingAnomalyDetector
+    detector = StreamingAnomalyDetector()
+    device_ids = [f"device_{i}" for i in range(n)]
+    columns = _anomaly_columns(n)
+    values = np.column_stack([columns[name] for name in detector.features])
+    hours = np.full(n, 12)
+    return lambda: detector.update(device_ids, values, hours)
+
+
+# ============================================================================
+# Storage and API
+
+@benchmark('storage.save_simulation', params=(24, 168, 720), quick=(24,))
+def bench_save_simulation(hours, num_agents=50):
+    from src.agents.base_agent import SwarmSimulator
+    from src.utils.historical_storage import HistoricalStorage
+
+    sim = SwarmSimulator(num_agents=num_agents)
+    step_results = [sim.step(hour % 24) for hour in range(hours)]
+    directory = tempfile.mkdtemp(prefix='bench_storage_')
+    atexit.register(shutil.rmtree, directory, True)
+    storage = HistoricalStorage(db_path=os.path.join(directory, 'history.db'))
+    return lambda: storage.save_simulation(num_agents=num_agents, hours=hours, step_results=step_results)
+
+
+class _FakeWebSocket:
+    """Client that accepts every frame without I/O"""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, message):
+        self.frames += 1
+
+
+@benchmark('websocket.broadcast', params=(1, 10, 100, 1000), quick=(1, 100))
+def bench_websocket_broadcast(num_clients, num_houses=50):
+    from src.api.websocket import SimulationWebSocket
+    manager = SimulationWebSocket()
+    manager.active_connections = [_FakeWebSocket() for _ in range(num_clients)]
+    update = {
+        'timestamp': 12,
+        'houses': [
+            {'id': i, 'production': 2.5, 'consumption': 1.5, 'battery': 5.0, 'status': 'surplus', 'neighbors': [i - 1, i + 1]}
+            for i in range(num_houses)
+        ],
+        'metrics': {'solarUsage': 80.0, 'batteryLevel': 50.0, 'costSavings': 1.2, 'co2Saved': 0.5},
+    }
+    loop = asyncio.new_event_loop()
+    atexit.register(loop.close)
+    return lambda: loop.run_until_complete(manager.broadcast(update))
+
+
+# ============================================================================
+# Runner
+
+def time_callable(func, repeat, min_time):
+    """
+    Median / min / mean / stdev seconds per call over ``repeat`` samples
+
+    Each sample runs the call ``number`` times, chosen (after one warm-up
+    call) so a sample lasts at least ``min_time`` seconds.
+    """
+    start = time.perf_counter()
+    func()
+    first = time.perf_counter() - start
+    number = max(1, int(math.ceil(min_time / first))) if first > 0 else 1000
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        'median_s': statistics.median(samples),
+        'min_s': min(samples),
+        'mean_s': statistics.fmean(samples),
+        'stdev_s': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def result_key(name, param):
+    return name if param is None else f"{name}[{param}]"
+
+
+def scaling_exponent(points):
+    """Log-log slope of time against size: ~1 linear, ~2 quadratic"""
+    if len(points) < 2:
+        return None
+    x = np.log([size for size, _ in points])
+    y = np.log([seconds for _, seconds in points])
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(pattern=None, quick=False, repeat=5, min_time=0.05, seed=0):
+    results, scaling = {}, {}
+    for name, (setup, params, quick_params) in BENCHMARKS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        points = []
+        for param in (quick_params if quick else params):
+            key = result_key(name, param)
+            # Same inputs on every run
+            random.seed(seed)
+            np.random.seed(seed)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    func = setup(param)
+                    result = time_callable(func, repeat, min_time)
+            except ImportError as e:
+                print(f"⚠️ Skipped {key}: {e}")
+                continue
+            result['param'] = param
+            results[key] = result
+            print(f"{key:<40}{result['median_s'] * 1e3:>12.3f} ms  ±{result['stdev_s'] * 1e3:.3f}  (x{result['number']})")
+            if isinstance(param, (int, float)):
+                points.append((param, result['median_s']))
+        exponent = scaling_exponent(points)
+        if exponent is not None:
+            scaling[name] = {'points': points, 'exponent': exponent}
+            print(f"{'':<4}scaling exponent {exponent:.2f}")
+
+    return {
+        'metadata': {
+            'timestamp': datetime.now().isoformat(),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': quick,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+        'scaling': scaling,
+    }
+
+
+def compare(baseline, current, threshold=0.15):
+    """
+    Rows of (key, baseline s, current s, ratio, verdict) for the shared keys
+
+    A benchmark regresses when its median is more than ``threshold``
+    slower than the baseline, and improves when that much faster.
+    """
+    rows = []
+    for key, result in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            rows.append((key, None, result['median_s'], None, 'new'))
+            continue
+        ratio = result['median_s'] / base['median_s'] if base['median_s'] > 0 else math.inf
+        if ratio > 1 + threshold:
+            verdict = 'regression'
+        elif ratio < 1 - threshold:
+            verdict = 'improvement'
+        else:
+            verdict = 'same'
+        rows.append((key, base['median_s'], result['median_s'], ratio, verdict))
+    return rows
+
+
+def cmd_run(args):
+    print("=" * 72)
+    report = run_suite(args.filter, args.quick, args.repeat, args.min_time, args.seed)
+    print("=" * 72)
+
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return print_comparison(compare(baseline, report, args.threshold))
+    return 0
+
+
+def print_comparison(rows):
+    print(f"{'benchmark':<40}{'baseline ms':>13}{'current ms':>12}{'ratio':>8}  verdict")
+    print("-" * 82)
+    for key, base, current, ratio, verdict in rows:
+        base_text = f"{base * 1e3:>13.3f}" if base is not None else f"{'-':>13}"
+        ratio_text = f"{ratio:>8.2f}" if ratio is not None else f"{'-':>8}"
+        marker = {'regression': '❌', 'improvement': '✅'}.get(verdict, '')
+        print(f"{key:<40}{base_text}{current * 1e3:>12.3f}{ratio_text}  {verdict} {marker}")
+
+    regressions = [row[0] for row in rows if row[4] == 'regression']
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    for label, report in (('baseline', baseline), ('current', current)):
+        meta = report.get('metadata', {})
+        print(f"{label:<9} {meta.get('timestamp', '?')}  commit {meta.get('commit') or '?'}  "
+              f"python {meta.get('python', '?')}  cpus {meta.get('cpu_count', '?')}")
+    return print_comparison(compare(baseline, current, args.threshold))
+
+
+def cmd_list(args):
+    for name, (_, params, quick_params) in BENCHMARKS.items():
+        sizes = ', '.join(str(p) for p in params if p is not None) or '-'
+        print(f"{name:<32}{sizes}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark simulation, API and ML hot paths')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the suite and save results as JSON')
+    run_parser.add_argument('--filter', help='Regex selecting benchmark names')
+    run_parser.add_argument('--quick', action='store_true', help='Smaller sizes only (for CI)')
+    run_parser.add_argument('--repeat', type=int, default=5, help='Samples per benchmark')
+    run_parser.add_argument('--min-time', type=float, default=0.05,
+                            help='Minimum seconds per sample (fast calls are looped)')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', help=f'JSON file (default: {os.path.relpath(DEFAULT_OUTPUT_DIR, ROOT)}/benchmark_<time>.json)')
+    run_parser.add_argument('--baseline', help='Compare against this results file after running')
+    run_parser.add_argument('--threshold', type=float, default=0.15,
+                            help='Relative slowdown counted as a regression (default: 0.15)')
+    run_parser.set_defaults(handler=cmd_run)
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.15)
+    compare_parser.set_defaults(handler=cmd_compare)
+
+    list_parser = subparsers.add_parser('list', help='List benchmarks and their sizes')
+    list_parser.set_defaults(handler=cmd_list)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Load Test
+Drive one API instance with a fleet of simulated ESP32 devices and dashboard
+WebSocket subscribers, and report throughput, latency percentiles and dropped
+frames
+
+Each device runs the firmware loop: POST /iot/data every ``--interval``
+seconds, GET /iot/command every ``--poll-interval`` seconds and POST
+/iot/command/confirm for every command it receives. Subscribers hold
+/ws/simulation open while a simulation runs; frames the server broadcast
+but a subscriber never received are reported as dropped.
+
+Usage:
+    python scripts/load_test.py --devices 1000 --subscribers 50 --duration 60
+    python scripts/load_test.py --in-process --devices 200      # no sockets, no extra deps
+    python scripts/load_test.py --url http://10.0.0.5:8000      # an already running server
+"""
+
+import sys
+import os
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import re
+import socket
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+import httpx
+
+API = '/api/v1'
+
+
+# ============================================================================
+# Telemetry
+
+class DeviceProfile:
+    """Realistic readings for one panel + battery over the day"""
+
+    def __init__(self, device_id, rng, time_scale=1.0):
+        self.device_id = device_id
+        self.rng = rng
+        self.time_scale = time_scale  # simulated seconds per wall second
+        self.panel_w = rng.uniform(150, 450)
+        self.battery_pct = rng.uniform(20, 90)
+        self.load_w = rng.uniform(20, 120)
+        self.clouds = rng.beta(2, 5)
+        self.start = time.time()
+
+    def reading(self):
+        now = self.start + (time.time() - self.start) * self.time_scale
+        hour = (now / 3600.0) % 24
+        sun = max(0.0, math.sin((hour - 6) * math.pi / 12))
+        self.clouds = min(1.0, max(0.0, self.clouds + self.rng.normal(0, 0.05)))
+        power_w = max(0.0, self.panel_w * sun * (1 - 0.75 * self.clouds) + self.rng.normal(0, 3))
+        voltage_v = 12.0 + 1.2 * self.battery_pct / 100 + self.rng.normal(0, 0.05)
+
+        # Battery follows the net of production and household load
+        self.battery_pct = min(100.0, max(0.0, self.battery_pct + (power_w - self.load_w) / 500.0))
+        return {
+            'device_id': self.device_id,
+            'sensor_data': {
+                'voltage_v': round(voltage_v, 3),
+                'current_a': round(power_w / voltage_v, 4),
+                'power_w': round(power_w, 2),
+                'temperature_c': round(25 + 15 * sun + self.rng.normal(0, 1), 2),
+                'battery_level_pct': round(self.battery_pct, 2),
+                'timestamp': datetime.now().isoformat(),
+            },
+            'timestamp': datetime.now().isoformat(),
+        }
+
+
+# ============================================================================
+# Results
+
+class Stats:
+    """Latencies and errors per operation"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(int)
+
+    def record(self, op, seconds, status=None):
+        self.latencies[op].append(seconds)
+        if status is not None:
+            self.statuses[f"{op}:{status}"] += 1
+
+    def error(self, op, kind):
+        self.errors[f"{op}:{kind}"] += 1
+
+    def summary(self, elapsed):
+        ops = {}
+        for op, values in sorted(self.latencies.items()):
+            values = np.asarray(values)
+            ops[op] = {
+                'count': int(len(values)),
+                'throughput_rps': len(values) / elapsed,
+                'p50_ms': float(np.percentile(values, 50) * 1e3),
+                'p90_ms': float(np.percentile(values, 90) * 1e3),
+                'p99_ms': float(np.percentile(values, 99) * 1e3),
+                'max_ms': float(values.max() * 1e3),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            'requests': total,
+            'throughput_rps': total / elapsed,
+            'operations': ops,
+            'errors': dict(self.errors),
+            'statuses': dict(self.statuses),
+        }
+
+
+def parse_metric(text, name, labels=''):
+    """Value of one sample in Prometheus text output (0 if absent)"""
+    match = re.search(rf'^{re.escape(name + labels)} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+# ============================================================================
+# Transports: the same client code runs over TCP or in-process (ASGI)
+
+class _ASGIWebSocket:
+    """Minimal in-process WebSocket client speaking ASGI to the app"""
+
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+        self._to_app = asyncio.Queue()
+        self._from_app = asyncio.Queue()
+        self._task = None
+
+    async def __aenter__(self):
+        scope = {
+            'type': 'websocket', 'asgi': {'version': '3.0'}, 'scheme': 'ws', 'path': self.path,
+            'raw_path': self.path.encode(), 'query_string': b'', 'headers': [],
+            'client': ('127.0.0.1', 0), 'server': ('loadtest', 80), 'subprotocols': [],
+        }
+        await self._to_app.put({'type': 'websocket.connect'})
+        self._task = asyncio.create_task(self.app(scope, self._to_app.get, self._from_app.put))
+        message = await self._from_app.get()
+        if message['type'] != 'websocket.accept':
+            raise ConnectionError(f"WebSocket rejected: {message}")
+        return self
+
+    async def recv(self):
+        message = await self._from_app.get()
+        if message['type'] == 'websocket.close':
+            raise ConnectionError("WebSocket closed by server")
+        return message.get('text') or message.get('bytes')
+
+    async def __aexit__(self, *exc):
+        await self._to_app.put({'type': 'websocket.disconnect', 'code': 1000})
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(self._task, 5)
+
+
+class Target:
+    """HTTP client plus WebSocket factory for the API under test"""
+
+    def __init__(self, client, websocket):
+        self.client = client
+        self.websocket = websocket
+
+    @classmethod
+    def remote(cls, url, connections):
+        try:
+            import websockets
+        except ImportError:
+            websockets = None
+
+        def websocket(path):
+            if websockets is None:
+                raise ImportError("WebSocket subscribers need the 'websockets' package (see requirements.txt)")
+            return websockets.connect(re.sub(r'^http', 'ws', url) + path, max_queue=None)
+
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        client = httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0)
+        return cls(client, websocket)
+
+    @classmethod
+    def in_process(cls, app):
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://loadtest', timeout=30.0)
+        return cls(client, lambda path: _ASGIWebSocket(app, path))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve(port, env):
+    """Run the API under uvicorn in a subprocess on localhost"""
+    code = (
+        "import logging, uvicorn\n"
+        "from src.api.main import app\n"
+        f"logging.getLogger('solar_swarm').setLevel({env['LOAD_TEST_LOG_LEVEL']!r})\n"
+        f"uvicorn.run(app, host='127.0.0.1', port={port}, log_level='warning')\n"
+    )
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def wait_ready(target, timeout):
+    """Wait for /ready (warm-up done) so cold starts don't skew latencies"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(httpx.TransportError):
+            if (await target.client.get('/ready')).status_code == 200:
+                return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+# ============================================================================
+# Load
+
+async def device_loop(target, profile, stats, args, stop, rng):
+    """One ESP32: telemetry, command poll and confirmation"""
+    client = target.client
+    # Spread devices over the first interval instead of a thundering herd
+    with contextlib.suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(stop.wait(), rng.uniform(0, args.interval))
+    next_data = next_poll = time.monotonic()
+
+    while not stop.is_set():
+        now = time.monotonic()
+        try:
+            if now >= next_data:
+                next_data += args.interval
+                start = time.perf_counter()
+                response = await client.post(f"{API}/iot/data", json=profile.reading())
+                stats.record('iot_data', time.perf_counter() - start, response.status_code)
+                if response.status_code != 200:
+                    stats.error('iot_data', response.status_code)
+
+            if now >= next_poll:
+                next_poll += args.poll_interval
+                start = time.perf_counter()
+                response = await client.get(f"{API}/iot/command", params={'device_id': profile.device_id})
+                stats.record('iot_command', time.perf_counter() - start, response.status_code)
+                if response.status_code == 200:
+                    command = response.json()
+                    start = time.perf_counter()
+                    response = await client.post(f"{API}/iot/command/confirm", json={
+                        'device_id': profile.device_id,
+                        'command': command['command'].get('action'),
+                        'command_id': command.get('command_id'),
+                        'executed': True,
+                    })
+                    stats.record('iot_confirm', time.perf_counter() - start, response.status_code)
+                elif response.status_code != 204:
+                    stats.error('iot_command', response.status_code)
+        except httpx.TimeoutException:
+            stats.error('device', 'timeout')
+        except httpx.TransportError as e:
+            stats.error('device', type(e).__name__)
+
+        delay = min(next_data, next_poll) - time.monotonic()
+        if delay > 0:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop.wait(), delay)
+
+
+async def subscriber(target, frames, connected, stop, index):
+    """One dashboard on /ws/simulation; counts frames received"""
+    try:
+        async with target.websocket('/ws/simulation') as ws:
+            connected.add(index)
+            while not stop.is_set():
+                receive = asyncio.ensure_future(ws.recv())
+                stopped = asyncio.ensure_future(stop.wait())
+                finished, _ = await asyncio.wait({receive, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                if receive not in finished:
+                    receive.cancel()
+                    break
+                stopped.cancel()
+                receive.result()
+                frames[index] += 1
+    except Exception as e:
+        connected.discard(index)
+        print(f"⚠️ Subscriber {index} disconnected: {e}")
+
+
+async def simulation_driver(target, args, stop):
+    """Keep a simulation running so /ws/simulation has frames to broadcast"""
+    client = target.client
+    start = None
+    while not stop.is_set():
+        if start is None or start.done():
+            status = (await client.get(f"{API}/simulation/status")).json()
+            if status['status'] != 'running':
+                # In-process the ASGI transport runs the simulation (a background
+                # task) before the response returns, so never await it inline
+                start = asyncio.create_task(
+                    client.post(f"{API}/simulation/start", json={'num_agents': args.sim_agents, 'hours': 168})
+                )
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stop.wait(), 1.0)
+
+    with contextlib.suppress(httpx.HTTPError):
+        await client.post(f"{API}/simulation/stop")
+    if start is not None:
+        # The loop notices the stop after at most one step, then saves its history
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(start, args.frame_interval + 30.0)
+
+
+async def scrape(target):
+    text = (await target.client.get('/metrics')).text
+    return {
+        'broadcasts': parse_metric(text, 'solar_websocket_broadcast_seconds_count'),
+        'send_failures': parse_metric(text, 'solar_websocket_send_failures_total'),
+    }
+
+
+async def run_load(target, args):
+    stats = Stats()
+    stop = asyncio.Event()   # devices and simulation
+    done = asyncio.Event()   # subscribers
+    rng = np.random.default_rng(args.seed)
+
+    if not await wait_ready(target, args.ready_timeout):
+        print("⚠️ API did not report ready; measuring anyway")
+
+    # Dashboards connect first so every broadcast in the window is expected by all of them
+    frames = [0] * args.subscribers
+    connected = set()
+    subscribers = [asyncio.create_task(subscriber(target, frames, connected, done, i))
+                   for i in range(args.subscribers)]
+    driver = asyncio.create_task(simulation_driver(target, args, stop)) if args.subscribers else None
+    await asyncio.sleep(0.5)
+
+    start = time.perf_counter()
+    before = await scrape(target)
+    frames_before = sum(frames)
+    devices = [
+        asyncio.create_task(device_loop(
+            target, DeviceProfile(f"loadtest_{i:05d}", np.random.default_rng(args.seed + i + 1), args.time_scale),
+            stats, args, stop, rng
+        ))
+        for i in range(args.devices)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*devices, *([driver] if driver else []), return_exceptions=True)
+    # Requests and broadcasts are both counted up to here: devices done, simulation stopped
+    elapsed = time.perf_counter() - start
+
+    # Simulation is stopped: let frames already broadcast reach their subscribers
+    await asyncio.sleep(args.drain)
+    after = await scrape(target)
+    received = sum(frames) - frames_before
+    done.set()
+    await asyncio.gather(*subscribers, return_exceptions=True)
+
+    report = stats.summary(elapsed)
+    broadcasts = int(after['broadcasts'] - before['broadcasts'])
+    expected = broadcasts * len(connected)
+    report['websocket'] = {
+        'subscribers': args.subscribers,
+        'connected': len(connected),
+        'broadcasts': broadcasts,
+        'frames_expected': expected,
+        'frames_received': received,
+        'frames_dropped': max(0, expected - received),
+        'send_failures': int(after['send_failures'] - before['send_failures']),
+        'frames_per_second': received / elapsed,
+    }
+    report['config'] = {
+        'devices': args.devices, 'interval_s': args.interval, 'poll_interval_s': args.poll_interval,
+        'duration_s': elapsed, 'mode': args.mode,
+    }
+    return report
+
+
+def print_report(report):
+    config, ws = report['config'], report['websocket']
+    print("=" * 78)
+    print(f"{config['devices']} devices ({config['interval_s']:g}s telemetry, {config['poll_interval_s']:g}s poll), "
+          f"{ws['subscribers']} subscribers, {config['duration_s']:.1f}s, {config['mode']}")
+    print("-" * 78)
+    print(f"{'operation':<14}{'count':>9}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for op, row in report['operations'].items():
+        print(f"{op:<14}{row['count']:>9}{row['throughput_rps']:>10.1f}{row['p50_ms']:>10.2f}"
+              f"{row['p90_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}")
+    print(f"{'total':<14}{report['requests']:>9}{report['throughput_rps']:>10.1f}")
+    if report['errors']:
+        print(f"❌ Errors: {report['errors']}")
+    print("-" * 78)
+    print(f"WebSocket: {ws['connected']}/{ws['subscribers']} connected, {ws['broadcasts']} broadcasts, "
+          f"{ws['frames_received']}/{ws['frames_expected']} frames received, "
+          f"{ws['frames_dropped']} dropped, {ws['send_failures']} send failures")
+    print("=" * 78)
+
+
+async def main_async(args):
+    env = dict(os.environ)
+    env['SIMULATION_STEP_SECONDS'] = str(args.frame_interval)
+    env['LOAD_TEST_LOG_LEVEL'] = args.log_level
+
+    if args.mode == 'in-process':
+        os.environ['SIMULATION_STEP_SECONDS'] = env['SIMULATION_STEP_SECONDS']
+        import logging
+        from src.api.main import app
+        logging.getLogger('solar_swarm').setLevel(args.log_level)
+        target = Target.in_process(app)
+        async with app.router.lifespan_context(app):
+            async with target.client:
+                return await run_load(target, args)
+
+    if args.mode == 'remote':
+        target = Target.remote(args.url, args.connections)
+        async with target.client:
+            return await run_load(target, args)
+
+    with serve(free_port(), env) as url:
+        target = Target.remote(url, args.connections)
+        async with target.client:
+            return await run_load(target, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the API with simulated ESP32 devices and dashboards')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--subscribers', type=int, default=20, help='/ws/simulation clients')
+    parser.add_argument('--duration', type=float, default=30.0, help='Measured seconds')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between device readings (firmware: 5)')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between command polls (firmware: 2)')
+    parser.add_argument('--frame-interval', type=float, default=0.5,
+                        help='Seconds per simulated hour, i.e. between /ws/simulation frames')
+    parser.add_argument('--sim-agents', type=int, default=50)
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Simulated seconds of daylight per wall second')
+    parser.add_argument('--connections', type=int, default=200, help='HTTP connection pool size')
+    parser.add_argument('--url', help='Test a running server instead of starting one')
+    parser.add_argument('--in-process', dest='mode', action='store_const', const='in-process', default='server',
+                        help='Call the ASGI app directly (no sockets; load generator shares the CPU)')
+    parser.add_argument('--drain', type=float, default=1.0, help='Seconds to wait for in-flight frames')
+    parser.add_argument('--ready-timeout', type=float, default=120.0)
+    parser.add_argument('--log-level', default='WARNING', help='API log level during the test')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the report as JSON')
+    args = parser.parse_args()
+    if args.url and args.mode == 'server':
+        args.mode = 'remote'
+
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
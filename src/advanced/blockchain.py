@@ -1,55 +1,191 @@
 import hashlib
+import hmac
 import json
 from time import time
 
+from .ledger_store import PersistentChain
+
+def hash_transaction(transaction):
+    """
+    SHA-256 hash of a single transaction
+    """
+    return hashlib.sha256(json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+
+def merkle_root(tx_hashes):
+    """
+    Merkle root over a list of transaction hashes (last hash duplicated on odd levels)
+    """
+    if not tx_hashes:
+        return hashlib.sha256(b'').hexdigest()
+    
+    level = list(tx_hashes)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [
+            hashlib.sha256((level[i] + level[i + 1]).encode()).hexdigest()
+            for i in range(0, len(level), 2)
+        ]
+    return level[0]
+
 class Block:
     """
     A block in the energy trading blockchain
+    
+    The block hash covers only the header (index, Merkle root, timestamp,
+    previous hash, nonce), so transactions are serialized once per block
+    rather than once per hash.
     """
     
-    def __init__(self, index, transactions, timestamp, previous_hash):
+    def __init__(self, index, transactions, timestamp, previous_hash, merkle_root_hash=None):
         self.index = index
         self.transactions = transactions
         self.timestamp = timestamp
         self.previous_hash = previous_hash
+        self.merkle_root = merkle_root_hash or self.compute_merkle_root()
         self.nonce = 0
+        self.validator = None
+        self.signature = None
         self.hash = self.calculate_hash()
     
-    def calculate_hash(self):
-        """
-        Calculate SHA-256 hash of block
-        """
-        block_string = json.dumps({
+    def to_dict(self):
+        return {
             'index': self.index,
             'transactions': self.transactions,
             'timestamp': self.timestamp,
             'previous_hash': self.previous_hash,
-            'nonce': self.nonce
+            'merkle_root': self.merkle_root,
+            'nonce': self.nonce,
+            'validator': self.validator,
+            'signature': self.signature,
+            'hash': self.hash
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        block = cls(data['index'], data['transactions'], data['timestamp'],
+                    data['previous_hash'], merkle_root_hash=data['merkle_root'])
+        block.nonce = data['nonce']
+        block.validator = data.get('validator')
+        block.signature = data.get('signature')
+        block.hash = data['hash']
+        return block
+    
+    def compute_merkle_root(self):
+        return merkle_root([hash_transaction(tx) for tx in self.transactions])
+    
+    def _header_hasher(self):
+        header = json.dumps({
+            'index': self.index,
+            'merkle_root': self.merkle_root,
+            'timestamp': self.timestamp,
+            'previous_hash': self.previous_hash
         }, sort_keys=True)
-        
-        return hashlib.sha256(block_string.encode()).hexdigest()
+        return hashlib.sha256(header.encode())
+    
+    def calculate_hash(self):
+        """
+        Calculate SHA-256 hash of the block header
+        """
+        hasher = self._header_hasher()
+        hasher.update(str(self.nonce).encode())
+        return hasher.hexdigest()
     
     def mine_block(self, difficulty=4):
         """
         Proof of work mining
         """
         target = '0' * difficulty
+        base = self._header_hasher()
         
         while self.hash[:difficulty] != target:
             self.nonce += 1
-            self.hash = self.calculate_hash()
+            hasher = base.copy()
+            hasher.update(str(self.nonce).encode())
+            self.hash = hasher.hexdigest()
         
         print(f"Block mined: {self.hash}")
 
+class ProofOfWork:
+    """
+    Proof-of-work consensus: the block hash must start with ``difficulty`` zeros
+    """
+    
+    def __init__(self, difficulty=2):
+        self.difficulty = difficulty
+    
+    def seal(self, block):
+        block.mine_block(self.difficulty)
+    
+    def verify(self, block):
+        return block.hash.startswith('0' * self.difficulty)
+
+class ProofOfAuthority:
+    """
+    Permissioned consensus: blocks are signed by a known authority
+    
+    ``authorities`` maps authority names to shared HMAC keys; blocks are
+    sealed by ``signer``. Sealing is a single HMAC, with no mining.
+    """
+    
+    def __init__(self, authorities, signer):
+        if signer not in authorities:
+            raise ValueError(f"Unknown signer: {signer}")
+        self.authorities = {name: key.encode() if isinstance(key, str) else key
+                            for name, key in authorities.items()}
+        self.signer = signer
+    
+    def _sign(self, name, block):
+        return hmac.new(self.authorities[name], block.hash.encode(), hashlib.sha256).hexdigest()
+    
+    def seal(self, block):
+        block.validator = self.signer
+        block.signature = self._sign(self.signer, block)
+    
+    def verify(self, block):
+        if block.validator not in self.authorities or block.signature is None:
+            return False
+        return hmac.compare_digest(block.signature, self._sign(block.validator, block))
+
 class EnergyBlockchain:
     """
     Blockchain for recording peer-to-peer energy transactions
+    
+    Balances are kept in an index updated as blocks are appended, and
+    validate_new_blocks() checks only blocks added since the last
+    validation (is_chain_valid() always checks the whole chain). Consensus
+    is pluggable: ProofOfWork (default) or the much cheaper ProofOfAuthority.
+    
+    With a LedgerStore as ``storage`` the chain is persisted on disk and
+    only the tip is loaded at startup; balances are then read lazily from
+    the store's address index.
     """
     
-    def __init__(self):
-        self.chain = [self.create_genesis_block()]
+    def __init__(self, consensus=None, storage=None):
+        self.consensus = consensus or ProofOfWork(difficulty=2)
+        self.storage = storage
+        self.balances = {}
         self.pending_transactions = []
-        self.difficulty = 2
+        
+        if storage is not None:
+            self.chain = PersistentChain(storage, Block)
+        else:
+            self.chain = []
+        
+        if len(self.chain):
+            # Persisted blocks were validated before they were written
+            self._validated_height = len(self.chain) - 1
+        else:
+            self._validated_height = 0
+            self._append_block(self.create_genesis_block())
+    
+    @property
+    def difficulty(self):
+        return getattr(self.consensus, 'difficulty', 0)
+    
+    @difficulty.setter
+    def difficulty(self, value):
+        self.consensus.difficulty = value
     
     def create_genesis_block(self):
         """
@@ -60,6 +196,16 @@ class EnergyBlockchain:
     def get_latest_block(self):
         return self.chain[-1]
     
+    def _append_block(self, block):
+        """Append a block and update the balance index"""
+        self.chain.append(block)
+        for transaction in block.transactions:
+            value = transaction['amount_kwh'] * transaction['price']
+            for address, delta in ((transaction['from'], -value), (transaction['to'], value)):
+                # Uncached balances are loaded from the store when requested
+                if self.storage is None or address in self.balances:
+                    self.balances[address] = self.balances.get(address, 0) + delta
+    
     def add_transaction(self, sender, receiver, amount, price):
         """
         Add energy transaction to pending pool
@@ -89,8 +235,8 @@ class EnergyBlockchain:
             previous_hash=self.get_latest_block().hash
         )
         
-        block.mine_block(self.difficulty)
-        self.chain.append(block)
+        self.consensus.seal(block)
+        self._append_block(block)
         
         # Mining reward
         self.pending_transactions = [{
@@ -105,33 +251,46 @@ class EnergyBlockchain:
     
     def get_balance(self, address):
         """
-        Calculate balance for an address
+        Balance for an address from the index
         """
-        balance = 0
-        
-        for block in self.chain:
-            for transaction in block.transactions:
+        if self.storage is not None and address not in self.balances:
+            balance = 0
+            for transaction in self.storage.transactions_for(address):
+                value = transaction['amount_kwh'] * transaction['price']
                 if transaction['from'] == address:
-                    balance -= transaction['amount_kwh'] * transaction['price']
+                    balance -= value
                 if transaction['to'] == address:
-                    balance += transaction['amount_kwh'] * transaction['price']
-        
-        return balance
+                    balance += value
+            self.balances[address] = balance
+        return self.balances.get(address, 0)
+    
+    def _is_block_valid(self, block, previous_block):
+        return (
+            block.hash == block.calculate_hash()
+            and block.merkle_root == block.compute_merkle_root()
+            and block.previous_hash == previous_block.hash
+            and self.consensus.verify(block)
+        )
     
     def is_chain_valid(self):
         """
         Verify blockchain integrity
         """
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i - 1]
-            
-            # Check hash
-            if current_block.hash != current_block.calculate_hash():
-                return False
-            
-            # Check link to previous block
-            if current_block.previous_hash != previous_block.hash:
+        return self._validate_from(1)
+    
+    def validate_new_blocks(self):
+        """
+        Verify only the blocks appended since the last successful check
+        
+        Cheaper than is_chain_valid() for a growing chain, but does not
+        catch tampering with blocks that were already validated.
+        """
+        return self._validate_from(self._validated_height + 1)
+    
+    def _validate_from(self, start):
+        for i in range(start, len(self.chain)):
+            if not self._is_block_valid(self.chain[i], self.chain[i - 1]):
                 return False
         
+        self._validated_height = len(self.chain) - 1
         return True
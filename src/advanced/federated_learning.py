@@ -1,77 +1,291 @@
+import multiprocessing as mp
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
 import torch
 from torch import nn
 
+def build_model():
+    return nn.Sequential(
+        nn.Linear(10, 64),
+        nn.ReLU(),
+        nn.Linear(64, 32),
+        nn.ReLU(),
+        nn.Linear(32, 1)
+    )
+
+def train_local(model, data, epochs=5):
+    """
+    Train model on local data and return the number of samples seen per epoch
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    criterion = nn.MSELoss()
+    num_samples = 0
+    
+    for epoch in range(epochs):
+        num_samples = 0
+        for X, y in data:
+            optimizer.zero_grad()
+            pred = model(X)
+            loss = criterion(pred, y)
+            loss.backward()
+            optimizer.step()
+            num_samples += len(X)
+    
+    return num_samples
+
+def flatten_state(state):
+    """Concatenate a state dict into one float32 vector"""
+    return torch.cat([value.detach().reshape(-1).float() for value in state.values()])
+
+def unflatten_state(vector, like):
+    """Split a flat vector back into a state dict shaped like ``like``"""
+    state, start = {}, 0
+    for key, value in like.items():
+        stop = start + value.numel()
+        state[key] = vector[start:stop].reshape(value.shape).to(value.dtype)
+        start = stop
+    return state
+
+class TopKCompressor:
+    """
+    Keep the ``ratio`` largest-magnitude entries of the update
+    
+    Payload is int32 indices + float32 values.
+    """
+    
+    def __init__(self, ratio=0.01):
+        self.ratio = ratio
+    
+    def compress(self, delta):
+        k = max(1, int(delta.numel() * self.ratio))
+        indices = torch.topk(delta.abs(), k, sorted=False).indices.to(torch.int32)
+        return (indices, delta[indices.long()]), k * 8
+    
+    def decompress(self, payload, size):
+        indices, values = payload
+        delta = torch.zeros(size)
+        delta[indices.long()] = values
+        return delta
+
+class QuantizeCompressor:
+    """
+    Linear 8-bit quantization with one float32 scale per ``chunk_size`` entries
+    """
+    
+    def __init__(self, chunk_size=256):
+        self.chunk_size = chunk_size
+    
+    def compress(self, delta):
+        pad = (-delta.numel()) % self.chunk_size
+        chunks = torch.nn.functional.pad(delta, (0, pad)).reshape(-1, self.chunk_size)
+        scale = chunks.abs().amax(dim=1, keepdim=True).clamp_min(1e-12) / 127
+        quantized = torch.round(chunks / scale).to(torch.int8)
+        return (quantized, scale), quantized.numel() + scale.numel() * 4
+    
+    def decompress(self, payload, size):
+        quantized, scale = payload
+        return (quantized.float() * scale).reshape(-1)[:size]
+
+def encode_update(global_state, local_state, compressor, residual=None):
+    """
+    Compress a client update as a delta from the global weights
+    
+    With error feedback the part of the delta lost to compression is
+    returned as the new residual and added to the next round's delta.
+    
+    Returns:
+        (payload, num_bytes, residual)
+    """
+    delta = flatten_state(local_state) - flatten_state(global_state)
+    if residual is not None:
+        delta += residual
+    payload, num_bytes = compressor.compress(delta)
+    residual = delta - compressor.decompress(payload, delta.numel())
+    return payload, num_bytes, residual
+
+_worker_model = None
+
+def _init_worker():
+    # One thread per process: the pool already provides the parallelism
+    torch.set_num_threads(1)
+
+def _train_client(global_state, data, epochs, compressor=None, residual=None):
+    """Pool task: train one client from the global weights"""
+    global _worker_model
+    if _worker_model is None:
+        _worker_model = build_model()
+    _worker_model.load_state_dict(global_state)
+    num_samples = train_local(_worker_model, data, epochs)
+    if compressor is None:
+        return _worker_model.state_dict(), num_samples
+    return encode_update(global_state, _worker_model.state_dict(), compressor, residual), num_samples
+
 class FederatedLearning:
     """
     Train models across multiple homes without sharing raw data
+    
+    Clients are trained one after another on a single scratch model, or in
+    parallel across ``num_workers`` processes. Either way their updates are
+    folded into a running FedAvg sum weighted by sample count as they arrive,
+    so only the sum and the in-flight updates are held in memory. With
+    ``clients_per_round`` set, a random subset of clients trains each round.
+    
+    With a ``compressor`` (TopKCompressor, QuantizeCompressor) clients send
+    compressed deltas from the global model instead of full state dicts,
+    with per-client error feedback when ``error_feedback`` is set. Upload
+    volume per round is recorded in ``communication_log``.
     """
     
-    def __init__(self, num_clients=50):
+    def __init__(self, num_clients=50, num_workers=1, clients_per_round=None,
+                 local_epochs=5, start_method=None, seed=None,
+                 compressor=None, error_feedback=True):
         self.num_clients = num_clients
+        self.num_workers = num_workers
+        self.clients_per_round = clients_per_round
+        self.local_epochs = local_epochs
+        self.start_method = start_method
+        self.rng = np.random.default_rng(seed)
+        self.compressor = compressor
+        self.error_feedback = error_feedback
+        self.residuals = {}
+        self.communication_log = []
+        
         self.global_model = self.create_model()
-        self.client_models = [self.create_model() for _ in range(num_clients)]
+        self._local_model = None
+        self._executor = None
     
     def create_model(self):
-        return nn.Sequential(
-            nn.Linear(10, 64),
-            nn.ReLU(),
-            nn.Linear(64, 32),
-            nn.ReLU(),
-            nn.Linear(32, 1)
-        )
+        return build_model()
     
-    def train_round(self, client_data):
+    def sample_clients(self, num_available):
         """
-        One round of federated training
+        Indices of the clients that take part in this round
         """
-        client_weights = []
+        if self.clients_per_round is None or self.clients_per_round >= num_available:
+            return np.arange(num_available)
+        return np.sort(self.rng.choice(num_available, self.clients_per_round, replace=False))
+    
+    def _client_updates(self, client_data, clients):
+        """Yield (i, result, num_samples) per client as each one finishes"""
+        global_state = self.global_model.state_dict()
+        
+        if self.num_workers <= 1:
+            if self._local_model is None:
+                self._local_model = self.create_model()
+            for i in clients:
+                self._local_model.load_state_dict(global_state)
+                num_samples = self.train_local(self._local_model, client_data[i], self.local_epochs)
+                if self.compressor is None:
+                    yield i, self._local_model.state_dict(), num_samples
+                else:
+                    yield i, encode_update(global_state, self._local_model.state_dict(),
+                                           self.compressor, self.residuals.get(i)), num_samples
+            return
         
-        # Each client trains locally
-        for i, data in enumerate(client_data):
-            # Load global model
-            self.client_models[i].load_state_dict(
-                self.global_model.state_dict()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=mp.get_context(self.start_method),
+                initializer=_init_worker
             )
+        
+        # Bound the number of submitted tasks so results stream back
+        pending = {}
+        clients = iter(clients)
+        while True:
+            for i in clients:
+                future = self._executor.submit(
+                    _train_client, global_state, client_data[i], self.local_epochs,
+                    self.compressor, self.residuals.get(i)
+                )
+                pending[future] = i
+                if len(pending) >= 2 * self.num_workers:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield (pending.pop(future),) + future.result()
+    
+    def _decoded_updates(self, updates, stats):
+        """Turn client results into (state_dict, num_samples), counting bytes"""
+        global_state = self.global_model.state_dict()
+        global_vector = flatten_state(global_state)
+        dense_bytes = global_vector.numel() * 4
+        
+        for i, result, num_samples in updates:
+            stats['dense_bytes'] += dense_bytes
+            if self.compressor is None:
+                stats['upload_bytes'] += dense_bytes
+                yield result, num_samples
+                continue
             
-            # Train on local data
-            self.train_local(self.client_models[i], data)
-            
-            # Collect weights
-            client_weights.append(
-                self.client_models[i].state_dict()
-            )
+            payload, num_bytes, residual = result
+            stats['upload_bytes'] += num_bytes
+            if self.error_feedback:
+                self.residuals[i] = residual
+            delta = self.compressor.decompress(payload, global_vector.numel())
+            yield unflatten_state(global_vector + delta, global_state), num_samples
+    
+    def train_round(self, client_data):
+        """
+        One round of federated training
+        
+        Args:
+            client_data: per-client iterables of (X, y) batches
+        
+        Returns:
+            Indices of the clients that took part
+        """
+        clients = self.sample_clients(len(client_data))
+        stats = {'round': len(self.communication_log), 'clients': len(clients),
+                 'upload_bytes': 0, 'dense_bytes': 0}
         
         # Aggregate weights (Federated Averaging)
-        global_weights = self.aggregate_weights(client_weights)
+        updates = self._client_updates(client_data, clients)
+        global_weights = self.aggregate_weights(self._decoded_updates(updates, stats))
         
         # Update global model
         self.global_model.load_state_dict(global_weights)
+        self.communication_log.append(stats)
+        return clients
     
     def aggregate_weights(self, client_weights):
         """
         Average weights from all clients
+        
+        Accepts state dicts (equal weighting) or (state_dict, num_samples)
+        pairs, weighted by sample count, from any iterable; the average is
+        accumulated as a running sum.
         """
-        averaged_weights = {}
+        running = None
+        total = 0.0
         
-        for key in client_weights[0].keys():
-            averaged_weights[key] = torch.stack([
-                client[key].float() for client in client_weights
-            ]).mean(0)
+        for update in client_weights:
+            state, num_samples = update if isinstance(update, tuple) else (update, 1)
+            weight = float(max(num_samples, 1))
+            if running is None:
+                dtypes = {key: value.dtype for key, value in state.items()}
+                running = {key: value.double() * weight for key, value in state.items()}
+            else:
+                for key, value in state.items():
+                    running[key].add_(value.double(), alpha=weight)
+            total += weight
         
-        return averaged_weights
+        if running is None:
+            return self.global_model.state_dict()
+        
+        return {key: (value / total).to(dtypes[key]) for key, value in running.items()}
     
     def train_local(self, model, data, epochs=5):
         """
         Train model on local data
         """
-        optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
-        criterion = nn.MSELoss()
-        
-        for epoch in range(epochs):
-            for X, y in data:
-                optimizer.zero_grad()
-                pred = model(X)
-                loss = criterion(pred, y)
-                loss.backward()
-                optimizer.step()
-                
\ No newline at end of file
+        return train_local(model, data, epochs)
+    
+    def close(self):
+        """Shut down the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -1,5 +1,7 @@
+import numpy as np
 import torch
 import torch.nn as nn
+from scipy.spatial import cKDTree
 from torch_geometric.nn import GCNConv
 
 class EnergyFlowGNN(nn.Module):
@@ -26,40 +28,191 @@ class EnergyFlowGNN(nn.Module):
         
         return x
 
-def create_neighborhood_graph(agents):
+def agent_positions(agents, spacing=1.0):
+    """
+    (N, 2) agent coordinates
+
+    Agents without a ``location`` (e.g. SolarPanelAgent) are laid out on a
+    square grid by id.
+    """
+    width = max(1, int(np.ceil(np.sqrt(len(agents)))))
+    positions = np.empty((len(agents), 2), dtype=np.float64)
+    for i, agent in enumerate(agents):
+        location = getattr(agent, 'location', None)
+        if location is None:
+            agent_id = getattr(agent, 'id', i)
+            location = ((agent_id % width) * spacing, (agent_id // width) * spacing)
+        positions[i] = location[:2]
+    return positions
+
+def agent_features(agents, positions):
+    """
+    Node features: [production, consumption, battery, location_x, location_y]
+    """
+    n = len(agents)
+    features = np.empty((n, 5), dtype=np.float32)
+    features[:, 0] = np.fromiter((a.production for a in agents), dtype=np.float32, count=n)
+    features[:, 1] = np.fromiter((a.consumption for a in agents), dtype=np.float32, count=n)
+    features[:, 2] = np.fromiter(
+        (a.battery if hasattr(a, 'battery') else a.battery_level for a in agents),
+        dtype=np.float32, count=n
+    )
+    features[:, 3:] = positions
+    return features
+
+def radius_graph_edges(positions, radius=5.0):
+    """
+    Directed edge_index [2, E] connecting every pair closer than ``radius``
+    """
+    pairs = cKDTree(positions).query_pairs(radius, output_type='ndarray')
+    if len(pairs):
+        # query_pairs is inclusive; keep the strict threshold
+        distance = np.linalg.norm(positions[pairs[:, 0]] - positions[pairs[:, 1]], axis=1)
+        pairs = pairs[distance < radius]
+    edges = np.concatenate([pairs, pairs[:, ::-1]]).T
+    return torch.from_numpy(np.ascontiguousarray(edges, dtype=np.int64)).reshape(2, -1)
+
+
+class NeighborSampler:
+    """
+    Sample bounded k-hop neighborhoods of seed nodes for mini-batch inference
+
+    Each hop keeps at most ``num_neighbors[k]`` neighbors per frontier node
+    (all of them if fewer, or if the fanout is -1); the returned subgraph
+    holds every edge between the sampled nodes. Node ids are relabelled
+    with the seeds first.
+    """
+
+    def __init__(self, edge_index, num_nodes, num_neighbors=(10, 10, 10), seed=None):
+        src, dst = edge_index.cpu().numpy()
+        order = np.argsort(dst, kind='stable')
+        # CSR over incoming edges: indices[indptr[i]:indptr[i + 1]] send to i
+        self.indices = src[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(dst, minlength=num_nodes))])
+        self.num_neighbors = num_neighbors
+        self.rng = np.random.default_rng(seed)
+
+        self._in_sample = np.zeros(num_nodes, dtype=bool)
+        self._local_id = np.full(num_nodes, -1, dtype=np.int64)
+
+    def _neighbors(self, nodes, fanout):
+        """(target, neighbor) pairs for up to ``fanout`` neighbors per node"""
+        degree = self.indptr[nodes + 1] - self.indptr[nodes]
+        counts = degree if fanout < 0 else np.minimum(degree, fanout)
+        targets = np.repeat(nodes, counts)
+        target_degree = np.repeat(degree, counts)
+        slot = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        if fanout >= 0:
+            sampled = target_degree > fanout
+            slot[sampled] = self.rng.integers(0, target_degree[sampled])
+        return targets, self.indices[self.indptr[targets] + slot]
+
+    def sample(self, seeds):
+        """
+        Returns:
+            (node ids, local edge_index) of the sampled subgraph
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        self._in_sample[seeds] = True
+        hops = [seeds]
+        frontier = seeds
+
+        for fanout in self.num_neighbors:
+            _, neighbors = self._neighbors(frontier, fanout)
+            frontier = np.unique(neighbors[~self._in_sample[neighbors]])
+            self._in_sample[frontier] = True
+            hops.append(frontier)
+
+        nodes = np.concatenate(hops)
+        self._local_id[nodes] = np.arange(len(nodes))
+        targets, sources = self._neighbors(nodes, -1)
+        keep = self._in_sample[sources]
+        edge_index = np.stack([self._local_id[sources[keep]], self._local_id[targets[keep]]])
+
+        self._in_sample[nodes] = False
+        self._local_id[nodes] = -1
+        return nodes, torch.from_numpy(edge_index)
+
+
+class NeighborhoodGraphBuilder:
+    """
+    Build the neighborhood graph, reusing edges while agents don't move
+
+    The radius graph (and its neighbor sampler) is rebuilt only when the
+    agent positions change; otherwise only node features are refreshed.
+    """
+
+    def __init__(self, radius=5.0):
+        self.radius = radius
+        self._positions = None
+        self._edge_index = None
+        self._samplers = {}
+
+    def build(self, agents):
+        from torch_geometric.data import Data
+
+        positions = agent_positions(agents)
+        if self._positions is None or not np.array_equal(positions, self._positions):
+            self._positions = positions
+            self._edge_index = radius_graph_edges(positions, self.radius)
+            self._samplers = {}
+
+        x = torch.from_numpy(agent_features(agents, positions))
+        return Data(x=x, edge_index=self._edge_index)
+
+    def sampler(self, graph, num_neighbors=(10, 10, 10), seed=None):
+        key = (tuple(num_neighbors), seed)
+        if key not in self._samplers:
+            self._samplers[key] = NeighborSampler(graph.edge_index, graph.num_nodes, num_neighbors, seed)
+        return self._samplers[key]
+
+
+_default_builder = NeighborhoodGraphBuilder()
+
+def create_neighborhood_graph(agents, builder=None):
     """
     Create graph representation of neighborhood
     """
-    import torch
-    from torch_geometric.data import Data
-    
-    # Node features: [production, consumption, battery, location_x, location_y]
-    node_features = torch.tensor([
-        [agent.production, agent.consumption, agent.battery, 
-         agent.location[0], agent.location[1]]
-        for agent in agents
-    ], dtype=torch.float)
-    
-    # Edge index: Connect neighbors (within distance threshold)
-    edges = []
-    for i, agent_i in enumerate(agents):
-        for j, agent_j in enumerate(agents):
-            if i != j:
-                distance = calculate_distance(agent_i.location, agent_j.location)
-                if distance < 5:  # Threshold
-                    edges.append([i, j])
-    
-    edge_index = torch.tensor(edges, dtype=torch.long).t().contiguous()
-    
-    return Data(x=node_features, edge_index=edge_index)
+    return (builder or _default_builder).build(agents)
 
-def optimize_energy_flows(agents, gnn_model):
+def sampled_inference(gnn_model, graph, batch_size=4096, num_neighbors=(10, 10, 10),
+                      sampler=None, seed=None):
+    """
+    Run the model over ``graph`` in mini-batches of seed nodes
+
+    Each batch only propagates over its sampled neighborhood, so memory is
+    bounded by the fanout rather than the graph size.
+    """
+    sampler = sampler or NeighborSampler(graph.edge_index, graph.num_nodes, num_neighbors, seed)
+    outputs = None
+
+    with torch.no_grad():
+        for start in range(0, graph.num_nodes, batch_size):
+            seeds = np.arange(start, min(start + batch_size, graph.num_nodes))
+            nodes, edge_index = sampler.sample(seeds)
+            out = gnn_model(graph.x[torch.from_numpy(nodes)], edge_index)[:len(seeds)]
+            if outputs is None:
+                outputs = out.new_empty((graph.num_nodes,) + out.shape[1:])
+            outputs[start:start + len(seeds)] = out
+
+    return outputs
+
+def optimize_energy_flows(agents, gnn_model, batch_size=None, num_neighbors=(10, 10, 10),
+                          builder=None):
     """
     Use GNN to find optimal energy routing
+
+    With ``batch_size`` set and more agents than that, inference runs on
+    neighbor-sampled mini-batches instead of the full graph.
     """
-    graph = create_neighborhood_graph(agents)
-    
+    builder = builder or _default_builder
+    graph = builder.build(agents)
+
+    if batch_size is not None and graph.num_nodes > batch_size:
+        sampler = builder.sampler(graph, num_neighbors)
+        return sampled_inference(gnn_model, graph, batch_size, sampler=sampler)
+
     with torch.no_grad():
         optimal_flows = gnn_model(graph.x, graph.edge_index)
-    
-    return optimal_flows
\ No newline at end of file
+
+    return optimal_flows
@@ -0,0 +1,257 @@
+"""
+Ledger Store
+Segmented append-only on-disk storage for the energy blockchain
+"""
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+
+RECORD_HEADER = struct.Struct('<II')     # payload length, crc32
+INDEX_ENTRY = struct.Struct('<IQI')      # segment, offset, record length
+
+
+class LedgerStore:
+    """
+    Append-only block log split into fixed-size segment files
+
+    Each block is stored as a length + CRC32 framed JSON record. A fixed-width
+    block index maps height -> (segment, offset) and an address index maps
+    each address to the (height, position) of its transactions. Reads go
+    through memory-mapped segments. An append writes the record, then the
+    index entries; on open a torn tail (record or index entry) left by a
+    crash is truncated or re-indexed, so only whole blocks are ever visible.
+    """
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024, fsync=True):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.fsync = fsync
+
+        self._maps = {}
+        self._address_index = None
+
+        self._index_file = open(self.path / 'blocks.idx', 'a+b')
+        self._address_file = open(self.path / 'addresses.idx', 'a+b')
+        self._recover()
+
+    # ------------------------------------------------------------------
+    # Files
+    # ------------------------------------------------------------------
+
+    def _segment_path(self, segment):
+        return self.path / f'segment_{segment:05d}.log'
+
+    def _sync(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _read_index_entry(self, height):
+        self._index_file.seek(height * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(self._index_file.read(INDEX_ENTRY.size))
+
+    def _recover(self):
+        """Drop partial index entries and re-index or truncate the log tail"""
+        index_size = os.path.getsize(self.path / 'blocks.idx')
+        self._height = index_size // INDEX_ENTRY.size
+        if index_size % INDEX_ENTRY.size:
+            self._index_file.truncate(self._height * INDEX_ENTRY.size)
+
+        if self._height:
+            segment, offset, length = self._read_index_entry(self._height - 1)
+            end = offset + length
+        else:
+            segment, end = 0, 0
+
+        # Complete records past the index were written before a crash; the
+        # tail may also have rolled over into the next segment
+        while self._segment_path(segment).exists():
+            with open(self._segment_path(segment), 'r+b') as f:
+                f.seek(end)
+                data = f.read()
+                pos = 0
+                while pos + RECORD_HEADER.size <= len(data):
+                    size, crc = RECORD_HEADER.unpack_from(data, pos)
+                    payload = data[pos + RECORD_HEADER.size:pos + RECORD_HEADER.size + size]
+                    if len(payload) < size or zlib.crc32(payload) != crc:
+                        break
+                    self._write_index_entry(segment, end + pos, RECORD_HEADER.size + size)
+                    pos += RECORD_HEADER.size + size
+                if pos < len(data):
+                    f.truncate(end + pos)
+            end += pos
+            if end == 0 and segment > 0:
+                self._segment_path(segment).unlink()
+                segment -= 1
+                end = self._segment_end_of(segment)
+                break
+            if not self._segment_path(segment + 1).exists():
+                break
+            segment, end = segment + 1, 0
+        self._sync(self._index_file)
+
+        self._segment = segment
+        self._segment_end = end
+
+        self._recover_addresses()
+
+    def _recover_addresses(self):
+        """Re-derive address entries for blocks the address index is missing"""
+        self._address_file.seek(0)
+        lines = self._address_file.read().split(b'\n')
+        complete = lines[:-1]
+
+        # A block's address entries may be only partly written: redo the last one
+        indexed = int(complete[-1].split(b'\t')[1]) if complete else 0
+        keep = [line for line in complete if int(line.split(b'\t')[1]) < indexed]
+        self._address_file.truncate(sum(len(line) + 1 for line in keep))
+
+        for height in range(indexed, self._height):
+            self._write_addresses(height, self.read_block(height))
+        self._sync(self._address_file)
+
+    def _segment_end_of(self, segment):
+        return os.path.getsize(self._segment_path(segment))
+
+    def _write_index_entry(self, segment, offset, length):
+        self._index_file.seek(0, os.SEEK_END)
+        self._index_file.write(INDEX_ENTRY.pack(segment, offset, length))
+        self._height += 1
+
+    def _write_addresses(self, height, block):
+        self._address_file.seek(0, os.SEEK_END)
+        for position, tx in enumerate(block.get('transactions', [])):
+            for address in {tx['from'], tx['to']}:
+                self._address_file.write(f'{address}\t{height}\t{position}\n'.encode())
+                if self._address_index is not None:
+                    self._address_index.setdefault(address, []).append((height, position))
+
+    def _map(self, segment, end):
+        """Memory map a segment, remapping when it has grown past the map"""
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < end:
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return mapped
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def __len__(self):
+        return self._height
+
+    def append(self, block):
+        """
+        Durably append a block dict and return its height
+        """
+        payload = json.dumps(block, sort_keys=True).encode()
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        if self._segment_end and self._segment_end + len(record) > self.segment_size:
+            self._segment += 1
+            self._segment_end = 0
+
+        with open(self._segment_path(self._segment), 'ab') as f:
+            f.write(record)
+            self._sync(f)
+
+        height = self._height
+        self._write_index_entry(self._segment, self._segment_end, len(record))
+        self._sync(self._index_file)
+        self._segment_end += len(record)
+
+        self._write_addresses(height, block)
+        self._sync(self._address_file)
+        return height
+
+    def read_block(self, height):
+        """
+        Read the block dict stored at ``height``
+        """
+        if height < 0:
+            height += self._height
+        if not 0 <= height < self._height:
+            raise IndexError(f"Block height out of range: {height}")
+
+        segment, offset, length = self._read_index_entry(height)
+        mapped = self._map(segment, offset + length)
+        size, crc = RECORD_HEADER.unpack_from(mapped, offset)
+        payload = mapped[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + size]
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"Corrupt ledger record at height {height}")
+        return json.loads(payload)
+
+    def transaction_locations(self, address):
+        """
+        (height, position) of every transaction involving ``address``
+
+        The address index is loaded from disk on first use.
+        """
+        if self._address_index is None:
+            self._address_index = {}
+            self._address_file.seek(0)
+            for line in self._address_file.read().splitlines():
+                addr, height, position = line.decode().split('\t')
+                self._address_index.setdefault(addr, []).append((int(height), int(position)))
+        return list(self._address_index.get(address, []))
+
+    def transactions_for(self, address):
+        """
+        All transactions involving ``address``, in chain order
+        """
+        transactions = []
+        block, block_height = None, None
+        for height, position in self.transaction_locations(address):
+            if height != block_height:
+                block, block_height = self.read_block(height), height
+            transactions.append(block['transactions'][position])
+        return transactions
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+        self._index_file.close()
+        self._address_file.close()
+
+
+class PersistentChain:
+    """
+    List-like view of the blocks in a LedgerStore
+
+    Only the tip block is kept in memory; other blocks are decoded from the
+    store on access.
+    """
+
+    def __init__(self, store, block_cls):
+        self.store = store
+        self.block_cls = block_cls
+        self._tip = block_cls.from_dict(store.read_block(-1)) if len(store) else None
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item in (-1, len(self) - 1) and self._tip is not None:
+            return self._tip
+        return self.block_cls.from_dict(self.store.read_block(item))
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def append(self, block):
+        self.store.append(block.to_dict())
+        self._tip = block
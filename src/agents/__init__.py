@@ -3,20 +3,27 @@ Agents Package
 Multi-agent reinforcement learning components
 """
 
+from importlib.util import find_spec
+
 from .base_agent import SolarPanelAgent, SwarmSimulator
 
-# Optional RL agent imports (only if ML libraries are available)
-try:
-    from .rl_agent import SolarSwarmEnv, train_rl_agents
-    __all__ = [
-        'SolarPanelAgent',
-        'SwarmSimulator',
+__all__ = [
+    'SolarPanelAgent',
+    'SwarmSimulator'
+]
+
+# Optional RL agent exports (only if ML libraries are available)
+if all(find_spec(name) is not None for name in ('torch', 'stable_baselines3', 'gym')):
+    __all__ += [
         'SolarSwarmEnv',
         'train_rl_agents'
     ]
-except ImportError:
-    # RL libraries not available, but base agents still work
-    __all__ = [
-        'SolarPanelAgent',
-        'SwarmSimulator'
-    ]
+
+
+def __getattr__(name):
+    # RL components pull in torch / stable_baselines3 / gym, so they are
+    # imported on first access (raises ImportError if those are missing)
+    if name in ('SolarSwarmEnv', 'train_rl_agents'):
+        from . import rl_agent
+        return getattr(rl_agent, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
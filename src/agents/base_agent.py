@@ -1,5 +1,11 @@
+import time
 import numpy as np
 
+from ..utils.instrumentation import DECISION_SECONDS, SIMULATION_STEP_SECONDS
+from ..utils.profiling import span, traced
+
+_SWARM_DECISION_SECONDS = DECISION_SECONDS.labels('swarm')
+
 class SolarPanelAgent:
     """
     Basic solar panel agent with rule-based decision making
@@ -67,8 +73,9 @@ class SolarPanelAgent:
         elif excess > 2:  # Threshold: 2 kWh minimum to share
             # Check if any neighbor needs energy
             for neighbor in self.neighbors:
-                if neighbor.calculate_needs() > 0:
-                    share_amount = min(excess, neighbor.calculate_needs())
+                neighbor_needs = neighbor.calculate_needs()
+                if neighbor_needs > 0:
+                    share_amount = min(excess, neighbor_needs)
                     return {
                         'action': 'share_energy',
                         'target': neighbor.id,
@@ -114,7 +121,13 @@ class SwarmSimulator:
     Simulate community of solar panel agents
     """
     
-    def __init__(self, num_agents=10, use_rl=False, rl_model_path=None):
+    def __init__(self, num_agents=10, use_rl=False, rl_model_path=None, dispatch=False):
+        """
+        Args:
+            dispatch: Route shared energy with the community-wide least-cost
+                EnergyDispatcher instead of each agent's greedy choice (only
+                the flows are used; batteries follow the agents' own rules)
+        """
         # Create agents (with optional RL support)
         if use_rl and rl_model_path:
             from .rl_hybrid_agent import HybridRLAgent
@@ -123,6 +136,11 @@ class SwarmSimulator:
             self.agents = [SolarPanelAgent(i) for i in range(num_agents)]
         self.connect_neighbors()
         self.time_step = 0
+        self.dispatcher = None
+        self.last_dispatch = None
+        if dispatch:
+            from ..simulation.dispatch import EnergyDispatcher
+            self.dispatcher = EnergyDispatcher()
         self.results = {
             'solar_used': [],
             'grid_import': [],
@@ -164,49 +182,66 @@ class SwarmSimulator:
         else:
             return np.random.uniform(0.5, 1)
     
+    @traced('swarm.timestep')
     def run_timestep(self, hour):
         """
         Run one simulation timestep
         """
+        start = time.perf_counter()
+        
         # Update all agents with current production/consumption
-        for agent in self.agents:
-            production = self.simulate_production(hour)
-            consumption = self.simulate_consumption(hour)
-            agent.update_state(production, consumption)
+        with span('swarm.update_state'):
+            for agent in self.agents:
+                production = self.simulate_production(hour)
+                consumption = self.simulate_consumption(hour)
+                agent.update_state(production, consumption)
         
         # Agents communicate
-        messages = []
-        for agent in self.agents:
-            msg = agent.communicate()
-            messages.append(msg)
+        with span('swarm.communicate'):
+            messages = []
+            for agent in self.agents:
+                msg = agent.communicate()
+                messages.append(msg)
         
         # Broadcast messages
-        for agent in self.agents:
-            for msg in messages:
-                if msg['from'] != agent.id:
-                    agent.receive_message(msg)
+        with span('swarm.broadcast'):
+            for agent in self.agents:
+                for msg in messages:
+                    if msg['from'] != agent.id:
+                        agent.receive_message(msg)
         
         # Agents make decisions
         total_shared = 0
         total_solar = 0
         total_grid = 0
         
-        for agent in self.agents:
-            decision = agent.make_decision()
-            
-            if decision['action'] == 'share_energy':
-                total_shared += decision['amount']
-            
-            total_solar += min(agent.production, agent.consumption)
-            
-            if agent.consumption > agent.production:
-                total_grid += agent.consumption - agent.production
+        decide_start = time.perf_counter()
+        with span('swarm.decide'):
+            for agent in self.agents:
+                decision = agent.make_decision()
+                
+                if decision['action'] == 'share_energy':
+                    total_shared += decision['amount']
+                
+                total_solar += min(agent.production, agent.consumption)
+                
+                if agent.consumption > agent.production:
+                    total_grid += agent.consumption - agent.production
+        
+        # Optional community-wide dispatch replaces the greedy shares
+        if self.dispatcher is not None:
+            with span('swarm.dispatch'):
+                self.last_dispatch = self.dispatcher.dispatch_agents(self.agents)
+            total_shared = self.last_dispatch.total_shared
+        _SWARM_DECISION_SECONDS.observe(time.perf_counter() - decide_start)
         
         # Record results
         self.results['shared_energy'].append(total_shared)
         self.results['solar_used'].append(total_solar)
         self.results['grid_import'].append(total_grid)
+        SIMULATION_STEP_SECONDS.observe(time.perf_counter() - start)
     
+    @traced('swarm.step')
     def step(self, hour):
         """
         Run one simulation timestep and return state for real-time updates
@@ -215,42 +250,47 @@ class SwarmSimulator:
         self.time_step += 1
         
         # Track energy flows
-        energy_flows = []
-        agent_decisions = []
-        
-        for agent in self.agents:
-            decision = agent.make_decision()
-            agent_decisions.append({
-                'agent_id': agent.id,
-                'action': decision.get('action'),
-                'amount': decision.get('amount', 0),
-                'target': decision.get('target')
-            })
+        with span('swarm.flows'):
+            energy_flows = []
+            agent_decisions = []
             
-            if decision.get('action') == 'share_energy':
-                energy_flows.append({
-                    'from': agent.id,
-                    'to': decision.get('target'),
-                    'amount': decision.get('amount', 0)
+            for agent in self.agents:
+                decision = agent.make_decision()
+                agent_decisions.append({
+                    'agent_id': agent.id,
+                    'action': decision.get('action'),
+                    'amount': decision.get('amount', 0),
+                    'target': decision.get('target')
                 })
+            
+                if decision.get('action') == 'share_energy' and self.last_dispatch is None:
+                    energy_flows.append({
+                        'from': agent.id,
+                        'to': decision.get('target'),
+                        'amount': decision.get('amount', 0)
+                    })
+            
+            if self.last_dispatch is not None:
+                energy_flows = self.last_dispatch.flows
         
         # Calculate metrics for this step
-        total_production = sum(a.production for a in self.agents)
-        total_consumption = sum(a.consumption for a in self.agents)
-        total_solar_used = sum(min(a.production, a.consumption) for a in self.agents)
-        total_grid_import = sum(max(0, a.consumption - a.production) for a in self.agents)
-        total_shared = sum(f['amount'] for f in energy_flows)
-        avg_battery = sum(a.battery_level / a.battery_capacity for a in self.agents) / len(self.agents) * 100 if self.agents else 0
-        
-        # Calculate AI performance metrics
-        decision_types = {}
-        for decision in agent_decisions:
-            action = decision.get('action', 'unknown')
-            decision_types[action] = decision_types.get(action, 0) + 1
-        
-        # Calculate decision efficiency (how many successful shares vs requests)
-        successful_shares = len([d for d in agent_decisions if d.get('action') == 'share_energy' and d.get('amount', 0) > 0])
-        total_decisions = len(agent_decisions) or 1
+        with span('swarm.metrics'):
+            total_production = sum(a.production for a in self.agents)
+            total_consumption = sum(a.consumption for a in self.agents)
+            total_solar_used = sum(min(a.production, a.consumption) for a in self.agents)
+            total_grid_import = sum(max(0, a.consumption - a.production) for a in self.agents)
+            total_shared = sum(f['amount'] for f in energy_flows)
+            avg_battery = sum(a.battery_level / a.battery_capacity for a in self.agents) / len(self.agents) * 100 if self.agents else 0
+            
+            # Calculate AI performance metrics
+            decision_types = {}
+            for decision in agent_decisions:
+                action = decision.get('action', 'unknown')
+                decision_types[action] = decision_types.get(action, 0) + 1
+            
+            # Calculate decision efficiency (how many successful shares vs requests)
+            successful_shares = len([d for d in agent_decisions if d.get('action') == 'share_energy' and d.get('amount', 0) > 0])
+            total_decisions = len(agent_decisions) or 1
         
         return {
             'hour': hour,
@@ -3,9 +3,12 @@ Agent Communication Module
 Handles message passing and coordination between agents
 """
 
+import heapq
+import json
 import numpy as np
-from typing import List, Dict, Any
-from dataclasses import dataclass
+from collections import defaultdict, deque
+from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, asdict
 from datetime import datetime
 
 
@@ -23,17 +26,63 @@ class Message:
 class CommunicationProtocol:
     """
     Manages communication between agents in the swarm
+    
+    Direct messages go into one heap per receiver, ordered by priority and
+    then send order. Broadcasts are stored once and each agent keeps a read
+    cursor into them, so polling costs O(messages delivered) rather than a
+    scan of every queued message. History is bounded; overflow is dropped or
+    appended to ``history_path`` as JSON lines.
     """
     
-    def __init__(self):
-        self.message_queue = []
-        self.message_history = []
-        self.broadcast_messages = []
+    def __init__(self, history_size: int = 10000, history_path: Optional[str] = None):
+        self.history_size = history_size
+        self.history_path = history_path
+        self.message_history = deque()
+        
+        self._seq = 0
+        self._mailboxes = defaultdict(list)  # receiver_id -> heap of (-priority, seq, message)
+        self._direct_by_age = deque()  # (timestamp, seq) of unread direct messages, send order
+        self._unread = set()
+        
+        self._broadcasts = []  # live broadcasts, oldest first
+        self._broadcast_head = 0  # index of the oldest live broadcast in _broadcasts
+        self._broadcast_offset = 0  # global broadcast number of _broadcasts[0]
+        self._cursors = defaultdict(int)  # agent_id -> next global broadcast number to read
     
-    def send_message(self, message: Message):
-        """Send a message to the queue"""
-        self.message_queue.append(message)
+    @property
+    def message_queue(self) -> List[Message]:
+        """Unread direct messages (for inspection)"""
+        return [
+            entry[2] for box in self._mailboxes.values()
+            for entry in box if entry[1] in self._unread
+        ]
+    
+    @property
+    def broadcast_messages(self) -> List[Message]:
+        """Live broadcast messages, oldest first"""
+        return self._broadcasts[self._broadcast_head:]
+    
+    def _record(self, message: Message):
         self.message_history.append(message)
+        if len(self.message_history) > self.history_size:
+            # Spill in chunks so the history file is written in batches
+            spill_count = max(1, self.history_size // 10)
+            spilled = [self.message_history.popleft() for _ in range(min(spill_count, len(self.message_history)))]
+            if self.history_path:
+                with open(self.history_path, 'a') as f:
+                    f.writelines(json.dumps(asdict(msg), default=str) + "\n" for msg in spilled)
+    
+    def send_message(self, message: Message):
+        """Send a message to the receiver's mailbox"""
+        # Drop age-tracking entries of messages that were already read
+        while self._direct_by_age and self._direct_by_age[0][1] not in self._unread:
+            self._direct_by_age.popleft()
+        
+        self._seq += 1
+        heapq.heappush(self._mailboxes[message.receiver_id], (-message.priority, self._seq, message))
+        self._direct_by_age.append((message.timestamp, self._seq))
+        self._unread.add(self._seq)
+        self._record(message)
     
     def broadcast(self, sender_id: int, message_type: str, content: Dict[str, Any]):
         """Broadcast message to all agents"""
@@ -44,58 +93,289 @@ class CommunicationProtocol:
             content=content,
             timestamp=datetime.now().timestamp()
         )
-        self.broadcast_messages.append(broadcast_msg)
-        self.message_history.append(broadcast_msg)
+        self._broadcasts.append(broadcast_msg)
+        self._record(broadcast_msg)
     
     def get_messages_for_agent(self, agent_id: int) -> List[Message]:
-        """Retrieve all messages for a specific agent"""
-        messages = []
+        """
+        Retrieve new messages for a specific agent
         
-        # Direct messages
-        for msg in self.message_queue:
-            if msg.receiver_id == agent_id:
-                messages.append(msg)
+        Direct messages are consumed; each broadcast is delivered once per
+        agent (never to its sender).
+        """
+        messages = []
         
-        # Broadcast messages
-        for msg in self.broadcast_messages:
-            if msg.sender_id != agent_id:  # Don't send own broadcasts back
-                messages.append(msg)
+        # Direct messages, already in priority order
+        mailbox = self._mailboxes.pop(agent_id, None)
+        if mailbox:
+            while mailbox:
+                _, seq, msg = heapq.heappop(mailbox)
+                if seq in self._unread:
+                    self._unread.discard(seq)
+                    messages.append(msg)
         
-        # Clear processed messages
-        self.message_queue = [m for m in self.message_queue if m.receiver_id != agent_id]
+        # Broadcasts since this agent's cursor
+        first_live = self._broadcast_offset + self._broadcast_head
+        start = max(self._cursors[agent_id], first_live) - self._broadcast_offset
+        new_broadcasts = [
+            msg for msg in self._broadcasts[start:]
+            if msg.sender_id != agent_id  # Don't send own broadcasts back
+        ]
+        self._cursors[agent_id] = self._broadcast_offset + len(self._broadcasts)
         
-        return sorted(messages, key=lambda x: x.priority, reverse=True)
+        if not new_broadcasts:
+            return messages
+        return sorted(messages + new_broadcasts, key=lambda x: x.priority, reverse=True)
     
     def clear_old_broadcasts(self, max_age_seconds: float = 60):
         """Remove old broadcast messages"""
-        current_time = datetime.now().timestamp()
-        self.broadcast_messages = [
-            msg for msg in self.broadcast_messages
-            if current_time - msg.timestamp < max_age_seconds
-        ]
+        cutoff = datetime.now().timestamp() - max_age_seconds
+        broadcasts = self._broadcasts
+        head = self._broadcast_head
+        while head < len(broadcasts) and broadcasts[head].timestamp <= cutoff:
+            head += 1
+        self._broadcast_head = head
+        
+        # Compact once most of the list is expired
+        if head > 1024 and head * 2 > len(broadcasts):
+            del broadcasts[:head]
+            self._broadcast_offset += head
+            self._broadcast_head = 0
+    
+    def clear_expired(self, max_age_seconds: float = 60):
+        """
+        Expire old direct messages and broadcasts
+        
+        Only messages older than the cutoff are visited: direct messages are
+        tracked in send order and expired lazily in the mailboxes.
+        """
+        cutoff = datetime.now().timestamp() - max_age_seconds
+        while self._direct_by_age and self._direct_by_age[0][0] <= cutoff:
+            _, seq = self._direct_by_age.popleft()
+            self._unread.discard(seq)
+        self.clear_old_broadcasts(max_age_seconds)
+
+
+@dataclass
+class Order:
+    """Limit order in the energy order book"""
+    order_id: str
+    agent_id: int
+    side: str  # 'bid' or 'ask'
+    price_per_kwh: float
+    energy_kwh: float
+    timestamp: float
+
+
+class OrderBook:
+    """
+    Limit order book with price-sorted bids and asks
+    
+    Each side is a heap ordered by price, then arrival. Insert is O(log n);
+    cancel and fill remove the order from the live index immediately and
+    drop its heap entry lazily when it reaches the top.
+    """
+    
+    def __init__(self):
+        self.orders: Dict[str, Order] = {}
+        self._bids = []  # (-price, seq, order_id)
+        self._asks = []  # (price, seq, order_id)
+        self._seq = 0
+        self._stale = 0
+    
+    def add(self, order: Order) -> str:
+        """Insert an order"""
+        self._seq += 1
+        if order.side == 'bid':
+            heapq.heappush(self._bids, (-order.price_per_kwh, self._seq, order.order_id))
+        elif order.side == 'ask':
+            heapq.heappush(self._asks, (order.price_per_kwh, self._seq, order.order_id))
+        else:
+            raise ValueError(f"Unknown order side: {order.side}")
+        self.orders[order.order_id] = order
+        return order.order_id
+    
+    def cancel(self, order_id: str) -> bool:
+        """Remove an order; returns False if it is not live"""
+        if self.orders.pop(order_id, None) is None:
+            return False
+        self._stale += 1
+        if self._stale > len(self.orders) + 64:
+            self._compact()
+        return True
+    
+    def fill(self, order_id: str, amount_kwh: float):
+        """Reduce an order by a filled amount, removing it once exhausted"""
+        order = self.orders[order_id]
+        order.energy_kwh -= amount_kwh
+        if order.energy_kwh <= 1e-9:
+            self.cancel(order_id)
+    
+    def _compact(self):
+        """Rebuild both heaps without cancelled entries"""
+        self._bids = [e for e in self._bids if e[2] in self.orders]
+        self._asks = [e for e in self._asks if e[2] in self.orders]
+        heapq.heapify(self._bids)
+        heapq.heapify(self._asks)
+        self._stale = 0
+    
+    def _peek(self, heap) -> Optional[Order]:
+        while heap and heap[0][2] not in self.orders:
+            heapq.heappop(heap)
+            self._stale = max(0, self._stale - 1)
+        return self.orders[heap[0][2]] if heap else None
+    
+    def best_bid(self) -> Optional[Order]:
+        return self._peek(self._bids)
+    
+    def best_ask(self) -> Optional[Order]:
+        return self._peek(self._asks)
+    
+    def asks(self, max_price: float = None) -> List[Order]:
+        """
+        Live asks in price order, up to ``max_price``
+        
+        Walks the heap from the root with a frontier heap instead of
+        sorting it, so only asks at or below ``max_price`` are visited.
+        """
+        heap = self._asks
+        asks = []
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier:
+            entry, i = heapq.heappop(frontier)
+            if max_price is not None and entry[0] > max_price:
+                break
+            order = self.orders.get(entry[2])
+            if order is not None:
+                asks.append(order)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return asks
+    
+    def clear(self) -> List[Dict]:
+        """
+        Run one double-auction clearing round
+        
+        Highest bids are matched against lowest asks while they cross; only
+        the crossing orders are visited. An agent's bid never matches its
+        own ask: those asks are skipped for that bid and stay in the book.
+        All matches settle at one uniform price, the midpoint of the highest
+        matched ask and the lowest matched bid. When skipped asks later fill
+        a cheaper bid that range can be empty; each match then settles at
+        the midpoint of its own bid and ask.
+        """
+        matches = []
+        held = []  # heap entries of asks skipped as self-trades for the current bid
+        bid, ask = self.best_bid(), self.best_ask()
+        
+        while bid is not None and ask is not None and bid.price_per_kwh >= ask.price_per_kwh:
+            if bid.agent_id == ask.agent_id:
+                held.append(heapq.heappop(self._asks))
+                ask = self.best_ask()
+                continue
+            amount = min(bid.energy_kwh, ask.energy_kwh)
+            matches.append((bid, ask, amount))
+            self.fill(bid.order_id, amount)
+            self.fill(ask.order_id, amount)
+            if bid.order_id not in self.orders:
+                # Skipped asks may match the next bidder
+                for entry in held:
+                    heapq.heappush(self._asks, entry)
+                held = []
+            bid, ask = self.best_bid(), self.best_ask()
+        
+        for entry in held:
+            heapq.heappush(self._asks, entry)
+        
+        if not matches:
+            return []
+        
+        highest_ask = max(ask.price_per_kwh for _, ask, _ in matches)
+        lowest_bid = min(bid.price_per_kwh for bid, _, _ in matches)
+        uniform = (highest_ask + lowest_bid) / 2 if highest_ask <= lowest_bid else None
+        timestamp = datetime.now().timestamp()
+        trades = []
+        for bid, ask, amount in matches:
+            price = uniform if uniform is not None else (bid.price_per_kwh + ask.price_per_kwh) / 2
+            trades.append({
+                'seller_id': ask.agent_id,
+                'buyer_id': bid.agent_id,
+                'offer_id': ask.order_id,
+                'bid_id': bid.order_id,
+                'energy_kwh': amount,
+                'price_per_kwh': price,
+                'total_cost': amount * price,
+                'timestamp': timestamp
+            })
+        return trades
+    
+    def __len__(self):
+        return len(self.orders)
 
 
 class EnergyNegotiator:
     """
     Handles energy trading negotiations between agents
+    
+    Offers (asks) and bids rest in an OrderBook. Single trades can still be
+    made with accept_offer(); clear_market() matches all crossing buyers
+    and sellers in one pass. Filled orders are removed from the book and
+    from ``active_offers``.
     """
     
     def __init__(self):
         self.active_offers = {}
+        self.active_bids = {}
         self.completed_trades = []
+        self.book = OrderBook()
+        self._order_seq = 0
+    
+    def _new_order_id(self, agent_id: int) -> str:
+        self._order_seq += 1
+        return f"{agent_id}_{datetime.now().timestamp()}_{self._order_seq}"
     
     def create_offer(self, seller_id: int, energy_kwh: float, price_per_kwh: float):
         """Create an energy offer"""
-        offer_id = f"{seller_id}_{datetime.now().timestamp()}"
+        offer_id = self._new_order_id(seller_id)
+        timestamp = datetime.now().timestamp()
         self.active_offers[offer_id] = {
             'seller_id': seller_id,
             'energy_kwh': energy_kwh,
             'price_per_kwh': price_per_kwh,
             'status': 'open',
-            'timestamp': datetime.now().timestamp()
+            'timestamp': timestamp
         }
+        self.book.add(Order(offer_id, seller_id, 'ask', price_per_kwh, energy_kwh, timestamp))
         return offer_id
     
+    def create_bid(self, buyer_id: int, energy_kwh: float, max_price_per_kwh: float):
+        """Create a bid to buy energy at up to max_price_per_kwh"""
+        bid_id = self._new_order_id(buyer_id)
+        timestamp = datetime.now().timestamp()
+        self.active_bids[bid_id] = {
+            'buyer_id': buyer_id,
+            'energy_kwh': energy_kwh,
+            'price_per_kwh': max_price_per_kwh,
+            'status': 'open',
+            'timestamp': timestamp
+        }
+        self.book.add(Order(bid_id, buyer_id, 'bid', max_price_per_kwh, energy_kwh, timestamp))
+        return bid_id
+    
+    def cancel_order(self, order_id: str) -> bool:
+        """Cancel an open offer or bid"""
+        self.active_offers.pop(order_id, None)
+        self.active_bids.pop(order_id, None)
+        return self.book.cancel(order_id)
+    
+    def _apply_fill(self, orders: Dict, order_id: str, amount_kwh: float):
+        entry = orders[order_id]
+        entry['energy_kwh'] -= amount_kwh
+        if entry['energy_kwh'] <= 1e-9:
+            entry['status'] = 'completed'
+            del orders[order_id]
+    
     def accept_offer(self, offer_id: str, buyer_id: int, amount_kwh: float):
         """Accept an energy offer"""
         if offer_id not in self.active_offers:
@@ -103,7 +383,7 @@ class EnergyNegotiator:
         
         offer = self.active_offers[offer_id]
         
-        if offer['status'] != 'open':
+        if offer['status'] != 'open' or offer['seller_id'] == buyer_id:
             return False
         
         if amount_kwh > offer['energy_kwh']:
@@ -121,23 +401,29 @@ class EnergyNegotiator:
         self.completed_trades.append(trade)
         
         # Update offer
-        offer['energy_kwh'] -= amount_kwh
-        if offer['energy_kwh'] <= 0:
-            offer['status'] = 'completed'
+        self.book.fill(offer_id, amount_kwh)
+        self._apply_fill(self.active_offers, offer_id, amount_kwh)
         
         return True
     
+    def clear_market(self) -> List[Dict]:
+        """Match all crossing bids and offers in one clearing round"""
+        trades = self.book.clear()
+        for trade in trades:
+            self._apply_fill(self.active_offers, trade['offer_id'], trade['energy_kwh'])
+            self._apply_fill(self.active_bids, trade['bid_id'], trade['energy_kwh'])
+        self.completed_trades.extend(trades)
+        return trades
+    
     def get_available_offers(self, max_price: float = None) -> List[Dict]:
-        """Get all available energy offers"""
-        offers = []
-        for offer_id, offer in self.active_offers.items():
-            if offer['status'] == 'open':
-                if max_price is None or offer['price_per_kwh'] <= max_price:
-                    offers.append({
-                        'offer_id': offer_id,
-                        **offer
-                    })
-        return offers
+        """Get open energy offers, cheapest first"""
+        return [
+            {
+                'offer_id': order.order_id,
+                **self.active_offers[order.order_id]
+            }
+            for order in self.book.asks(max_price)
+        ]
 
 
 class ConsensusProtocol:
@@ -8,7 +8,9 @@ import torch.nn as nn
 import torch.optim as optim
 import numpy as np
 from collections import deque
+from pathlib import Path
 import random
+import json
 
 
 class DQNNetwork(nn.Module):
@@ -55,6 +57,210 @@ class ReplayBuffer:
         return len(self.buffer)
 
 
+class RingReplayBuffer:
+    """
+    Experience replay buffer backed by preallocated NumPy arrays
+    
+    Each field lives in one contiguous array; the oldest transition is
+    overwritten once the buffer is full. Sampling gathers a batch with a
+    single integer index array per field.
+    """
+    
+    FIELDS = ('states', 'actions', 'rewards', 'next_states', 'dones')
+    
+    def __init__(self, capacity, state_size):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.ptr = 0
+        self.size = 0
+        
+        self.states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
+    
+    def push(self, state, action, reward, next_state, done):
+        idx = self.ptr
+        self.states[idx] = state
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        self.next_states[idx] = next_state
+        self.dones[idx] = done
+        
+        self.ptr = (self.ptr + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return idx
+    
+    def _gather(self, idx):
+        return (
+            self.states[idx],
+            self.actions[idx],
+            self.rewards[idx],
+            self.next_states[idx],
+            self.dones[idx]
+        )
+    
+    def sample(self, batch_size):
+        idx = np.random.randint(0, self.size, size=batch_size)
+        return self._gather(idx)
+    
+    def _arrays(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    def _meta(self):
+        return {
+            'type': type(self).__name__,
+            'capacity': self.capacity,
+            'state_size': self.state_size,
+            'ptr': self.ptr,
+            'size': self.size
+        }
+    
+    def save(self, directory):
+        """Write a snapshot as one .npy file per field plus a metadata file"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, array in self._arrays().items():
+            np.save(directory / f"{name}.npy", array)
+        with open(directory / "meta.json", 'w') as f:
+            json.dump(self._meta(), f)
+    
+    def _restore(self, directory, meta, mmap_mode):
+        for name in self._arrays():
+            setattr(self, name, np.load(directory / f"{name}.npy", mmap_mode=mmap_mode))
+        self.ptr = meta['ptr']
+        self.size = meta['size']
+    
+    @classmethod
+    def load(cls, directory, mmap_mode='r+', **kwargs):
+        """
+        Load a snapshot written by save()
+        
+        Arrays are memory-mapped ('r+' writes new transitions back to the
+        snapshot, 'c' keeps them in memory); pass mmap_mode=None to copy
+        everything into RAM.
+        """
+        directory = Path(directory)
+        with open(directory / "meta.json") as f:
+            meta = json.load(f)
+        buffer = cls.__new__(cls)
+        cls.__init__(buffer, 0, meta['state_size'], **kwargs)
+        buffer.capacity = meta['capacity']
+        buffer._restore(directory, meta, mmap_mode)
+        return buffer
+    
+    def __len__(self):
+        return self.size
+
+
+class SumTree:
+    """
+    Binary sum tree over leaf priorities
+    
+    Leaves sit at [tree_capacity, 2 * tree_capacity) of a flat array, with
+    tree_capacity rounded up to a power of two so every leaf has the same
+    depth. Updates and prefix-sum lookups are O(log n) and vectorized over
+    batches of indices.
+    """
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tree_capacity = 1
+        while self.tree_capacity < capacity:
+            self.tree_capacity *= 2
+        self.depth = self.tree_capacity.bit_length() - 1
+        self.tree = np.zeros(2 * self.tree_capacity, dtype=np.float64)
+    
+    def total(self):
+        return self.tree[1]
+    
+    def get(self, idx):
+        return self.tree[np.asarray(idx) + self.tree_capacity]
+    
+    def update(self, idx, priorities):
+        nodes = np.asarray(idx, dtype=np.int64) + self.tree_capacity
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+    
+    def find(self, values):
+        """Return leaf indices whose cumulative priority range contains each value"""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = values > left_sum
+            values = np.where(go_right, values - left_sum, values)
+            nodes = np.where(go_right, left + 1, left)
+        return np.minimum(nodes - self.tree_capacity, self.capacity - 1)
+
+
+class PrioritizedReplayBuffer(RingReplayBuffer):
+    """
+    Proportional prioritized experience replay (Schaul et al., 2016)
+    
+    New transitions get the current maximum priority. sample() also returns
+    importance-sampling weights and the sampled indices so priorities can be
+    refreshed from TD errors with update_priorities().
+    """
+    
+    def __init__(self, capacity, state_size, alpha=0.6, beta=0.4, eps=1e-6):
+        super().__init__(capacity, state_size)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.max_priority = 1.0
+        self.tree = SumTree(max(1, capacity))
+    
+    def push(self, state, action, reward, next_state, done):
+        idx = super().push(state, action, reward, next_state, done)
+        self.tree.update([idx], self.max_priority ** self.alpha)
+        return idx
+    
+    def sample(self, batch_size, beta=None):
+        beta = self.beta if beta is None else beta
+        total = self.tree.total()
+        
+        # Stratified sampling: one draw per equal-mass segment
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * segment
+        idx = np.minimum(self.tree.find(values), self.size - 1)
+        
+        probs = self.tree.get(idx) / total
+        weights = (self.size * probs) ** (-beta)
+        weights = (weights / weights.max()).astype(np.float32)
+        
+        return self._gather(idx) + (weights, idx)
+    
+    def update_priorities(self, idx, td_errors):
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.eps
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(idx, priorities ** self.alpha)
+    
+    def _arrays(self):
+        arrays = super()._arrays()
+        arrays['priorities'] = self.tree.tree
+        return arrays
+    
+    def _meta(self):
+        meta = super()._meta()
+        meta.update(alpha=self.alpha, beta=self.beta, eps=self.eps, max_priority=self.max_priority)
+        return meta
+    
+    def _restore(self, directory, meta, mmap_mode):
+        super()._restore(directory, meta, mmap_mode)
+        self.tree = SumTree(meta['capacity'])
+        self.tree.tree = self.priorities
+        del self.priorities
+        self.alpha = meta['alpha']
+        self.beta = meta['beta']
+        self.eps = meta['eps']
+        self.max_priority = meta['max_priority']
+
+
 class DQNAgent:
     """
     DQN Agent for solar panel optimization
@@ -70,7 +276,10 @@ class DQNAgent:
         epsilon_decay=0.995,
         epsilon_min=0.01,
         buffer_size=10000,
-        batch_size=64
+        batch_size=64,
+        prioritized_replay=False,
+        per_alpha=0.6,
+        per_beta=0.4
     ):
         self.state_size = state_size
         self.action_size = action_size
@@ -89,7 +298,11 @@ class DQNAgent:
         self.criterion = nn.MSELoss()
         
         # Replay buffer
-        self.memory = ReplayBuffer(buffer_size)
+        self.prioritized_replay = prioritized_replay
+        if prioritized_replay:
+            self.memory = PrioritizedReplayBuffer(buffer_size, state_size, alpha=per_alpha, beta=per_beta)
+        else:
+            self.memory = RingReplayBuffer(buffer_size, state_size)
         
         self.steps = 0
     
@@ -113,14 +326,15 @@ class DQNAgent:
             return 0
         
         # Sample batch
-        states, actions, rewards, next_states, dones = self.memory.sample(self.batch_size)
+        batch = self.memory.sample(self.batch_size)
+        states, actions, rewards, next_states, dones = batch[:5]
         
         # Convert to tensors
-        states = torch.FloatTensor(states)
-        actions = torch.LongTensor(actions)
-        rewards = torch.FloatTensor(rewards)
-        next_states = torch.FloatTensor(next_states)
-        dones = torch.FloatTensor(dones)
+        states = torch.from_numpy(states)
+        actions = torch.from_numpy(actions)
+        rewards = torch.from_numpy(rewards)
+        next_states = torch.from_numpy(next_states)
+        dones = torch.from_numpy(dones)
         
         # Current Q values
         current_q_values = self.q_network(states).gather(1, actions.unsqueeze(1))
@@ -131,7 +345,14 @@ class DQNAgent:
             target_q_values = rewards + (1 - dones) * self.gamma * next_q_values
         
         # Compute loss
-        loss = self.criterion(current_q_values.squeeze(), target_q_values)
+        current_q_values = current_q_values.squeeze(1)
+        if self.prioritized_replay:
+            weights, indices = batch[5:]
+            td_errors = target_q_values - current_q_values
+            loss = (torch.from_numpy(weights) * td_errors.pow(2)).mean()
+            self.memory.update_priorities(indices, td_errors.detach().numpy())
+        else:
+            loss = self.criterion(current_q_values, target_q_values)
         
         # Optimize
         self.optimizer.zero_grad()
@@ -6,8 +6,11 @@ Gym-compatible environment for multi-agent reinforcement learning
 import gym
 from gym import spaces
 import numpy as np
+from scipy import sparse
 from typing import List, Dict, Tuple
 
+from ..utils.profiling import span, traced
+
 
 class MultiAgentSolarEnv(gym.Env):
     """
@@ -145,6 +148,7 @@ class MultiAgentSolarEnv(gym.Env):
             return np.random.uniform(1, 2)
         return np.random.uniform(0.5, 1)
     
+    @traced('marl.step')
     def step(self, actions):
         """
         Execute one step with actions from all agents
@@ -159,59 +163,62 @@ class MultiAgentSolarEnv(gym.Env):
         rewards = []
         
         # Update production and consumption
-        for state in self.agent_states:
-            state['production'] = self._simulate_production(hour)
-            state['consumption'] = self._simulate_consumption(hour)
+        with span('marl.update_state'):
+            for state in self.agent_states:
+                state['production'] = self._simulate_production(hour)
+                state['consumption'] = self._simulate_consumption(hour)
         
         # Process actions for each agent
-        for i, (state, action) in enumerate(zip(self.agent_states, actions)):
-            charge_rate, share_amount, sell_amount = action
-            
-            net_energy = state['production'] - state['consumption']
-            reward = 0
-            
-            # Battery charging
-            if charge_rate > 0 and net_energy > 0:
-                charge = min(
-                    net_energy * charge_rate,
-                    state['battery_capacity'] - state['battery_level']
-                )
-                state['battery_level'] += charge
-                reward += charge * 2  # Reward for storing solar
-                net_energy -= charge
-            
-            # Energy sharing
-            if share_amount > 0 and net_energy > 0:
-                shared = min(share_amount, net_energy)
-                reward += shared * 3  # Higher reward for sharing
-                net_energy -= shared
-            
-            # Sell to grid
-            if sell_amount > 0 and net_energy > 0:
-                sold = min(sell_amount, net_energy)
-                reward += sold * 1  # Lower reward
-                net_energy -= sold
-            
-            # Penalties
-            if state['consumption'] > state['production']:
-                deficit = state['consumption'] - state['production']
-                if state['battery_level'] >= deficit:
-                    state['battery_level'] -= deficit
-                else:
-                    grid_import = deficit - state['battery_level']
-                    state['battery_level'] = 0
-                    reward -= grid_import * 5  # Penalty for grid import
-            
-            if state['battery_level'] < 0.2 * state['battery_capacity']:
-                reward -= 10  # Low battery penalty
-            
-            rewards.append(reward)
+        with span('marl.actions'):
+            for i, (state, action) in enumerate(zip(self.agent_states, actions)):
+                charge_rate, share_amount, sell_amount = action
+                
+                net_energy = state['production'] - state['consumption']
+                reward = 0
+                
+                # Battery charging
+                if charge_rate > 0 and net_energy > 0:
+                    charge = min(
+                        net_energy * charge_rate,
+                        state['battery_capacity'] - state['battery_level']
+                    )
+                    state['battery_level'] += charge
+                    reward += charge * 2  # Reward for storing solar
+                    net_energy -= charge
+                
+                # Energy sharing
+                if share_amount > 0 and net_energy > 0:
+                    shared = min(share_amount, net_energy)
+                    reward += shared * 3  # Higher reward for sharing
+                    net_energy -= shared
+                
+                # Sell to grid
+                if sell_amount > 0 and net_energy > 0:
+                    sold = min(sell_amount, net_energy)
+                    reward += sold * 1  # Lower reward
+                    net_energy -= sold
+                
+                # Penalties
+                if state['consumption'] > state['production']:
+                    deficit = state['consumption'] - state['production']
+                    if state['battery_level'] >= deficit:
+                        state['battery_level'] -= deficit
+                    else:
+                        grid_import = deficit - state['battery_level']
+                        state['battery_level'] = 0
+                        reward -= grid_import * 5  # Penalty for grid import
+                
+                if state['battery_level'] < 0.2 * state['battery_capacity']:
+                    reward -= 10  # Low battery penalty
+                
+                rewards.append(reward)
         
         self.current_step += 1
         done = self.current_step >= self.max_steps
         dones = [done] * self.num_agents
         
-        observations = self._get_observations()
+        with span('marl.observations'):
+            observations = self._get_observations()
         info = {'step': self.current_step}
         
         return observations, rewards, dones, info
@@ -235,6 +242,195 @@ class MultiAgentSolarEnv(gym.Env):
         pass
 
 
+class VectorizedMultiAgentSolarEnv(MultiAgentSolarEnv):
+    """
+    Array-based variant of MultiAgentSolarEnv
+
+    Agent state lives in flat NumPy arrays instead of a list of dicts.
+    step() takes an (N, 3) action array and returns (N, 8) observations,
+    (N,) rewards and (N,) dones. Neighbor averages come from a row-normalized
+    sparse adjacency matrix built once per environment.
+    """
+
+    def __init__(self, num_agents=50, grid_size=(10, 5), radius=1):
+        self.radius = radius
+        self._adjacency = None
+        self._has_neighbors = None
+        super(VectorizedMultiAgentSolarEnv, self).__init__(num_agents, grid_size)
+
+    def _build_adjacency(self, radius=1):
+        """Build the row-normalized neighbor matrix (Manhattan distance <= radius)"""
+        cols = self.grid_size[1]
+        ids = np.arange(self.num_agents)
+        rows_idx, cols_idx = ids // cols, ids % cols
+
+        # Dense lookup table from grid cell to agent id (-1 = empty cell)
+        cell_to_agent = np.full((rows_idx.max() + 1, cols), -1, dtype=np.int64)
+        cell_to_agent[rows_idx, cols_idx] = ids
+
+        src, dst = [], []
+        for dr in range(-radius, radius + 1):
+            for dc in range(-radius, radius + 1):
+                if (dr == 0 and dc == 0) or abs(dr) + abs(dc) > radius:
+                    continue
+                r, c = rows_idx + dr, cols_idx + dc
+                valid = (r >= 0) & (r < cell_to_agent.shape[0]) & (c >= 0) & (c < cols)
+                neighbor = np.full(self.num_agents, -1, dtype=np.int64)
+                neighbor[valid] = cell_to_agent[r[valid], c[valid]]
+                mask = neighbor >= 0
+                src.append(ids[mask])
+                dst.append(neighbor[mask])
+
+        src = np.concatenate(src) if src else np.empty(0, dtype=np.int64)
+        dst = np.concatenate(dst) if dst else np.empty(0, dtype=np.int64)
+        adjacency = sparse.csr_matrix(
+            (np.ones(len(src)), (src, dst)),
+            shape=(self.num_agents, self.num_agents)
+        )
+
+        degree = np.asarray(adjacency.sum(axis=1)).ravel()
+        inv_degree = np.divide(1.0, degree, out=np.zeros_like(degree), where=degree > 0)
+        self._adjacency = sparse.diags(inv_degree) @ adjacency
+        self._has_neighbors = degree > 0
+
+    def reset(self):
+        """Reset environment to initial state"""
+        if self._adjacency is None:
+            self._build_adjacency(self.radius)
+
+        self.current_step = 0
+        self.battery_level = np.full(self.num_agents, 50.0)
+        self.battery_capacity = np.full(self.num_agents, 10.0)
+        self.production = np.zeros(self.num_agents)
+        self.consumption = np.zeros(self.num_agents)
+
+        return self._get_observations()
+
+    def _get_observations(self):
+        """Get the (N, 8) observation array for all agents"""
+        hour = self.current_step % 24
+        excess = np.maximum(0.0, self.production - self.consumption)
+
+        avg_neighbor_battery = np.where(
+            self._has_neighbors, self._adjacency @ self.battery_level, 50.0
+        )
+        avg_neighbor_excess = np.where(
+            self._has_neighbors, self._adjacency @ excess, 0.0
+        )
+
+        # Simulate weather
+        temperature = 20 + 10 * np.sin((self.current_step / 24) * 2 * np.pi / 365)
+        cloud_cover = np.random.beta(2, 5, size=self.num_agents) * 100
+
+        observations = np.empty((self.num_agents, 8), dtype=np.float32)
+        observations[:, 0] = self.battery_level
+        observations[:, 1] = self.production
+        observations[:, 2] = self.consumption
+        observations[:, 3] = hour
+        observations[:, 4] = avg_neighbor_battery
+        observations[:, 5] = avg_neighbor_excess
+        observations[:, 6] = temperature
+        observations[:, 7] = cloud_cover
+
+        return observations
+
+    def _sample_production(self, hour):
+        """Simulate solar production for all agents"""
+        if 6 <= hour <= 18:
+            base = 5 * np.sin((hour - 6) * np.pi / 12)
+            return np.maximum(0.0, base + np.random.normal(0, 0.3, size=self.num_agents))
+        return np.zeros(self.num_agents)
+
+    def _sample_consumption(self, hour):
+        """Simulate consumption for all agents"""
+        if 6 <= hour <= 9 or 18 <= hour <= 22:
+            return np.random.uniform(2, 4, size=self.num_agents)
+        elif 9 < hour < 18:
+            return np.random.uniform(1, 2, size=self.num_agents)
+        return np.random.uniform(0.5, 1, size=self.num_agents)
+
+    def _apply_actions(self, actions):
+        """Apply an (N, 3) action array to the current state and return rewards"""
+        actions = np.asarray(actions, dtype=np.float64).reshape(self.num_agents, 3)
+        charge_rate, share_amount, sell_amount = actions[:, 0], actions[:, 1], actions[:, 2]
+
+        level = self.battery_level
+        capacity = self.battery_capacity
+        net_energy = self.production - self.consumption
+        rewards = np.zeros(self.num_agents)
+
+        # Battery charging
+        mask = (charge_rate > 0) & (net_energy > 0)
+        charge = np.where(mask, np.minimum(net_energy * charge_rate, capacity - level), 0.0)
+        level += charge
+        rewards += charge * 2
+        net_energy -= charge
+
+        # Energy sharing
+        mask = (share_amount > 0) & (net_energy > 0)
+        shared = np.where(mask, np.minimum(share_amount, net_energy), 0.0)
+        rewards += shared * 3
+        net_energy -= shared
+
+        # Sell to grid
+        mask = (sell_amount > 0) & (net_energy > 0)
+        sold = np.where(mask, np.minimum(sell_amount, net_energy), 0.0)
+        rewards += sold * 1
+        net_energy -= sold
+
+        # Penalties
+        deficit = self.consumption - self.production
+        in_deficit = deficit > 0
+        covered = in_deficit & (level >= deficit)
+        uncovered = in_deficit & ~covered
+        grid_import = np.where(uncovered, deficit - level, 0.0)
+        level -= np.where(covered, deficit, 0.0)
+        level[uncovered] = 0.0
+        rewards -= grid_import * 5
+
+        rewards -= np.where(level < 0.2 * capacity, 10.0, 0.0)
+
+        return rewards.astype(np.float32)
+
+    @traced('marl.step')
+    def step(self, actions):
+        """
+        Execute one step with actions from all agents
+
+        Args:
+            actions: Array of shape (N, 3)
+
+        Returns:
+            observations (N, 8), rewards (N,), dones (N,), info
+        """
+        hour = self.current_step % 24
+
+        with span('marl.update_state'):
+            self.production = self._sample_production(hour)
+            self.consumption = self._sample_consumption(hour)
+        with span('marl.actions'):
+            rewards = self._apply_actions(actions)
+
+        self.current_step += 1
+        done = self.current_step >= self.max_steps
+        dones = np.full(self.num_agents, done)
+
+        with span('marl.observations'):
+            observations = self._get_observations()
+        info = {'step': self.current_step}
+
+        return observations, rewards, dones, info
+
+    def render(self, mode='human'):
+        """Render the environment"""
+        if mode == 'human':
+            print(f"\n=== Step {self.current_step} ===")
+            print(f"Hour: {self.current_step % 24}")
+            print(f"Total Production: {self.production.sum():.2f} kWh")
+            print(f"Total Consumption: {self.consumption.sum():.2f} kWh")
+            print(f"Average Battery: {self.battery_level.mean():.1f}%")
+
+
 # Usage example
 if __name__ == "__main__":
     env = MultiAgentSolarEnv(num_agents=10)
@@ -63,6 +63,71 @@ class ActorCritic(nn.Module):
         return action_logprob, state_value, dist_entropy
 
 
+class RolloutBuffer:
+    """
+    Preallocated rollout storage for PPO
+    
+    Arrays are allocated on the first transition, shaped (capacity, ...) for
+    a single environment or (capacity, num_envs, ...) for a vectorized one,
+    and doubled in place if a rollout outgrows them.
+    """
+    
+    def __init__(self, state_dim, action_dim, capacity=2048):
+        self.state_dim = state_dim
+        self.action_dim = action_dim
+        self.capacity = capacity
+        self.batch_shape = None
+        self.ptr = 0
+    
+    def _allocate(self, batch_shape, capacity):
+        shape = (capacity,) + batch_shape
+        arrays = {
+            'states': np.zeros(shape + (self.state_dim,), dtype=np.float32),
+            'actions': np.zeros(shape + (self.action_dim,), dtype=np.float32),
+            'logprobs': np.zeros(shape, dtype=np.float32),
+            'rewards': np.zeros(shape, dtype=np.float32),
+            'dones': np.zeros(shape, dtype=np.float32),
+        }
+        if self.batch_shape is not None:
+            for name, array in arrays.items():
+                array[:self.ptr] = getattr(self, name)[:self.ptr]
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.batch_shape = batch_shape
+        self.capacity = capacity
+    
+    def add(self, state, action, logprob, reward, done):
+        """Append one (possibly batched) transition"""
+        state = np.asarray(state, dtype=np.float32)
+        if self.batch_shape is None:
+            self._allocate(state.shape[:-1], self.capacity)
+        elif self.ptr == self.capacity:
+            self._allocate(self.batch_shape, self.capacity * 2)
+        
+        self.states[self.ptr] = state
+        self.actions[self.ptr] = action
+        self.logprobs[self.ptr] = logprob
+        self.rewards[self.ptr] = reward
+        self.dones[self.ptr] = done
+        self.ptr += 1
+    
+    def get(self):
+        """Return views of the filled part of the buffer"""
+        return (
+            self.states[:self.ptr],
+            self.actions[:self.ptr],
+            self.logprobs[:self.ptr],
+            self.rewards[:self.ptr],
+            self.dones[:self.ptr]
+        )
+    
+    def clear(self):
+        self.ptr = 0
+    
+    def __len__(self):
+        return self.ptr
+
+
 class PPOAgent:
     """
     PPO Agent for continuous action spaces
@@ -76,12 +141,15 @@ class PPOAgent:
         gamma=0.99,
         eps_clip=0.2,
         K_epochs=10,
-        gae_lambda=0.95
+        gae_lambda=0.95,
+        minibatch_size=64,
+        rollout_size=2048
     ):
         self.gamma = gamma
         self.eps_clip = eps_clip
         self.K_epochs = K_epochs
         self.gae_lambda = gae_lambda
+        self.minibatch_size = minibatch_size
         
         self.policy = ActorCritic(state_dim, action_dim)
         self.optimizer = optim.Adam(self.policy.parameters(), lr=lr)
@@ -91,108 +159,124 @@ class PPOAgent:
         self.MseLoss = nn.MSELoss()
         
         # Storage
-        self.states = []
-        self.actions = []
-        self.logprobs = []
-        self.rewards = []
-        self.is_terminals = []
-        self.values = []
+        self.buffer = RolloutBuffer(state_dim, action_dim, capacity=rollout_size)
     
     def select_action(self, state):
-        """Select action using current policy"""
+        """
+        Select action using current policy
+        
+        A 2-D state array is treated as a batch from a vectorized
+        environment and returns (N, action_dim) actions and (N,) logprobs.
+        """
+        state = np.asarray(state, dtype=np.float32)
         with torch.no_grad():
-            state = torch.FloatTensor(state).unsqueeze(0)
+            if state.ndim == 2:
+                action, action_logprob = self.policy_old.act(torch.from_numpy(state))
+                return action.cpu().numpy(), action_logprob.cpu().numpy()
+            
+            state = torch.from_numpy(state).unsqueeze(0)
             action, action_logprob = self.policy_old.act(state)
         
         return action.cpu().numpy().flatten(), action_logprob.item()
     
     def store_transition(self, state, action, logprob, reward, done):
         """Store transition"""
-        self.states.append(state)
-        self.actions.append(action)
-        self.logprobs.append(logprob)
-        self.rewards.append(reward)
-        self.is_terminals.append(done)
+        self.buffer.add(state, action, logprob, reward, done)
     
     def compute_gae(self, rewards, values, dones, next_value):
-        """Compute Generalized Advantage Estimation"""
-        advantages = []
-        gae = 0
+        """
+        Compute Generalized Advantage Estimation
+        
+        Works on (T,) or (T, num_envs) arrays: TD residuals are computed in
+        one vectorized pass, then accumulated with a reverse scan over time.
+        """
+        rewards = np.asarray(rewards, dtype=np.float32)
+        values = np.asarray(values, dtype=np.float32)
+        not_done = 1.0 - np.asarray(dones, dtype=np.float32)
         
-        values = values + [next_value]
+        next_values = np.concatenate([values[1:], np.asarray(next_value, dtype=np.float32)[None]])
+        deltas = rewards + self.gamma * next_values * not_done - values
+        decay = self.gamma * self.gae_lambda * not_done
         
-        for step in reversed(range(len(rewards))):
-            delta = rewards[step] + self.gamma * values[step + 1] * (1 - dones[step]) - values[step]
-            gae = delta + self.gamma * self.gae_lambda * (1 - dones[step]) * gae
-            advantages.insert(0, gae)
+        advantages = np.empty_like(deltas)
+        gae = np.zeros_like(deltas[0])
+        for step in range(len(deltas) - 1, -1, -1):
+            gae = deltas[step] + decay[step] * gae
+            advantages[step] = gae
         
         return advantages
     
     def update(self):
         """Update policy using PPO"""
-        if len(self.states) == 0:
+        if len(self.buffer) == 0:
             return 0
         
-        # Convert to tensors
-        old_states = torch.FloatTensor(np.array(self.states))
-        old_actions = torch.FloatTensor(np.array(self.actions))
-        old_logprobs = torch.FloatTensor(self.logprobs)
+        states, actions, logprobs, rewards, dones = self.buffer.get()
         
-        # Compute values for GAE
+        # Single batched value pass over the whole rollout
+        old_states = torch.from_numpy(states)
         with torch.no_grad():
-            values = []
-            for state in old_states:
-                shared = self.policy_old.forward(state.unsqueeze(0))
-                value = self.policy_old.critic(shared).item()
-                values.append(value)
+            values = self.policy_old.critic(self.policy_old.forward(old_states)).squeeze(-1).numpy()
         
         # Compute advantages
-        advantages = self.compute_gae(self.rewards, values, self.is_terminals, 0)
-        advantages = torch.FloatTensor(advantages)
-        returns = advantages + torch.FloatTensor(values)
+        advantages = self.compute_gae(rewards, values, dones, np.zeros_like(values[0]))
+        returns = advantages + values
+        
+        # Flatten time and environment dimensions into one batch
+        old_states = old_states.reshape(-1, states.shape[-1])
+        old_actions = torch.from_numpy(actions).reshape(-1, actions.shape[-1])
+        old_logprobs = torch.from_numpy(logprobs).reshape(-1)
+        advantages = torch.from_numpy(advantages).reshape(-1)
+        returns = torch.from_numpy(returns).reshape(-1)
         
         # Normalize advantages
         advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
         
-        # PPO update
+        batch_size = old_states.shape[0]
+        minibatch_size = min(self.minibatch_size or batch_size, batch_size)
+        
+        # PPO update over shuffled minibatches
         total_loss = 0
+        num_updates = 0
         for _ in range(self.K_epochs):
-            # Evaluate actions
-            logprobs, state_values, dist_entropy = self.policy.evaluate(old_states, old_actions)
-            
-            # Importance ratio
-            ratios = torch.exp(logprobs - old_logprobs)
-            
-            # Surrogate loss
-            surr1 = ratios * advantages
-            surr2 = torch.clamp(ratios, 1 - self.eps_clip, 1 + self.eps_clip) * advantages
-            
-            # Final loss
-            actor_loss = -torch.min(surr1, surr2).mean()
-            critic_loss = self.MseLoss(state_values, returns)
-            entropy_loss = -0.01 * dist_entropy.mean()
-            
-            loss = actor_loss + 0.5 * critic_loss + entropy_loss
-            
-            # Optimize
-            self.optimizer.zero_grad()
-            loss.backward()
-            self.optimizer.step()
-            
-            total_loss += loss.item()
+            permutation = torch.randperm(batch_size)
+            for start in range(0, batch_size, minibatch_size):
+                idx = permutation[start:start + minibatch_size]
+                
+                # Evaluate actions
+                mb_logprobs, state_values, dist_entropy = self.policy.evaluate(old_states[idx], old_actions[idx])
+                state_values = state_values.reshape(-1)
+                
+                # Importance ratio
+                ratios = torch.exp(mb_logprobs - old_logprobs[idx])
+                
+                # Surrogate loss
+                mb_advantages = advantages[idx]
+                surr1 = ratios * mb_advantages
+                surr2 = torch.clamp(ratios, 1 - self.eps_clip, 1 + self.eps_clip) * mb_advantages
+                
+                # Final loss
+                actor_loss = -torch.min(surr1, surr2).mean()
+                critic_loss = self.MseLoss(state_values, returns[idx])
+                entropy_loss = -0.01 * dist_entropy.mean()
+                
+                loss = actor_loss + 0.5 * critic_loss + entropy_loss
+                
+                # Optimize
+                self.optimizer.zero_grad()
+                loss.backward()
+                self.optimizer.step()
+                
+                total_loss += loss.item()
+                num_updates += 1
         
         # Update old policy
         self.policy_old.load_state_dict(self.policy.state_dict())
         
         # Clear storage
-        self.states = []
-        self.actions = []
-        self.logprobs = []
-        self.rewards = []
-        self.is_terminals = []
-        self.values = []
+        self.buffer.clear()
         
-        return total_loss / self.K_epochs
+        return total_loss / num_updates
     
     def save(self, filepath):
         """Save model"""
@@ -206,16 +290,26 @@ class PPOAgent:
 
 # Training function
 def train_ppo_agent(env, episodes=1000, max_steps=1000):
-    """Train PPO agent"""
+    """
+    Train PPO agent
+    
+    ``env`` may be a single environment or a vectorized one exposing
+    ``num_envs`` (SharedMemoryVecEnv, MultiAgentBatchEnv). Vectorized
+    environments reset themselves, so each episode is a rollout of
+    ``max_steps`` batched transitions.
+    """
     state_dim = env.observation_space.shape[0]
     action_dim = env.action_space.shape[0]
+    num_envs = getattr(env, 'num_envs', None)
     
     agent = PPOAgent(state_dim, action_dim)
     
     scores = []
+    state = env.reset()
     
     for episode in range(episodes):
-        state = env.reset()
+        if num_envs is None:
+            state = env.reset()
         total_reward = 0
         
         for step in range(max_steps):
@@ -225,10 +319,13 @@ def train_ppo_agent(env, episodes=1000, max_steps=1000):
             agent.store_transition(state, action, logprob, reward, done)
             
             state = next_state
-            total_reward += reward
             
-            if done:
-                break
+            if num_envs is None:
+                total_reward += reward
+                if done:
+                    break
+            else:
+                total_reward += float(np.mean(reward))
         
         loss = agent.update()
         scores.append(total_reward)
@@ -1,7 +1,9 @@
+import math
 import numpy as np
 import torch
 from stable_baselines3 import PPO
 from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
 import gym
 from gym import spaces
 
@@ -141,12 +143,28 @@ class SolarSwarmEnv(gym.Env):
         pass
 
 
-def train_rl_agents(total_timesteps=100000):
+def train_rl_agents(total_timesteps=100000, num_workers=1):
     """
     Train RL agents using PPO
+    
+    Args:
+        total_timesteps: Total environment steps across all workers
+        num_workers: Number of environment copies stepped in parallel
+            subprocesses (1 = in-process)
     """
-    # Create environment
-    env = SolarSwarmEnv(num_agents=10)  # Start with 10 agents
+    # Create environment, one copy per worker
+    env = make_vec_env(
+        SolarSwarmEnv,
+        n_envs=num_workers,
+        env_kwargs={'num_agents': 10},  # Start with 10 agents
+        vec_env_cls=SubprocVecEnv if num_workers > 1 else DummyVecEnv
+    )
+    
+    # n_steps is per worker: keep the rollout near 2048 steps and a whole
+    # number of minibatches (n_steps * num_workers divisible by batch_size)
+    batch_size = 64
+    step = batch_size // math.gcd(batch_size, num_workers)
+    n_steps = max(batch_size, 2048 // num_workers // step * step)
     
     # Initialize PPO model
     model = PPO(
@@ -154,8 +172,8 @@ def train_rl_agents(total_timesteps=100000):
         env,
         verbose=1,
         learning_rate=0.0003,
-        n_steps=2048,
-        batch_size=64,
+        n_steps=n_steps,
+        batch_size=batch_size,
         n_epochs=10,
         gamma=0.99,
         tensorboard_log="./tensorboard/"
@@ -164,6 +182,7 @@ def train_rl_agents(total_timesteps=100000):
     # Train
     print("🤖 Training RL agents...")
     model.learn(total_timesteps=total_timesteps)
+    env.close()
     
     # Save model
     model.save("models/solar_swarm_ppo")
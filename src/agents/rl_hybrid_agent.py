@@ -4,7 +4,6 @@ Hybrid Agent that can use either rule-based or RL-based decision making
 import numpy as np
 import os
 from .base_agent import SolarPanelAgent
-from .ppo_agent import PPOAgent
 
 class HybridRLAgent(SolarPanelAgent):
     """
@@ -19,6 +18,9 @@ class HybridRLAgent(SolarPanelAgent):
         
         if use_rl and rl_model_path and os.path.exists(rl_model_path):
             try:
+                # torch is only needed once an RL model is actually loaded
+                from .ppo_agent import PPOAgent
+                
                 # State: [battery_pct, production, consumption, hour/24, neighbor_avg_battery]
                 state_dim = 5
                 action_dim = 3  # [charge_pct, share_amount, sell_amount]
@@ -0,0 +1,199 @@
+"""
+Vectorized Environments
+Run several environment copies across processes for PPO training
+"""
+
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from .multi_agent_env import VectorizedMultiAgentSolarEnv
+
+
+class MultiAgentBatchEnv:
+    """
+    Expose every agent of a VectorizedMultiAgentSolarEnv as one batch entry
+
+    Observations and actions are per agent, so a single-agent policy can be
+    trained on all agents at once. The episode resets automatically when it
+    ends, like the subprocess vectorized environment below.
+    """
+
+    def __init__(self, num_agents=50, grid_size=(10, 5), max_steps=24):
+        self.env = VectorizedMultiAgentSolarEnv(num_agents=num_agents, grid_size=grid_size)
+        self.env.max_steps = max_steps
+        self.num_envs = num_agents
+        self.observation_space = self.env.observation_space
+        self.action_space = self.env.action_space
+
+    def reset(self):
+        return self.env.reset()
+
+    def step(self, actions):
+        obs, rewards, dones, info = self.env.step(actions)
+        if dones.all():
+            info['terminal_observation'] = obs
+            obs = self.env.reset()
+        return obs, rewards, dones, [info] * self.num_envs
+
+    def close(self):
+        self.env.close()
+
+
+def _worker(remote, parent_remote, env_fn):
+    """Run one environment copy and write observations into shared memory"""
+    parent_remote.close()
+    env = env_fn()
+    batched = hasattr(env, 'num_envs')
+    shm = None
+    obs_buf = None
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+
+            if cmd == 'step':
+                obs, reward, done, info = env.step(data)
+                if not batched and done:
+                    info['terminal_observation'] = obs
+                    obs = env.reset()
+                obs_buf[...] = obs
+                remote.send((reward, done, info))
+
+            elif cmd == 'reset':
+                obs_buf[...] = env.reset()
+                remote.send(None)
+
+            elif cmd == 'spaces':
+                remote.send((
+                    env.observation_space,
+                    env.action_space,
+                    env.num_envs if batched else 1
+                ))
+
+            elif cmd == 'attach':
+                name, shape, dtype, start, stop = data
+                shm = SharedMemory(name=name)
+                view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)[start:stop]
+                obs_buf = view if batched else view[0]
+                remote.send(None)
+
+            elif cmd == 'close':
+                env.close()
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        obs_buf = None
+        if shm is not None:
+            shm.close()
+        remote.close()
+
+
+class SharedMemoryVecEnv:
+    """
+    Step N environment copies in subprocesses
+
+    Observations are written by the workers straight into one shared-memory
+    array, so only actions, rewards and dones travel over the pipes. Workers
+    may host a single environment or a batched one exposing ``num_envs``
+    (e.g. MultiAgentBatchEnv); the batch dimension is flattened across workers.
+    """
+
+    def __init__(self, env_fns: List[Callable], start_method: Optional[str] = None):
+        ctx = mp.get_context(start_method)
+        self.num_workers = len(env_fns)
+        self.closed = False
+
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(self.num_workers)])
+        self.processes = []
+        for work_remote, remote, env_fn in zip(work_remotes, self.remotes, env_fns):
+            process = ctx.Process(target=_worker, args=(work_remote, remote, env_fn), daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(('spaces', None))
+        self.observation_space, self.action_space, _ = self.remotes[0].recv()
+
+        # Batch size contributed by each worker
+        self.worker_sizes = []
+        for remote in self.remotes:
+            remote.send(('spaces', None))
+            self.worker_sizes.append(remote.recv()[2])
+        self.offsets = np.concatenate([[0], np.cumsum(self.worker_sizes)])
+        self.num_envs = int(self.offsets[-1])
+
+        shape = (self.num_envs,) + tuple(self.observation_space.shape)
+        dtype = np.dtype(self.observation_space.dtype)
+        self._shm = SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self._obs = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+
+        for i, remote in enumerate(self.remotes):
+            remote.send(('attach', (self._shm.name, shape, dtype, self.offsets[i], self.offsets[i + 1])))
+        for remote in self.remotes:
+            remote.recv()
+
+    def reset(self):
+        """Reset all environments and return the (num_envs, obs_dim) observations"""
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        return self._obs.copy()
+
+    def step_async(self, actions):
+        actions = np.asarray(actions)
+        for i, remote in enumerate(self.remotes):
+            chunk = actions[self.offsets[i]:self.offsets[i + 1]]
+            remote.send(('step', chunk if self.worker_sizes[i] > 1 else chunk[0]))
+
+    def step_wait(self):
+        rewards, dones, infos = [], [], []
+        for i, remote in enumerate(self.remotes):
+            reward, done, info = remote.recv()
+            rewards.append(np.atleast_1d(reward))
+            dones.append(np.atleast_1d(done))
+            infos.extend(info if isinstance(info, list) else [info])
+
+        return (
+            self._obs.copy(),
+            np.concatenate(rewards).astype(np.float32),
+            np.concatenate(dones).astype(bool),
+            infos
+        )
+
+    def step(self, actions):
+        """Step all environments with a (num_envs, action_dim) array"""
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        """Stop workers and release the shared observation buffer"""
+        if self.closed:
+            return
+        for remote in self.remotes:
+            try:
+                remote.send(('close', None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+        self._obs = None
+        self._shm.close()
+        self._shm.unlink()
+        self.closed = True
+
+
+def make_vec_env(env_fn: Callable, num_workers: int = 1, start_method: Optional[str] = None):
+    """
+    Create ``num_workers`` copies of ``env_fn`` in subprocesses
+
+    With a single worker the environment is built in-process, since a
+    subprocess would only add IPC overhead.
+    """
+    if num_workers <= 1:
+        return env_fn()
+    return SharedMemoryVecEnv([env_fn for _ in range(num_workers)], start_method=start_method)
@@ -0,0 +1,137 @@
+"""
+IoT Command Dispatcher
+Deliver device commands by long-poll or per-device WebSocket with acknowledgement
+"""
+
+import asyncio
+from typing import Callable, Dict, List, Optional
+
+from ..utils.device_store import DeviceStore
+
+
+class CommandDispatcher:
+    """
+    Per-device command delivery
+
+    Commands are queued in a DeviceStore as ``{'command_id', 'command',
+    'status', 'timestamp'}`` records; a new command supersedes any still
+    pending for the device. Publishing wakes any long-poll waiting on that
+    device, pushes the command onto the device's queue while it has a
+    WebSocket open and calls any registered listeners (e.g. MQTT).
+    Devices acknowledge by ``command_id``; WebSocket deliveries are marked
+    ``delivered`` so they are not returned again by polling.
+
+    ``store_factory`` defers opening (and restoring) a persistent store
+    until commands are first used. All methods must be called from the
+    event loop thread.
+    """
+
+    def __init__(self, store: Optional[DeviceStore] = None, queue_size: int = 16,
+                 store_factory: Optional[Callable[[], DeviceStore]] = None):
+        self._store = store
+        self._store_factory = store_factory
+        self.queue_size = queue_size
+        self._events: Dict[str, asyncio.Event] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._listeners: List[Callable[[str, Dict], None]] = []
+
+    @property
+    def store(self) -> DeviceStore:
+        if self._store is None:
+            self._store = self._store_factory() if self._store_factory is not None else DeviceStore(db_path=None)
+        return self._store
+
+    def add_listener(self, callback: Callable[[str, Dict], None]):
+        """Call ``callback(device_id, record)`` for every published command"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str, Dict], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def publish(self, device_id: str, command: Dict, timestamp: Optional[str] = None) -> int:
+        """Queue a command as the device's pending command and notify listeners"""
+        record = self.store.push_command(device_id, command, timestamp)
+
+        event = self._events.pop(device_id, None)
+        if event is not None:
+            event.set()
+
+        queue = self._queues.get(device_id)
+        if queue is not None:
+            if queue.full():
+                # Newer commands supersede the oldest undelivered one
+                queue.get_nowait()
+            queue.put_nowait(record)
+
+        for listener in self._listeners:
+            listener(device_id, record)
+
+        return record['command_id']
+
+    def pending(self, device_id: str) -> Optional[Dict]:
+        commands = self.store.pending_commands(device_id)
+        return commands[-1] if commands else None
+
+    async def wait_for_command(self, device_id: str, timeout: float) -> Optional[Dict]:
+        """
+        Return the pending command, waiting up to ``timeout`` seconds for one
+        """
+        record = self.pending(device_id)
+        if record is not None or timeout <= 0:
+            return record
+
+        event = self._events.get(device_id)
+        if event is None:
+            event = self._events[device_id] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            if self._events.get(device_id) is event and not event.is_set():
+                del self._events[device_id]
+            return None
+        return self.pending(device_id)
+
+    def acknowledge(self, device_id: str, command_id: Optional[int] = None, executed: bool = True) -> bool:
+        """
+        Mark the device's command executed (or failed)
+
+        Without ``command_id`` the latest command is acknowledged, as the
+        original confirm endpoint did.
+        """
+        status = 'executed' if executed else 'failed'
+        return self.store.set_command_status(device_id, command_id, status) is not None
+
+    def subscribe(self, device_id: str) -> asyncio.Queue:
+        """
+        Open the device's push queue, seeded with its pending command
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queues[device_id] = queue
+        record = self.pending(device_id)
+        if record is not None:
+            queue.put_nowait(record)
+        return queue
+
+    def unsubscribe(self, device_id: str, queue: asyncio.Queue):
+        if self._queues.get(device_id) is queue:
+            del self._queues[device_id]
+
+    def mark_delivered(self, device_id: str, record: Dict):
+        self.store.set_command_status(device_id, record['command_id'], 'delivered', expected='pending')
+
+    def history(self, device_id: str) -> List[Dict]:
+        return self.store.commands(device_id)
+
+    @property
+    def connected_devices(self) -> int:
+        return len(self._queues)
+
+    @property
+    def waiting_devices(self) -> int:
+        return len(self._events)
+
+    @property
+    def queued_commands(self) -> int:
+        """Commands waiting in WebSocket push queues"""
+        return sum(queue.qsize() for queue in list(self._queues.values()))
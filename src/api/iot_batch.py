@@ -0,0 +1,67 @@
+"""
+IoT Batch Payloads
+Decode many sensor readings at once into column arrays
+"""
+
+import numpy as np
+from typing import Any, Dict, List
+
+# Compact binary reading: little-endian, 52 bytes per record
+IOT_RECORD_DTYPE = np.dtype([
+    ('device_id', 'S32'),           # UTF-8, NUL padded
+    ('voltage_v', '<f4'),
+    ('current_a', '<f4'),
+    ('power_w', '<f4'),
+    ('temperature_c', '<f4'),
+    ('battery_level_pct', '<f4'),
+])
+
+# Sensor fields and the defaults /iot/data uses when they are missing
+SENSOR_DEFAULTS = {
+    'voltage_v': 0.0,
+    'current_a': 0.0,
+    'power_w': 0.0,
+    'temperature_c': 25.0,
+    'battery_level_pct': 50.0,
+}
+
+
+def parse_binary_readings(body: bytes) -> Dict[str, Any]:
+    """
+    Decode concatenated IOT_RECORD_DTYPE records
+
+    Raises:
+        ValueError: if the body is not a whole number of records
+    """
+    if len(body) % IOT_RECORD_DTYPE.itemsize:
+        raise ValueError(
+            f"Binary payload must be a multiple of {IOT_RECORD_DTYPE.itemsize} bytes"
+        )
+    records = np.frombuffer(body, dtype=IOT_RECORD_DTYPE)
+    columns = {name: records[name].astype(np.float64) for name in SENSOR_DEFAULTS}
+    columns['device_id'] = [raw.decode('utf-8', errors='replace') for raw in records['device_id']]
+    return columns
+
+
+def parse_json_readings(readings: List[Dict]) -> Dict[str, Any]:
+    """
+    Decode a list of /iot/data style payloads
+    ({"device_id": ..., "sensor_data": {...}})
+    """
+    n = len(readings)
+    sensor_data = [reading.get('sensor_data', {}) for reading in readings]
+    columns = {
+        name: np.fromiter((float(data.get(name, default)) for data in sensor_data), dtype=np.float64, count=n)
+        for name, default in SENSOR_DEFAULTS.items()
+    }
+    columns['device_id'] = [reading.get('device_id', 'unknown') for reading in readings]
+    return columns
+
+
+def encode_binary_readings(device_ids: List[str], **fields) -> bytes:
+    """Build a binary batch payload (for gateways, tests and load generators)"""
+    records = np.zeros(len(device_ids), dtype=IOT_RECORD_DTYPE)
+    records['device_id'] = [device_id.encode('utf-8')[:32] for device_id in device_ids]
+    for name, default in SENSOR_DEFAULTS.items():
+        records[name] = fields.get(name, default)
+    return records.tobytes()
@@ -5,18 +5,36 @@ Real-time solar swarm intelligence API
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import asyncio
+import time
 from contextlib import asynccontextmanager
 
-from .routes import router
+from .routes import router, command_dispatcher
+from .mqtt_broker import ExternalBrokerBridge, InProcessBroker, MQTTServer
+from .mqtt_ingest import MQTTIngestionAdapter
 from .websocket import SimulationWebSocket
+from ..services.streaming_anomaly import get_streaming_detector
+from ..services.anomaly_service import get_anomaly_service
+from ..services.forecasting_service import get_forecasting_service
+from ..services.model_trainer import BackgroundModelTrainer, ModelRegistry, ModelWatcher
+from ..services.warmup import Readiness, warm_up
+from ..utils.device_store import close_device_store, get_device_store
+from ..utils.instrumentation import (
+    COMMAND_QUEUE_DEPTH, CONTENT_TYPE, LONG_POLL_WAITING, REGISTRY, WEBSOCKET_CONNECTIONS
+)
 from ..utils.logger import logger
 from ..config import config
 
 # WebSocket manager
 ws_manager = SimulationWebSocket()
 
+# Connection and queue gauges are read when /metrics is scraped
+WEBSOCKET_CONNECTIONS.labels('simulation').set_function(lambda: len(ws_manager.active_connections))
+WEBSOCKET_CONNECTIONS.labels('iot_commands').set_function(lambda: command_dispatcher.connected_devices)
+COMMAND_QUEUE_DEPTH.set_function(lambda: command_dispatcher.queued_commands)
+LONG_POLL_WAITING.set_function(lambda: command_dispatcher.waiting_devices)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
@@ -24,8 +42,90 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Starting Solar Swarm Intelligence API")
     logger.info(f"   Agents: {config.num_agents}")
     logger.info(f"   Battery: {config.battery_capacity} kWh")
+    get_streaming_detector().start_background_retraining()
+    
+    # Pick up retrained models without a restart; services are attached
+    # once loaded, and a newer registry version can replace a broken one
+    registry = ModelRegistry(config.get('training.registry', 'models/registry'))
+    watcher = ModelWatcher(registry, interval=config.get('training.reload_interval_seconds', 30))
+    watcher.start()
+    
+    def start_device_store():
+        start = time.perf_counter()
+        get_device_store().start()
+        readiness.timings['device_store'] = time.perf_counter() - start
+    
+    def attach_services():
+        for name, get_service in (('anomaly_service', get_anomaly_service),
+                                  ('forecasting_service', get_forecasting_service)):
+            try:
+                setattr(watcher, name, get_service())
+            except Exception as e:
+                logger.error(f"❌ Model watcher cannot reach {name}: {e}")
+    
+    # Restore device state, load models and run dummy inference off the
+    # event loop; /health answers immediately, /ready returns 503 until done.
+    # The device store and watcher run whether or not warm-up succeeds.
+    readiness = app.state.readiness = Readiness()
+    
+    async def run_warmup():
+        try:
+            await asyncio.to_thread(start_device_store)
+        except Exception as e:
+            logger.error(f"❌ Device store failed to start: {e}")
+        await asyncio.to_thread(warm_up, readiness)
+        await asyncio.to_thread(attach_services)
+        if readiness.ready:
+            logger.info(f"✅ Warm-up complete in {sum(readiness.timings.values()):.2f}s, ready for traffic")
+    
+    warmup_task = asyncio.create_task(run_warmup())
+    
+    trainer = None
+    if config.get('training.background_enabled', False):
+        trainer = BackgroundModelTrainer(
+            registry_root=str(registry.root),
+            interval=config.get('training.interval_seconds', 3600),
+            history_rows=config.get('training.history_rows', 5000),
+            lstm_epochs=config.get('training.lstm_epochs', 5)
+        )
+        trainer.start()
+        logger.info("🔁 Background model training enabled")
+    
+    # Optional MQTT ingestion: embedded broker, or an external one via paho-mqtt
+    mqtt_server = mqtt_bridge = mqtt_adapter = None
+    if config.get('iot.mqtt.enabled', False):
+        host = config.get('iot.mqtt.host', '0.0.0.0')
+        port = config.get('iot.mqtt.port', 1883)
+        if config.get('iot.mqtt.mode', 'embedded') == 'external':
+            bus = mqtt_bridge = ExternalBrokerBridge(host, port)
+            mqtt_bridge.start()
+        else:
+            bus = InProcessBroker()
+            mqtt_server = MQTTServer(bus, host, port)
+            await mqtt_server.start()
+        mqtt_adapter = MQTTIngestionAdapter(
+            bus,
+            command_dispatcher,
+            prefix=config.get('iot.mqtt.topic_prefix', 'solar'),
+            batch_size=config.get('iot.mqtt.batch_size', 500),
+            batch_interval=config.get('iot.mqtt.batch_interval_ms', 50) / 1000.0
+        )
+        mqtt_adapter.start()
+    
     yield
     # Shutdown
+    warmup_task.cancel()
+    if mqtt_adapter is not None:
+        mqtt_adapter.stop()
+    if mqtt_server is not None:
+        await mqtt_server.stop()
+    if mqtt_bridge is not None:
+        mqtt_bridge.stop()
+    if trainer is not None:
+        trainer.stop()
+    watcher.stop()
+    get_streaming_detector().stop_background_retraining()
+    close_device_store()
     logger.info("🛑 Shutting down API")
 
 # Create FastAPI app
@@ -58,7 +158,7 @@ async def root():
         "agents": config.num_agents
     }
 
-# Health check
+# Health check (liveness)
 @app.get("/health")
 async def health_check():
     return {
@@ -66,6 +166,20 @@ async def health_check():
         "timestamp": asyncio.get_event_loop().time()
     }
 
+# Readiness check: 503 until the startup warm-up has loaded the models
+@app.get("/ready")
+async def readiness_check():
+    readiness = getattr(app.state, 'readiness', None) or Readiness()
+    return JSONResponse(
+        status_code=200 if readiness.ready else 503,
+        content=readiness.to_dict()
+    )
+
+# Prometheus scrape endpoint
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
 # WebSocket endpoint
 @app.websocket("/ws/simulation")
 async def websocket_endpoint(websocket: WebSocket):
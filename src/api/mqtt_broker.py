@@ -0,0 +1,341 @@
+"""
+MQTT Broker
+In-process publish/subscribe bus, a minimal embedded MQTT 3.1.1 server on top
+of it, and a bridge to an external broker
+"""
+
+import asyncio
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import paho.mqtt.client as paho_mqtt
+    PAHO_AVAILABLE = True
+except ImportError:
+    PAHO_AVAILABLE = False
+
+from ..utils.logger import logger
+
+# Callback signature for subscribers: callback(topic, payload)
+MessageCallback = Callable[[str, bytes], None]
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """MQTT topic filter matching ('+' one level, '#' the rest)"""
+    pattern_levels = pattern.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(pattern_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+class _TopicNode:
+    __slots__ = ('children', 'subscribers')
+
+    def __init__(self):
+        self.children: Dict[str, '_TopicNode'] = {}
+        self.subscribers: List[Tuple[int, MessageCallback]] = []
+
+
+class InProcessBroker:
+    """
+    Topic-filter pub/sub within one process
+
+    Subscriptions live in a trie keyed by topic level, so a publish only
+    visits the filters that can match it rather than every subscriber.
+    Callbacks run synchronously in the publisher's thread and must not
+    block (e.g. put onto a queue or write to a transport).
+    """
+
+    def __init__(self):
+        self._root = _TopicNode()
+        self._filters: Dict[int, str] = {}
+        self._next_id = 0
+
+    def subscribe(self, pattern: str, callback: MessageCallback) -> int:
+        """Register ``callback`` for topics matching ``pattern``; returns a handle"""
+        node = self._root
+        for level in pattern.split('/'):
+            node = node.children.setdefault(level, _TopicNode())
+        self._next_id += 1
+        node.subscribers.append((self._next_id, callback))
+        self._filters[self._next_id] = pattern
+        return self._next_id
+
+    def unsubscribe(self, handle: int):
+        pattern = self._filters.pop(handle, None)
+        if pattern is None:
+            return
+        path = [self._root]
+        for level in pattern.split('/'):
+            path.append(path[-1].children[level])
+        path[-1].subscribers = [s for s in path[-1].subscribers if s[0] != handle]
+
+        # Prune empty branches
+        for level, parent, node in zip(reversed(pattern.split('/')), reversed(path[:-1]), reversed(path[1:])):
+            if node.subscribers or node.children:
+                break
+            del parent.children[level]
+
+    def publish(self, topic: str, payload: bytes) -> int:
+        """Deliver to every matching subscriber; returns the number reached"""
+        delivered = 0
+        for callback in self._match(topic.split('/')):
+            try:
+                callback(topic, payload)
+                delivered += 1
+            except Exception as e:
+                logger.warning(f"MQTT subscriber failed on {topic}: {e}")
+        return delivered
+
+    def _match(self, levels: List[str]) -> List[MessageCallback]:
+        callbacks = []
+        nodes = [self._root]
+        for level in levels:
+            next_nodes = []
+            for node in nodes:
+                wildcard = node.children.get('#')
+                if wildcard is not None:
+                    callbacks.extend(cb for _, cb in wildcard.subscribers)
+                for key in (level, '+'):
+                    child = node.children.get(key)
+                    if child is not None:
+                        next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                return callbacks
+        for node in nodes:
+            callbacks.extend(cb for _, cb in node.subscribers)
+            # 'a/#' also matches 'a'
+            wildcard = node.children.get('#')
+            if wildcard is not None:
+                callbacks.extend(cb for _, cb in wildcard.subscribers)
+        return callbacks
+
+    @property
+    def num_subscriptions(self) -> int:
+        return len(self._filters)
+
+
+# MQTT 3.1.1 control packet types
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return struct.pack('!H', len(data)) + data
+
+
+def encode_packet(packet_type: int, body: bytes, flags: int = 0) -> bytes:
+    """Fixed header (type, flags, variable-length remaining length) + body"""
+    header = bytearray([(packet_type << 4) | flags])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            break
+    return bytes(header) + body
+
+
+def encode_publish(topic: str, payload: bytes, qos: int = 0, packet_id: int = 0) -> bytes:
+    body = encode_string(topic)
+    if qos:
+        body += struct.pack('!H', packet_id)
+    return encode_packet(PUBLISH, body + payload, qos << 1)
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+    """Read one control packet; returns (type, flags, body)"""
+    first, byte = await reader.readexactly(2)
+    length, shift = byte & 0x7F, 7
+    while byte & 0x80:
+        if shift > 21:
+            raise ValueError("Malformed remaining length")
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+    body = await reader.readexactly(length) if length else b''
+    return first >> 4, first & 0x0F, body
+
+
+def _decode_string(body: bytes, pos: int) -> Tuple[str, int]:
+    (length,) = struct.unpack_from('!H', body, pos)
+    end = pos + 2 + length
+    return body[pos + 2:end].decode('utf-8'), end
+
+
+class MQTTServer:
+    """
+    Minimal embedded MQTT 3.1.1 server over an InProcessBroker
+
+    Supports what constrained devices use: CONNECT, PUBLISH (QoS 0/1/2
+    inbound), SUBSCRIBE / UNSUBSCRIBE, PINGREQ and DISCONNECT. Messages are
+    delivered to clients at QoS 0; a client whose socket buffer exceeds
+    ``max_buffer`` bytes has messages dropped (counted in ``dropped``)
+    rather than stalling the publisher. No retained messages, sessions or
+    authentication.
+    """
+
+    def __init__(self, broker: InProcessBroker, host: str = "127.0.0.1", port: int = 1883,
+                 max_buffer: int = 256 * 1024):
+        self.broker = broker
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        # Report the bound port (port 0 picks a free one)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"📶 MQTT broker listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def clients(self) -> int:
+        return len(self._tasks)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        handles = {}
+        task = asyncio.current_task()
+        self._tasks.add(task)
+
+        def deliver(topic, payload):
+            if writer.is_closing():
+                return
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.dropped += 1
+                return
+            writer.write(encode_publish(topic, payload))
+
+        try:
+            packet_type, _, _ = await read_packet(reader)
+            if packet_type != CONNECT:
+                return
+            writer.write(encode_packet(CONNACK, b'\x00\x00'))
+
+            while True:
+                packet_type, flags, body = await read_packet(reader)
+
+                if packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic, pos = _decode_string(body, 0)
+                    if qos:
+                        packet_id = body[pos:pos + 2]
+                        pos += 2
+                        writer.write(encode_packet(PUBACK if qos == 1 else PUBREC, packet_id))
+                    self.broker.publish(topic, body[pos:])
+                elif packet_type == PUBREL:
+                    writer.write(encode_packet(PUBCOMP, body[:2]))
+                elif packet_type == SUBSCRIBE:
+                    packet_id, pos, granted = body[:2], 2, bytearray()
+                    while pos < len(body):
+                        pattern, pos = _decode_string(body, pos)
+                        pos += 1  # requested QoS; delivery is QoS 0
+                        if pattern not in handles:
+                            handles[pattern] = self.broker.subscribe(pattern, deliver)
+                        granted.append(0)
+                    writer.write(encode_packet(SUBACK, packet_id + bytes(granted)))
+                elif packet_type == UNSUBSCRIBE:
+                    pos = 2
+                    while pos < len(body):
+                        pattern, pos = _decode_string(body, pos)
+                        handle = handles.pop(pattern, None)
+                        if handle is not None:
+                            self.broker.unsubscribe(handle)
+                    writer.write(encode_packet(UNSUBACK, body[:2]))
+                elif packet_type == PINGREQ:
+                    writer.write(encode_packet(PINGRESP, b''))
+                elif packet_type == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, UnicodeDecodeError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutting down
+            pass
+        finally:
+            for handle in handles.values():
+                self.broker.unsubscribe(handle)
+            self._tasks.discard(task)
+            writer.close()
+
+
+class ExternalBrokerBridge:
+    """
+    Same subscribe/publish interface as InProcessBroker, backed by an
+    external MQTT broker through paho-mqtt
+
+    Messages arrive on paho's network thread and are handed to callbacks
+    on the asyncio loop that called ``start()``.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 1883, client_id: str = "solar-swarm-api",
+                 qos: int = 0):
+        if not PAHO_AVAILABLE:
+            raise ImportError("paho-mqtt is required to use an external MQTT broker")
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self._subscriptions: Dict[int, Tuple[str, MessageCallback]] = {}
+        self._next_id = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        callback_api = getattr(paho_mqtt, 'CallbackAPIVersion', None)
+        if callback_api is not None:
+            self._client = paho_mqtt.Client(callback_api.VERSION2, client_id=client_id)
+        else:
+            self._client = paho_mqtt.Client(client_id=client_id)
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._client.connect_async(self.host, self.port)
+        self._client.loop_start()
+
+    def stop(self):
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, *args):
+        # (Re)subscribe after every connect
+        for pattern in {pattern for pattern, _ in self._subscriptions.values()}:
+            client.subscribe(pattern, self.qos)
+
+    def _on_message(self, client, userdata, message):
+        self._loop.call_soon_threadsafe(self._dispatch, message.topic, bytes(message.payload))
+
+    def _dispatch(self, topic: str, payload: bytes):
+        for pattern, callback in list(self._subscriptions.values()):
+            if topic_matches(pattern, topic):
+                callback(topic, payload)
+
+    def subscribe(self, pattern: str, callback: MessageCallback) -> int:
+        self._next_id += 1
+        self._subscriptions[self._next_id] = (pattern, callback)
+        self._client.subscribe(pattern, self.qos)
+        return self._next_id
+
+    def unsubscribe(self, handle: int):
+        pattern, _ = self._subscriptions.pop(handle, (None, None))
+        if pattern is not None and all(p != pattern for p, _ in self._subscriptions.values()):
+            self._client.unsubscribe(pattern)
+
+    def publish(self, topic: str, payload: bytes) -> int:
+        self._client.publish(topic, payload, self.qos)
+        return 1
@@ -0,0 +1,164 @@
+"""
+MQTT Ingestion
+Batch device telemetry from pub/sub topics into the IoT pipeline and publish
+commands back to per-device topics
+"""
+
+import asyncio
+import json
+import time
+import numpy as np
+from typing import Callable, Dict, List, Optional, Set
+
+from .iot_batch import SENSOR_DEFAULTS, parse_binary_readings
+from .command_dispatcher import CommandDispatcher
+from ..utils.instrumentation import record_iot_request
+from ..utils.logger import logger
+
+
+class MQTTIngestionAdapter:
+    """
+    Bridge between device topics and the IoT decision pipeline
+
+    Topics (``prefix`` defaults to "solar"):
+    - ``<prefix>/<device_id>/telemetry``: a sensor_data JSON object (or an
+      /iot/data style payload), or binary IOT_RECORD_DTYPE records
+    - ``<prefix>/<device_id>/command``: commands published to the device
+      as {"command_id", "command", "timestamp"}
+    - ``<prefix>/<device_id>/ack``: {"command_id": ..., "executed": true}
+
+    Telemetry is accumulated and handed to ``process`` (by default the
+    same vectorized pipeline as /iot/data/batch) every ``batch_size``
+    messages or ``batch_interval`` seconds, whichever comes first. Every
+    command the dispatcher publishes, whichever endpoint decided it, is
+    forwarded to the device's command topic. Only devices seen on their
+    own telemetry or ack topic count as MQTT clients: their commands are
+    marked delivered on publish. Others (e.g. HTTP-polling devices) keep
+    the command pending until they fetch or acknowledge it.
+
+    ``bus`` is anything with ``subscribe(pattern, callback)`` /
+    ``unsubscribe(handle)`` / ``publish(topic, payload)``, i.e. an
+    InProcessBroker or ExternalBrokerBridge. Callbacks must run on the
+    event loop thread.
+    """
+
+    def __init__(
+        self,
+        bus,
+        dispatcher: CommandDispatcher,
+        process: Optional[Callable[[Dict], object]] = None,
+        prefix: str = "solar",
+        batch_size: int = 500,
+        batch_interval: float = 0.05
+    ):
+        if process is None:
+            from .routes import process_iot_readings
+            process = process_iot_readings
+        self.bus = bus
+        self.dispatcher = dispatcher
+        self.process = process
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._id_level = prefix.count('/') + 1
+
+        self._device_ids: List[str] = []
+        self._values: Dict[str, List] = {name: [] for name in SENSOR_DEFAULTS}
+        self._binary: List[Dict] = []
+        self._pending = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._handles: List[int] = []
+        self._mqtt_devices: Set[str] = set()
+        self.stats = {'messages': 0, 'batches': 0, 'invalid': 0, 'commands_sent': 0}
+
+    def start(self):
+        self._handles = [
+            self.bus.subscribe(f"{self.prefix}/+/telemetry", self._on_telemetry),
+            self.bus.subscribe(f"{self.prefix}/+/ack", self._on_ack),
+        ]
+        self.dispatcher.add_listener(self._on_command)
+        logger.info(f"📶 MQTT ingestion subscribed to {self.prefix}/+/telemetry")
+
+    def stop(self):
+        for handle in self._handles:
+            self.bus.unsubscribe(handle)
+        self._handles = []
+        self.dispatcher.remove_listener(self._on_command)
+        self.flush()
+
+    def _device_id(self, topic: str) -> str:
+        return topic.split('/')[self._id_level]
+
+    def _on_telemetry(self, topic: str, payload: bytes):
+        self._mqtt_devices.add(self._device_id(topic))
+        try:
+            if payload[:1] == b'{':
+                reading = json.loads(payload)
+                sensor_data = reading.get('sensor_data', reading)
+                values = [float(sensor_data.get(name, default)) for name, default in SENSOR_DEFAULTS.items()]
+                self._device_ids.append(reading.get('device_id', self._device_id(topic)))
+                for name, value in zip(SENSOR_DEFAULTS, values):
+                    self._values[name].append(value)
+                count = 1
+            else:
+                columns = parse_binary_readings(payload)
+                self._binary.append(columns)
+                count = len(columns['device_id'])
+        except (ValueError, TypeError, AttributeError):
+            self.stats['invalid'] += 1
+            return
+
+        self.stats['messages'] += 1
+        self._pending += count
+        if self._pending >= self.batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_interval, self.flush)
+
+    def _on_ack(self, topic: str, payload: bytes):
+        self._mqtt_devices.add(self._device_id(topic))
+        try:
+            ack = json.loads(payload)
+            self.dispatcher.acknowledge(self._device_id(topic), ack.get('command_id'), ack.get('executed', True))
+        except (ValueError, TypeError, AttributeError):
+            self.stats['invalid'] += 1
+
+    def _on_command(self, device_id: str, record: Dict):
+        payload = json.dumps({
+            'command_id': record['command_id'],
+            'command': record['command'],
+            'timestamp': record['timestamp']
+        }).encode('utf-8')
+        # A truthy publish only means someone subscribed (a bridge always
+        # reports 1); only mark delivered for devices that speak MQTT
+        if self.bus.publish(f"{self.prefix}/{device_id}/command", payload) and device_id in self._mqtt_devices:
+            self.dispatcher.mark_delivered(device_id, record)
+            self.stats['commands_sent'] += 1
+
+    def flush(self):
+        """Run the pipeline over everything received since the last batch"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        columns = {name: np.asarray(values, dtype=np.float64) for name, values in self._values.items()}
+        columns['device_id'] = self._device_ids
+        for binary in self._binary:
+            for name in SENSOR_DEFAULTS:
+                columns[name] = np.concatenate([columns[name], binary[name]])
+            columns['device_id'] = columns['device_id'] + binary['device_id']
+
+        self._device_ids = []
+        self._values = {name: [] for name in SENSOR_DEFAULTS}
+        self._binary = []
+        self._pending = 0
+
+        try:
+            start = time.perf_counter()
+            self.process(columns)
+            record_iot_request('mqtt', len(columns['device_id']), time.perf_counter() - start)
+            self.stats['batches'] += 1
+        except Exception as e:
+            logger.warning(f"MQTT batch processing failed: {e}")
@@ -3,10 +3,13 @@ API Routes
 All REST endpoints for the Solar Swarm Intelligence system
 """
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Response
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Request, Response, WebSocket, WebSocketDisconnect
 from typing import List, Optional
 from datetime import datetime
 import asyncio
+import json
+import time
+import numpy as np
 
 from .schemas import (
     SimulationStatus,
@@ -17,15 +20,22 @@ from .schemas import (
     ForecastResponse,
     IoTDataRequest,
     IoTDataResponse,
+    IoTBatchResponse,
     IoTCommandResponse
 )
+from .iot_batch import parse_binary_readings, parse_json_readings
+from .command_dispatcher import CommandDispatcher
 from ..agents.base_agent import SwarmSimulator
 from ..agents.rl_hybrid_agent import HybridRLAgent
 from ..utils.metrics import PerformanceEvaluator
 from ..utils.logger import logger
+from ..config import config
 from ..utils.historical_storage import HistoricalStorage
+from ..utils.device_store import get_device_store
+from ..utils.instrumentation import DECISION_SECONDS, record_iot_request
 from ..services.forecasting_service import get_forecasting_service
 from ..services.anomaly_service import get_anomaly_service
+from ..services.streaming_anomaly import get_streaming_detector
 
 router = APIRouter()
 
@@ -35,8 +45,20 @@ simulation_running = False
 historical_storage = HistoricalStorage()
 step_results_history = []  # Store step results for historical storage
 
-# IoT device command store (in-memory, use Redis/DB in production)
-device_commands = {}
+# IoT device commands and telemetry (sharded, persisted to SQLite; opened on first use)
+command_dispatcher = CommandDispatcher(store_factory=get_device_store)
+
+_IOT_DECISION_SECONDS = DECISION_SECONDS.labels('iot')
+
+def agent_columns(agents):
+    """Agent state as column arrays for AnomalyDetectionService.detect_anomalies_array"""
+    n = len(agents)
+    return {
+        'agent_ids': [agent.id for agent in agents],
+        'production': np.fromiter((agent.production for agent in agents), dtype=np.float64, count=n),
+        'consumption': np.fromiter((agent.consumption for agent in agents), dtype=np.float64, count=n),
+        'battery_level': np.fromiter((agent.battery_level for agent in agents), dtype=np.float64, count=n),
+    }
 
 @router.get("/simulation/status", response_model=SimulationStatus)
 async def get_simulation_status():
@@ -191,30 +213,22 @@ async def run_simulation_background(hours: int):
             }
             
             # Store step result for historical storage
+            step_result['agent_states'] = update['houses']
             step_results_history.append(step_result)
             
             # Detect anomalies
             anomaly_service = get_anomaly_service()
-            agent_data = [
-                {
-                    'agent_id': agent.id,
-                    'production': agent.production,
-                    'consumption': agent.consumption,
-                    'battery_level': agent.battery_level,
-                    'net_energy': agent.production - agent.consumption,
-                    'hour': hour
-                }
-                for agent in current_simulation.agents
-            ]
-            anomalies = anomaly_service.detect_anomalies(agent_data)
+            anomalies = anomaly_service.detect_anomalies_array(
+                **agent_columns(current_simulation.agents), hour=hour % 24
+            )
             if anomalies:
                 update['anomalies'] = anomalies
             
             # Broadcast to all connected clients
             await ws_manager.broadcast(update)
             
-            # Wait before next step (simulate real-time: 2 seconds per hour)
-            await asyncio.sleep(2)
+            # Wait before next step (simulate real-time: 2 seconds per hour by default)
+            await asyncio.sleep(config.get('api.simulation_step_seconds', 2.0))
             
         logger.info(f"Simulation completed: {hours} hours")
         
@@ -478,6 +492,25 @@ async def get_forecast():
         forecast=forecast
     )
 
+@router.get("/models/status")
+async def get_models_status():
+    """Version and training time of the live anomaly and forecasting models"""
+    anomaly_service = get_anomaly_service()
+    forecasting_service = get_forecasting_service()
+    
+    return {
+        "anomaly": {
+            "model_type": anomaly_service.model_type,
+            "version": anomaly_service.model_version,
+            "trained_at": anomaly_service.trained_at
+        },
+        "forecasting": {
+            "model_type": forecasting_service.model_type,
+            "version": forecasting_service.model_version,
+            "trained_at": forecasting_service.trained_at
+        }
+    }
+
 @router.get("/anomalies")
 async def get_anomalies():
     """Get current anomaly alerts"""
@@ -488,20 +521,10 @@ async def get_anomalies():
     
     anomaly_service = get_anomaly_service()
     
-    # Prepare agent data
-    agent_data = [
-        {
-            'agent_id': agent.id,
-            'production': agent.production,
-            'consumption': agent.consumption,
-            'battery_level': agent.battery_level,
-            'net_energy': agent.production - agent.consumption,
-            'hour': current_simulation.time_step % 24
-        }
-        for agent in current_simulation.agents
-    ]
-    
-    anomalies = anomaly_service.detect_anomalies(agent_data)
+    anomalies = anomaly_service.detect_anomalies_array(
+        **agent_columns(current_simulation.agents),
+        hour=current_simulation.time_step % 24
+    )
     
     return {"anomalies": anomalies}
 
@@ -682,81 +705,85 @@ async def get_analytics_trends():
 # IoT Endpoints for ESP32 Prototype
 # ============================================================================
 
-def make_iot_decision(current_production, forecasted_production, battery_level, voltage, has_anomaly):
+def make_iot_decisions(current_production, forecasted_production, battery_level, voltage, has_anomaly):
     """
-    AI-based decision making for IoT device control
+    AI-based decision making for a batch of IoT devices
     
     Priority logic:
     1. Emergency: Battery low + no production → Disable load
     2. High production + battery not full → Charge battery
     3. High production + battery full → Export to grid
     4. Low production + battery available → Use battery for load
-    """
     
-    # Emergency: Battery critically low
-    if battery_level < 20 and current_production < 0.1:
-        return {
-            'action': 'disable_load',
-            'amount': 0.0,
-            'priority': 'critical',
-            'reason': 'Battery critically low, preserving energy'
-        }
-    
-    # Emergency: Anomaly detected
-    if has_anomaly:
-        return {
-            'action': 'stop_battery',
-            'amount': 0.0,
-            'priority': 'high',
-            'reason': 'Anomaly detected, stopping battery operations'
-        }
-    
-    # High production scenarios
-    if current_production > 0.5:  # > 500W production
-        if battery_level < 80:
-            # Charge battery
-            charge_rate = min(current_production * 0.8, 2.0)  # Max 2kW charging
-            return {
-                'action': 'charge_battery',
-                'amount': charge_rate,
-                'priority': 'high',
-                'reason': f'High production ({current_production:.2f}kW), charging battery'
-            }
-        elif battery_level >= 80:
-            # Battery full, export to grid
-            return {
-                'action': 'export_to_grid',
-                'amount': current_production * 0.9,
-                'priority': 'medium',
-                'reason': 'Battery full, exporting excess to grid'
-            }
+    All arguments are arrays (or scalars broadcast to the batch); every
+    rule is evaluated as a mask and the first matching one wins.
+    """
+    start = time.perf_counter()
+    production, battery, anomaly = np.broadcast_arrays(
+        np.asarray(current_production, dtype=np.float64),
+        np.asarray(battery_level, dtype=np.float64),
+        np.asarray(has_anomaly, dtype=bool)
+    )
+    production, battery, anomaly = production.ravel(), battery.ravel(), anomaly.ravel()
+    
+    high_production = production > 0.5  # > 500W production
+    low_production = production < 0.2  # < 200W production
+    branch = np.select(
+        [
+            (battery < 20) & (production < 0.1),  # Emergency: Battery critically low
+            anomaly,  # Emergency: Anomaly detected
+            high_production & (battery < 80),  # Charge battery
+            high_production,  # Battery full, export to grid
+            low_production & (battery > 30),  # Use battery for load
+            low_production,  # Battery low, disable load
+        ],
+        np.arange(6),
+        default=6  # Normal operation
+    )
+    amount = np.select(
+        [branch == 2, branch == 3, branch == 4],
+        [
+            np.minimum(production * 0.8, 2.0),  # Max 2kW charging
+            production * 0.9,
+            np.minimum(1.0, battery / 10),  # Discharge rate
+        ],
+        default=0.0
+    )
     
-    # Low production scenarios
-    elif current_production < 0.2:  # < 200W production
-        if battery_level > 30:
-            # Use battery for load
-            return {
-                'action': 'discharge_battery',
-                'amount': min(1.0, battery_level / 10),  # Discharge rate
-                'priority': 'medium',
-                'reason': 'Low production, using battery for load'
-            }
+    decisions = []
+    for b, value, p in zip(branch.tolist(), amount.tolist(), production.tolist()):
+        if b == 0:
+            decision = ('disable_load', 'critical', 'Battery critically low, preserving energy')
+        elif b == 1:
+            decision = ('stop_battery', 'high', 'Anomaly detected, stopping battery operations')
+        elif b == 2:
+            decision = ('charge_battery', 'high', f'High production ({p:.2f}kW), charging battery')
+        elif b == 3:
+            decision = ('export_to_grid', 'medium', 'Battery full, exporting excess to grid')
+        elif b == 4:
+            decision = ('discharge_battery', 'medium', 'Low production, using battery for load')
+        elif b == 5:
+            decision = ('disable_load', 'high', 'Low production and low battery, disabling load')
         else:
-            # Battery low, disable load
-            return {
-                'action': 'disable_load',
-                'amount': 0.0,
-                'priority': 'high',
-                'reason': 'Low production and low battery, disabling load'
-            }
+            decision = ('enable_load', 'normal', 'Normal operation, load enabled')
+        decisions.append({
+            'action': decision[0],
+            'amount': value,
+            'priority': decision[1],
+            'reason': decision[2]
+        })
     
-    # Normal operation: Enable load, stop battery operations
-    return {
-        'action': 'enable_load',
-        'amount': 0.0,
-        'priority': 'normal',
-        'reason': 'Normal operation, load enabled'
-    }
+    _IOT_DECISION_SECONDS.observe(time.perf_counter() - start)
+    return decisions
+
+
+def make_iot_decision(current_production, forecasted_production, battery_level, voltage, has_anomaly):
+    """
+    AI-based decision making for IoT device control (single device)
+    """
+    return make_iot_decisions(
+        [current_production], [forecasted_production], [battery_level], [voltage], [has_anomaly]
+    )[0]
 
 
 @router.post("/iot/data", response_model=IoTDataResponse)
@@ -794,6 +821,7 @@ async def receive_iot_data(data: dict):
     """
     from datetime import datetime
     
+    start = time.perf_counter()
     device_id = data.get('device_id', 'unknown')
     sensor_data = data.get('sensor_data', {})
     
@@ -806,6 +834,7 @@ async def receive_iot_data(data: dict):
     battery_level = sensor_data.get('battery_level_pct', 50.0)
     
     logger.info(f"📡 IoT data from {device_id}: {power_w:.2f}W ({power_kw:.3f}kW) @ {voltage:.2f}V, Battery: {battery_level:.1f}%")
+    command_dispatcher.store.record_telemetry(device_id, sensor_data)
     
     # ============ AI DECISION MAKING ============
     
@@ -821,6 +850,8 @@ async def receive_iot_data(data: dict):
             'hour': datetime.now().hour
         }]
         anomalies = anomaly_service.detect_anomalies(anomaly_data)
+        # Deviations from this device's own rolling baseline
+        anomalies += get_streaming_detector().process_points(anomaly_data)
         has_anomaly = len(anomalies) > 0 if anomalies else False
     except Exception as e:
         logger.warning(f"Anomaly detection failed: {e}")
@@ -830,12 +861,8 @@ async def receive_iot_data(data: dict):
     # 2. Forecasting (predict next hour production)
     try:
         forecasting_service = get_forecasting_service()
-        historical_data = [{
-            'hour': datetime.now().hour,
-            'production': power_kw,
-            'consumption': 0.0,
-            'battery_pct': battery_level / 100.0
-        }]
+        # Hourly averages of this device's own readings (current hour included)
+        historical_data = command_dispatcher.store.hourly_history(device_id)
         forecast = forecasting_service.predict_24h(historical_data=historical_data)
         next_hour_production = forecast[0]['predicted_kwh'] if forecast and len(forecast) > 0 else power_kw
     except Exception as e:
@@ -851,14 +878,11 @@ async def receive_iot_data(data: dict):
         has_anomaly=has_anomaly
     )
     
-    # Store command for device to retrieve
-    device_commands[device_id] = {
-        'command': decision,
-        'status': 'pending',
-        'timestamp': datetime.now().isoformat()
-    }
+    # Store command for device to retrieve (wakes long-polls / WebSockets)
+    command_dispatcher.publish(device_id, decision)
     
     logger.info(f"🎯 Decision for {device_id}: {decision['action']} (amount: {decision.get('amount', 0)}) - {decision['reason']}")
+    record_iot_request('data', 1, time.perf_counter() - start)
     
     return IoTDataResponse(
         status="received",
@@ -870,22 +894,131 @@ async def receive_iot_data(data: dict):
     )
 
 
+@router.post("/iot/data/batch", response_model=IoTBatchResponse)
+async def receive_iot_data_batch(request: Request):
+    """
+    Receive many sensor readings (from one gateway or many devices) at once
+    
+    Accepts either:
+    - JSON: a list of /iot/data payloads, or {"readings": [...]}
+    - application/octet-stream: concatenated 52-byte records
+      (see iot_batch.IOT_RECORD_DTYPE)
+    
+    Anomaly detection, forecasting and decisions run once over the whole
+    batch; one command per device is stored and returned.
+    """
+    start = time.perf_counter()
+    body = await request.body()
+    try:
+        if request.headers.get('content-type', '').startswith('application/octet-stream'):
+            columns = parse_binary_readings(body)
+        else:
+            payload = json.loads(body or b'[]')
+            readings = payload.get('readings', []) if isinstance(payload, dict) else payload
+            columns = parse_json_readings(readings)
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch payload: {e}")
+    
+    response = process_iot_readings(columns)
+    record_iot_request('batch', response.count, time.perf_counter() - start)
+    return response
+
+
+def process_iot_readings(columns: dict) -> IoTBatchResponse:
+    """Vectorized /iot/data pipeline over decoded column arrays"""
+    device_ids = columns['device_id']
+    power_kw = columns['power_w'] / 1000.0
+    battery_level = columns['battery_level_pct']
+    now = datetime.now()
+    command_dispatcher.store.record_batch(device_ids, columns, now.timestamp())
+    
+    # 1. Anomaly Detection (rules + per-device rolling baselines)
+    flagged = set()
+    anomalies = []
+    if device_ids:
+        try:
+            anomalies = get_anomaly_service().detect_anomalies_array(
+                production=power_kw,
+                consumption=0.0,  # Could add consumption sensor later
+                battery_level=battery_level,
+                hour=now.hour,
+                agent_ids=device_ids
+            )
+            detector = get_streaming_detector()
+            values = {'production': power_kw, 'consumption': np.zeros(len(device_ids)), 'battery_level': battery_level}
+            values = np.column_stack([values[name] for name in detector.features])
+            result = detector.update(device_ids, values, np.full(len(device_ids), now.hour))
+            anomalies += detector.alerts(device_ids, values, result)
+        except Exception as e:
+            logger.warning(f"Batch anomaly detection failed: {e}")
+        flagged = {alert['agent_id'] for alert in anomalies}
+    
+    # 2. Forecasting: each device's own hourly history (current batch included),
+    # with every LSTM-ready device in one batched forward pass
+    try:
+        forecasting_service = get_forecasting_service()
+        store = command_dispatcher.store
+        if forecasting_service.model_type == "lstm":
+            histories = {device_id: store.hourly_history(device_id) for device_id in dict.fromkeys(device_ids)}
+        else:
+            histories = dict.fromkeys(device_ids, [])  # other models are not per-device
+        forecasts = forecasting_service.predict_next_hour_batch(list(histories.values()))
+        by_device = dict(zip(histories, forecasts))
+        next_hour = np.array([by_device[device_id] for device_id in device_ids], dtype=np.float64)
+    except Exception as e:
+        logger.warning(f"Forecasting failed: {e}, using current production as forecast")
+        next_hour = power_kw
+    next_hour_production = float(np.mean(next_hour)) if device_ids else 0.0
+    
+    # 3. Rule-based Decision Making
+    decisions = make_iot_decisions(
+        current_production=power_kw,
+        forecasted_production=next_hour,
+        battery_level=battery_level,
+        voltage=columns['voltage_v'],
+        has_anomaly=[device_id in flagged for device_id in device_ids]
+    )
+    
+    # A device repeated in the batch gets one command: its latest decision
+    timestamp = now.isoformat()
+    commands = dict(zip(device_ids, decisions))
+    for device_id, decision in commands.items():
+        command_dispatcher.publish(device_id, decision, timestamp)
+    
+    logger.info(f"📡 IoT batch: {len(device_ids)} readings from {len(commands)} devices, {len(anomalies)} anomalies")
+    
+    return IoTBatchResponse(
+        status="received",
+        count=len(device_ids),
+        anomalies_detected=len(anomalies),
+        forecast_next_hour=next_hour_production,
+        commands=commands,
+        timestamp=timestamp
+    )
+
+
 @router.get("/iot/command")
-async def get_iot_command(device_id: str = Query(..., description="Device identifier")):
+async def get_iot_command(
+    device_id: str = Query(..., description="Device identifier"),
+    wait: float = Query(0.0, ge=0.0, le=60.0, description="Long-poll: seconds to wait for a command")
+):
     """
     ESP32 polls this endpoint to get pending commands
     
+    With ``wait`` > 0 the request is held until a command is queued for
+    the device or the timeout passes.
+    
     Returns:
     - 200 with command if available
     - 204 No Content if no command pending
     """
-    if device_id in device_commands:
-        command_data = device_commands[device_id]
-        if command_data['status'] == 'pending':
-            return IoTCommandResponse(
-                command=command_data['command'],
-                timestamp=command_data['timestamp']
-            )
+    command_data = await command_dispatcher.wait_for_command(device_id, wait)
+    if command_data is not None:
+        return IoTCommandResponse(
+            command=command_data['command'],
+            timestamp=command_data['timestamp'],
+            command_id=command_data.get('command_id')
+        )
     
     # No command available - return 204 No Content
     return Response(status_code=204)
@@ -899,14 +1032,53 @@ async def confirm_command_execution(data: dict):
     Payload: {
         "device_id": "esp32_sensor_01",
         "command": "charge_battery",
+        "command_id": 42,  (optional)
         "executed": true
     }
     """
     device_id = data.get('device_id')
     command = data.get('command')
     
-    if device_id in device_commands:
-        device_commands[device_id]['status'] = 'executed'
+    if command_dispatcher.acknowledge(device_id, data.get('command_id'), data.get('executed', True)):
         logger.info(f"✅ Command '{command}' executed by {device_id}")
     
     return {"status": "confirmed", "device_id": device_id, "command": command}
+
+
+@router.websocket("/iot/ws/{device_id}")
+async def iot_command_channel(websocket: WebSocket, device_id: str):
+    """
+    Persistent per-device command channel
+    
+    The server pushes {"command_id", "command", "timestamp"} as commands
+    are decided; the device replies {"ack": command_id, "executed": true}.
+    """
+    await websocket.accept()
+    queue = command_dispatcher.subscribe(device_id)
+    
+    async def receive_acks():
+        while True:
+            message = await websocket.receive_json()
+            if 'ack' in message:
+                command_dispatcher.acknowledge(device_id, message['ack'], message.get('executed', True))
+    
+    receiver = asyncio.create_task(receive_acks())
+    try:
+        while True:
+            getter = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            record = getter.result()
+            await websocket.send_json({
+                'command_id': record['command_id'],
+                'command': record['command'],
+                'timestamp': record['timestamp']
+            })
+            command_dispatcher.mark_delivered(device_id, record)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        command_dispatcher.unsubscribe(device_id, queue)
@@ -112,6 +112,7 @@ class IoTCommandResponse(BaseModel):
     """IoT command response"""
     command: Dict[str, Any] = Field(..., description="Command to execute")
     timestamp: str = Field(..., description="Command timestamp")
+    command_id: Optional[int] = Field(None, description="Id to acknowledge the command with")
 
 class IoTDataResponse(BaseModel):
     """IoT data processing response"""
@@ -121,3 +122,12 @@ class IoTDataResponse(BaseModel):
     forecast_next_hour: float = Field(..., description="Forecasted production for next hour")
     command: Dict[str, Any] = Field(..., description="AI-generated command")
     timestamp: str = Field(..., description="Response timestamp")
+
+class IoTBatchResponse(BaseModel):
+    """IoT batch processing response"""
+    status: str = Field(..., description="Processing status")
+    count: int = Field(..., description="Number of readings processed")
+    anomalies_detected: int = Field(0, description="Number of anomalies detected")
+    forecast_next_hour: float = Field(..., description="Mean per-device forecast for next hour")
+    commands: Dict[str, Dict[str, Any]] = Field(..., description="AI-generated command per device")
+    timestamp: str = Field(..., description="Response timestamp")
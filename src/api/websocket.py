@@ -2,6 +2,8 @@ from fastapi import WebSocket
 import asyncio
 import json
 
+from ..utils.instrumentation import WEBSOCKET_BROADCAST_SECONDS, WEBSOCKET_SEND_FAILURES
+
 class SimulationWebSocket:
     """
     WebSocket manager for real-time simulation updates
@@ -21,12 +23,14 @@ class SimulationWebSocket:
         """
         Send data to all connected clients
         """
-        message = json.dumps(data)
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                self.disconnect(connection)
+        with WEBSOCKET_BROADCAST_SECONDS.time():
+            message = json.dumps(data)
+            for connection in list(self.active_connections):
+                try:
+                    await connection.send_text(message)
+                except:
+                    WEBSOCKET_SEND_FAILURES.inc()
+                    self.disconnect(connection)
     
     async def run_simulation(self, simulator):
         """
@@ -42,6 +42,9 @@ class Config:
         
         if os.getenv('LOG_LEVEL'):
             self.config['logging']['level'] = os.getenv('LOG_LEVEL')
+        
+        if os.getenv('SIMULATION_STEP_SECONDS'):
+            self.config['api']['simulation_step_seconds'] = float(os.getenv('SIMULATION_STEP_SECONDS'))
     
     def get(self, key_path: str, default=None):
         """
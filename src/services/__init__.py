@@ -3,11 +3,18 @@ Services package
 """
 from .forecasting_service import ForecastingService, get_forecasting_service
 from .anomaly_service import AnomalyDetectionService, get_anomaly_service
+from .streaming_anomaly import StreamingAnomalyDetector, get_streaming_detector
+from .warmup import Readiness, preload, warm_up
 
 __all__ = [
     'ForecastingService',
     'get_forecasting_service',
     'AnomalyDetectionService',
-    'get_anomaly_service'
+    'get_anomaly_service',
+    'StreamingAnomalyDetector',
+    'get_streaming_detector',
+    'preload',
+    'Readiness',
+    'warm_up'
 ]
 
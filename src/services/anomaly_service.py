@@ -3,23 +3,90 @@ Anomaly Detection Service
 Detects anomalies in energy production/consumption patterns
 """
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence
 from datetime import datetime
 
-try:
-    from sklearn.ensemble import IsolationForest
-    from sklearn.preprocessing import StandardScaler
-    SKLEARN_AVAILABLE = True
-except ImportError:
-    SKLEARN_AVAILABLE = False
+from importlib.util import find_spec
+
+from ..utils.instrumentation import ANOMALY_DETECTION_SECONDS
+
+# sklearn is imported when a model is first trained, not at import time
+SKLEARN_AVAILABLE = find_spec('sklearn') is not None
+
+# Columns accepted by the array / DataFrame API, with the dict defaults
+COLUMN_DEFAULTS = {
+    'production': 0.0,
+    'consumption': 0.0,
+    'battery_level': 0.0,
+    'net_energy': 0.0,
+    'hour': 12,
+}
+
+# Rule-based detection: (type, severity, score) in evaluation order
+_RULES = (
+    ('low_production', 'medium', -0.3),
+    ('high_consumption', 'high', -0.5),
+    ('low_battery', 'high', -0.4),
+    ('unusual_pattern', 'low', -0.2),
+)
+
+_RULES_SECONDS = ANOMALY_DETECTION_SECONDS.labels('rules')
+_FOREST_SECONDS = ANOMALY_DETECTION_SECONDS.labels('isolation_forest')
 
 class AnomalyDetectionService:
     """Service for detecting anomalies in energy data"""
     
     def __init__(self):
         self.isolation_forest = None
-        self.scaler = StandardScaler() if SKLEARN_AVAILABLE else None
+        self.scaler = None
         self._trained = False
+        self._model = None  # (scaler, isolation_forest) swapped as one reference
+        self.model_version = None
+        self.trained_at = None
+    
+    @property
+    def model_type(self) -> str:
+        """'isolation_forest' once a model is live, else 'rule_based'"""
+        return 'isolation_forest' if self._model is not None else 'rule_based'
+    
+    def swap_model(self, scaler, isolation_forest, version: Optional[str] = None,
+                   trained_at: Optional[str] = None):
+        """Make a fitted scaler / IsolationForest pair the live model"""
+        self._model = (scaler, isolation_forest)
+        self.scaler = scaler
+        self.isolation_forest = isolation_forest
+        self.model_version = version
+        self.trained_at = trained_at
+        self._trained = True
+    
+    def load_model(self, path, version: Optional[str] = None, trained_at: Optional[str] = None):
+        """Load a pickled (scaler, isolation_forest) artifact and swap it in"""
+        import pickle
+        with open(path, 'rb') as f:
+            scaler, isolation_forest = pickle.load(f)
+        self.swap_model(scaler, isolation_forest, version, trained_at)
+        print(f"✅ Loaded anomaly detection model {version or path}")
+    
+    @staticmethod
+    def _columns_from_dicts(data: List[Dict]) -> Dict[str, np.ndarray]:
+        """Convert data point dicts to column arrays"""
+        n = len(data)
+        columns = {
+            name: np.fromiter((point.get(name, default) for point in data), dtype=np.float64, count=n)
+            for name, default in COLUMN_DEFAULTS.items()
+        }
+        columns['agent_id'] = [point.get('agent_id', i) for i, point in enumerate(data)]
+        return columns
+    
+    @staticmethod
+    def _features(columns: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.column_stack([
+            columns['production'],
+            columns['consumption'],
+            columns['battery_level'],
+            columns['net_energy'],
+            columns['hour'] / 24.0,
+        ])
     
     def train(self, historical_data: List[Dict]):
         """Train anomaly detection model on historical data"""
@@ -27,31 +94,25 @@ class AnomalyDetectionService:
             return
         
         try:
-            # Extract features
-            features = []
-            for data_point in historical_data:
-                features.append([
-                    data_point.get('production', 0),
-                    data_point.get('consumption', 0),
-                    data_point.get('battery_level', 0),
-                    data_point.get('net_energy', 0),
-                    data_point.get('hour', 12) / 24.0,
-                ])
-            
-            if len(features) < 10:
+            if len(historical_data) < 10:
                 return  # Need minimum data
             
-            X = np.array(features)
-            X_scaled = self.scaler.fit_transform(X)
+            from sklearn.ensemble import IsolationForest
+            from sklearn.preprocessing import StandardScaler
+            
+            # Extract features
+            X = self._features(self._columns_from_dicts(historical_data))
+            scaler = StandardScaler()
+            X_scaled = scaler.fit_transform(X)
             
             # Train Isolation Forest
-            self.isolation_forest = IsolationForest(
+            isolation_forest = IsolationForest(
                 contamination=0.1,
                 n_estimators=100,
                 random_state=42
             )
-            self.isolation_forest.fit(X_scaled)
-            self._trained = True
+            isolation_forest.fit(X_scaled)
+            self.swap_model(scaler, isolation_forest, trained_at=datetime.now().isoformat())
             print("✅ Anomaly detection model trained")
         except Exception as e:
             print(f"⚠️ Anomaly detection training failed: {e}")
@@ -61,129 +122,188 @@ class AnomalyDetectionService:
         Detect anomalies in current data
         Returns list of anomaly alerts
         """
-        alerts = []
+        if not current_data:
+            return []
+        return self._detect(self._columns_from_dicts(current_data))
+    
+    def detect_anomalies_array(
+        self,
+        production,
+        consumption,
+        battery_level,
+        net_energy=None,
+        hour=12,
+        agent_ids: Optional[Sequence] = None
+    ) -> List[Dict]:
+        """
+        Detect anomalies from column arrays (one entry per agent/device)
         
-        if not self._trained or not SKLEARN_AVAILABLE:
-            # Fallback: rule-based detection
-            return self._rule_based_detection(current_data)
+        Scalars are broadcast; ``net_energy`` defaults to production -
+        consumption and ``agent_ids`` to the row index.
+        """
+        production = np.asarray(production, dtype=np.float64).reshape(-1)
+        n = len(production)
+        consumption = np.broadcast_to(np.asarray(consumption, dtype=np.float64), (n,))
+        columns = {
+            'production': production,
+            'consumption': consumption,
+            'battery_level': np.broadcast_to(np.asarray(battery_level, dtype=np.float64), (n,)),
+            'net_energy': (production - consumption) if net_energy is None
+                          else np.broadcast_to(np.asarray(net_energy, dtype=np.float64), (n,)),
+            'hour': np.broadcast_to(np.asarray(hour, dtype=np.float64), (n,)),
+            'agent_id': agent_ids,
+        }
+        return self._detect(columns)
+    
+    def detect_anomalies_frame(self, frame) -> List[Dict]:
+        """
+        Detect anomalies from a DataFrame with the data point columns
         
+        Missing columns take the same defaults as missing dict keys.
+        """
+        n = len(frame)
+        columns = {
+            name: frame[name].to_numpy(dtype=np.float64) if name in frame else np.full(n, float(default))
+            for name, default in COLUMN_DEFAULTS.items()
+        }
+        columns['agent_id'] = frame['agent_id'].tolist() if 'agent_id' in frame else None
+        return self._detect(columns)
+    
+    def _detect(self, columns: Dict) -> List[Dict]:
+        model = self._model
+        if model is None or not SKLEARN_AVAILABLE:
+            # Fallback: rule-based detection
+            with _RULES_SECONDS.time():
+                return self._rule_based_alerts(columns)
+        with _FOREST_SECONDS.time():
+            return self._detect_with_model(model, columns)
+    
+    def _detect_with_model(self, model, columns: Dict) -> List[Dict]:
+        scaler, isolation_forest = model
         try:
-            # Extract features
-            features = []
-            for data_point in current_data:
-                features.append([
-                    data_point.get('production', 0),
-                    data_point.get('consumption', 0),
-                    data_point.get('battery_level', 0),
-                    data_point.get('net_energy', 0),
-                    data_point.get('hour', 12) / 24.0,
-                ])
-            
-            X = np.array(features)
-            X_scaled = self.scaler.transform(X)
+            X_scaled = scaler.transform(self._features(columns))
             
-            # Predict anomalies
-            predictions = self.isolation_forest.predict(X_scaled)
-            anomaly_scores = self.isolation_forest.score_samples(X_scaled)
-            
-            # Generate alerts
-            for i, (data_point, is_anomaly, score) in enumerate(zip(current_data, predictions, anomaly_scores)):
-                if is_anomaly == -1:  # Anomaly detected
-                    alerts.append({
-                        "agent_id": data_point.get('agent_id', i),
-                        "timestamp": datetime.now().isoformat(),
-                        "type": self._classify_anomaly(data_point),
-                        "severity": "high" if score < -0.5 else "medium",
-                        "description": self._get_anomaly_description(data_point, score),
-                        "score": float(score)
-                    })
+            # Predict anomalies; score only the flagged rows
+            flagged = np.flatnonzero(isolation_forest.predict(X_scaled) == -1)
+            if len(flagged) == 0:
+                return []
+            scores = isolation_forest.score_samples(X_scaled[flagged])
+            types = self._classify_anomalies(
+                columns['production'][flagged],
+                columns['consumption'][flagged],
+                columns['battery_level'][flagged]
+            )
         except Exception as e:
             print(f"Anomaly detection failed: {e}, using rule-based")
-            return self._rule_based_detection(current_data)
+            return self._rule_based_alerts(columns)
+        
+        # Generate alerts
+        alerts = []
+        timestamp = datetime.now().isoformat()
+        agent_ids = columns['agent_id']
+        for i, anomaly_type, score in zip(flagged, types, scores):
+            production = columns['production'][i]
+            consumption = columns['consumption'][i]
+            battery = columns['battery_level'][i]
+            alerts.append({
+                "agent_id": agent_ids[i] if agent_ids is not None else int(i),
+                "timestamp": timestamp,
+                "type": str(anomaly_type),
+                "severity": "high" if score < -0.5 else "medium",
+                "description": self._describe(production, consumption, battery, score),
+                "score": float(score)
+            })
         
         return alerts
     
     def _rule_based_detection(self, data: List[Dict]) -> List[Dict]:
         """Rule-based anomaly detection fallback"""
-        alerts = []
+        if not data:
+            return []
+        return self._rule_based_alerts(self._columns_from_dicts(data))
+    
+    def _rule_based_alerts(self, columns: Dict) -> List[Dict]:
+        """Evaluate all rules as boolean masks and build alerts for flagged rows"""
+        production = columns['production']
+        consumption = columns['consumption']
+        battery = columns['battery_level']
+        hour = columns['hour']
         
-        for i, point in enumerate(data):
-            production = point.get('production', 0)
-            consumption = point.get('consumption', 0)
-            battery = point.get('battery_level', 0)
-            hour = point.get('hour', 12)
-            
+        masks = (
             # Rule 1: Unexpectedly low production during daylight
-            if 6 <= hour <= 18 and production < 0.5:
-                alerts.append({
-                    "agent_id": point.get('agent_id', i),
-                    "timestamp": datetime.now().isoformat(),
-                    "type": "low_production",
-                    "severity": "medium",
-                    "description": f"Very low production ({production:.2f} kWh) during daylight hours",
-                    "score": -0.3
-                })
-            
+            (hour >= 6) & (hour <= 18) & (production < 0.5),
             # Rule 2: Extremely high consumption
-            if consumption > 8:
-                alerts.append({
-                    "agent_id": point.get('agent_id', i),
-                    "timestamp": datetime.now().isoformat(),
-                    "type": "high_consumption",
-                    "severity": "high",
-                    "description": f"Unusually high consumption ({consumption:.2f} kWh)",
-                    "score": -0.5
-                })
-            
+            consumption > 8,
             # Rule 3: Battery critically low
-            if battery < 0.1:
-                alerts.append({
-                    "agent_id": point.get('agent_id', i),
-                    "timestamp": datetime.now().isoformat(),
-                    "type": "low_battery",
-                    "severity": "high",
-                    "description": f"Battery critically low ({battery:.2f} kWh)",
-                    "score": -0.4
-                })
-            
+            battery < 0.1,
             # Rule 4: Production but no consumption (possible panel issue)
-            if production > 2 and consumption < 0.1:
-                alerts.append({
-                    "agent_id": point.get('agent_id', i),
-                    "timestamp": datetime.now().isoformat(),
-                    "type": "unusual_pattern",
-                    "severity": "low",
-                    "description": "Production but minimal consumption detected",
-                    "score": -0.2
-                })
+            (production > 2) & (consumption < 0.1),
+        )
+        
+        rows = np.concatenate([np.flatnonzero(mask) for mask in masks])
+        if len(rows) == 0:
+            return []
+        rules = np.concatenate([np.full(np.count_nonzero(mask), k) for k, mask in enumerate(masks)])
+        
+        # Same order as evaluating every rule per data point
+        order = np.lexsort((rules, rows))
+        
+        alerts = []
+        timestamp = datetime.now().isoformat()
+        agent_ids = columns['agent_id']
+        for i, rule in zip(rows[order].tolist(), rules[order].tolist()):
+            anomaly_type, severity, score = _RULES[rule]
+            if rule == 0:
+                description = f"Very low production ({production[i]:.2f} kWh) during daylight hours"
+            elif rule == 1:
+                description = f"Unusually high consumption ({consumption[i]:.2f} kWh)"
+            elif rule == 2:
+                description = f"Battery critically low ({battery[i]:.2f} kWh)"
+            else:
+                description = "Production but minimal consumption detected"
+            alerts.append({
+                "agent_id": agent_ids[i] if agent_ids is not None else i,
+                "timestamp": timestamp,
+                "type": anomaly_type,
+                "severity": severity,
+                "description": description,
+                "score": score
+            })
         
         return alerts
     
+    @staticmethod
+    def _classify_anomalies(production, consumption, battery) -> np.ndarray:
+        """Classify anomaly types for arrays of readings"""
+        return np.select(
+            [production < 0.5, consumption > 6, battery < 0.2],
+            ["low_production", "high_consumption", "low_battery"],
+            default="unusual_pattern"
+        )
+    
     def _classify_anomaly(self, data_point: Dict) -> str:
         """Classify the type of anomaly"""
-        production = data_point.get('production', 0)
-        consumption = data_point.get('consumption', 0)
-        battery = data_point.get('battery_level', 0)
-        
-        if production < 0.5:
-            return "low_production"
-        elif consumption > 6:
-            return "high_consumption"
-        elif battery < 0.2:
-            return "low_battery"
-        else:
-            return "unusual_pattern"
+        return str(self._classify_anomalies(
+            np.array([data_point.get('production', 0)]),
+            np.array([data_point.get('consumption', 0)]),
+            np.array([data_point.get('battery_level', 0)])
+        )[0])
     
-    def _get_anomaly_description(self, data_point: Dict, score: float) -> str:
-        """Generate human-readable description"""
-        production = data_point.get('production', 0)
-        consumption = data_point.get('consumption', 0)
-        battery = data_point.get('battery_level', 0)
-        
+    @staticmethod
+    def _describe(production: float, consumption: float, battery: float, score: float) -> str:
         if score < -0.5:
             return f"Severe anomaly: Production={production:.2f} kWh, Consumption={consumption:.2f} kWh, Battery={battery:.2f} kWh"
         else:
             return f"Anomaly detected: Production={production:.2f} kWh, Consumption={consumption:.2f} kWh"
+    
+    def _get_anomaly_description(self, data_point: Dict, score: float) -> str:
+        """Generate human-readable description"""
+        return self._describe(
+            data_point.get('production', 0),
+            data_point.get('consumption', 0),
+            data_point.get('battery_level', 0),
+            score
+        )
 
 # Global service instance
 _anomaly_service = None
@@ -3,21 +3,29 @@ Forecasting Service
 Loads and uses LSTM/Prophet models for predictions
 """
 import os
-import torch
+import threading
 import numpy as np
-import pandas as pd
 from datetime import datetime, timedelta
+from importlib.util import find_spec
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence
 
-try:
-    from ..models.lstm_forecaster import SolarLSTM
-    from ..models.forecasting import SolarForecaster
-    LSTM_AVAILABLE = True
-    PROPHET_AVAILABLE = True
-except ImportError:
-    LSTM_AVAILABLE = False
-    PROPHET_AVAILABLE = False
+from ..utils.instrumentation import FORECAST_SECONDS
+
+# torch / Prophet are imported when a model is first loaded, not at import time
+LSTM_AVAILABLE = find_spec('torch') is not None
+PROPHET_AVAILABLE = find_spec('prophet') is not None
+
+def lstm_features(point: Dict) -> np.ndarray:
+    """LSTM input features for one hourly data point"""
+    # Features: [hour, production, consumption, battery, ...]
+    return np.array([
+        point.get('hour', 12) / 24.0,
+        point.get('production', 0) / 10.0,
+        point.get('consumption', 0) / 10.0,
+        point.get('battery_pct', 0.5),
+        0, 0, 0, 0, 0, 0  # Placeholder for additional features
+    ])
 
 class ForecastingService:
     """Service for solar production forecasting"""
@@ -26,14 +34,43 @@ class ForecastingService:
         self.lstm_model = None
         self.prophet_model = None
         self.model_type = "simple"  # simple, lstm, prophet
+        self.model_version = None
+        self.trained_at = None
+        self._load_models()
+    
+    def reload(self):
+        """Re-read models/ (e.g. after an offline retrain)"""
         self._load_models()
     
+    def load_lstm(self, path, version: Optional[str] = None, trained_at: Optional[str] = None):
+        """
+        Load an LSTM checkpoint and make it the live model
+        
+        The model is built and loaded before the reference is swapped, so
+        requests in flight keep using the previous model.
+        """
+        import torch
+        from ..models.lstm_forecaster import SolarLSTM
+        
+        model = SolarLSTM(input_size=10, hidden_size=64, num_layers=2)
+        model.load_state_dict(torch.load(path, map_location='cpu'))
+        model.eval()
+        
+        self.lstm_model = model
+        self.model_type = "lstm"
+        self.model_version = version
+        self.trained_at = trained_at
+        print(f"✅ Loaded LSTM forecasting model {version or path}")
+    
     def _load_models(self):
         """Load trained models if available"""
         # Try to load LSTM
         lstm_path = Path("models/best_lstm.pth")
         if lstm_path.exists() and LSTM_AVAILABLE:
             try:
+                import torch
+                from ..models.lstm_forecaster import SolarLSTM
+                
                 self.lstm_model = SolarLSTM(input_size=10, hidden_size=64, num_layers=2)
                 self.lstm_model.load_state_dict(torch.load(lstm_path, map_location='cpu'))
                 self.lstm_model.eval()
@@ -65,12 +102,52 @@ class ForecastingService:
         now = datetime.now()
         timestamps = [now + timedelta(hours=i) for i in range(24)]
         
-        if self.model_type == "lstm" and self.lstm_model and historical_data:
-            return self._predict_lstm(timestamps, historical_data)
+        # Snapshot the model so a concurrent hot-swap can't change it mid-request
+        lstm_model = self.lstm_model
+        
+        if self.model_type == "lstm" and lstm_model and historical_data:
+            with FORECAST_SECONDS.labels('lstm').time():
+                return self._predict_lstm(timestamps, historical_data, lstm_model)
         elif self.model_type == "prophet" and self.prophet_model:
-            return self._predict_prophet(timestamps, weather_forecast)
+            with FORECAST_SECONDS.labels('prophet').time():
+                return self._predict_prophet(timestamps, weather_forecast)
         else:
-            return self._predict_simple(timestamps, weather_forecast)
+            with FORECAST_SECONDS.labels('simple').time():
+                return self._predict_simple(timestamps, weather_forecast)
+    
+    def predict_next_hour_batch(self, histories: Sequence[List[Dict]]) -> np.ndarray:
+        """
+        Next-hour production (kWh) for many devices, one hourly history each
+        
+        With the LSTM live, every history of at least 24 points goes through
+        one batched forward pass of shape (n, 24, 10); shorter histories get
+        the simple forecast, as predict_24h gives them. Other models are not
+        per-device, so their next-hour value is shared.
+        """
+        n = len(histories)
+        lstm_model = self.lstm_model
+        if self.model_type != "lstm" or lstm_model is None:
+            return np.full(n, self.predict_24h()[0]['predicted_kwh'], dtype=np.float64)
+        
+        result = np.full(n, self._predict_simple([datetime.now()])[0]['predicted_kwh'], dtype=np.float64)
+        rows = [i for i, history in enumerate(histories) if len(history) >= 24]
+        if not rows:
+            return result
+        
+        with FORECAST_SECONDS.labels('lstm_batch').time():
+            try:
+                import torch
+                sequences = np.array(
+                    [[lstm_features(point) for point in histories[i][-24:]] for i in rows],
+                    dtype=np.float32
+                )
+                with torch.no_grad():
+                    output = lstm_model(torch.from_numpy(sequences))
+                predictions = output.numpy()[:, 0].astype(np.float64) * 10.0  # Denormalize
+                result[rows] = np.round(np.maximum(predictions, 0), 2)
+            except Exception as e:
+                print(f"Batched LSTM prediction failed: {e}, falling back to simple")
+        return result
     
     def _predict_simple(self, timestamps: List[datetime], weather: Optional[Dict] = None) -> List[Dict]:
         """Simple sinusoidal forecast"""
@@ -99,34 +176,25 @@ class ForecastingService:
         
         return forecast
     
-    def _predict_lstm(self, timestamps: List[datetime], historical: List[Dict]) -> List[Dict]:
+    def _predict_lstm(self, timestamps: List[datetime], historical: List[Dict], model=None) -> List[Dict]:
         """Predict using LSTM model"""
+        import torch
+        
+        model = model or self.lstm_model
         try:
             # Prepare input sequence (last 24 hours)
             if len(historical) < 24:
                 return self._predict_simple(timestamps)
             
             # Extract features from historical data
-            sequence = []
-            for h in historical[-24:]:
-                # Features: [hour, production, consumption, battery, ...]
-                features = np.array([
-                    h.get('hour', 12) / 24.0,
-                    h.get('production', 0) / 10.0,
-                    h.get('consumption', 0) / 10.0,
-                    h.get('battery_pct', 0.5),
-                    0, 0, 0, 0, 0, 0  # Placeholder for additional features
-                ])
-                sequence.append(features)
-            
-            sequence = np.array(sequence)
+            sequence = np.array([lstm_features(h) for h in historical[-24:]])
             sequence_tensor = torch.FloatTensor(sequence).unsqueeze(0)
             
             # Generate predictions
             forecast = []
             with torch.no_grad():
                 for i, ts in enumerate(timestamps):
-                    pred = self.lstm_model(sequence_tensor)
+                    pred = model(sequence_tensor)
                     pred_value = pred.item() * 10.0  # Denormalize
                     
                     forecast.append({
@@ -178,11 +246,15 @@ class ForecastingService:
 
 # Global service instance
 _forecasting_service = None
+_forecasting_lock = threading.Lock()
 
 def get_forecasting_service() -> ForecastingService:
     """Get or create forecasting service singleton"""
     global _forecasting_service
     if _forecasting_service is None:
-        _forecasting_service = ForecastingService()
+        # Startup warm-up may be constructing it on another thread
+        with _forecasting_lock:
+            if _forecasting_service is None:
+                _forecasting_service = ForecastingService()
     return _forecasting_service
 
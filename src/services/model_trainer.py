@@ -0,0 +1,297 @@
+"""
+Background Model Training
+Periodically retrain anomaly / forecasting models and hot-swap them into the API
+"""
+import json
+import multiprocessing as mp
+import os
+import pickle
+import shutil
+import threading
+import uuid
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..utils.historical_storage import HistoricalStorage
+
+
+ANOMALY_ARTIFACT = 'anomaly.pkl'
+FORECAST_ARTIFACT = 'lstm.pth'
+
+
+class ModelRegistry:
+    """
+    Versioned model artifacts on disk
+
+    Each version lives in ``<root>/<kind>/<version>/`` next to a
+    ``meta.json``; ``<root>/<kind>/CURRENT`` names the live version and is
+    replaced atomically, so readers never see a half-written model.
+    """
+
+    def __init__(self, root: str = "models/registry", keep: int = 5):
+        self.root = Path(root)
+        self.keep = keep
+
+    def publish(self, kind: str, write_fn, metadata: Optional[Dict] = None) -> Dict:
+        """
+        Write a new version with ``write_fn(directory)`` and make it current
+        """
+        kind_dir = self.root / kind
+        kind_dir.mkdir(parents=True, exist_ok=True)
+
+        version = f"{datetime.now():%Y%m%dT%H%M%S.%f}-{uuid.uuid4().hex[:6]}"
+        staging = kind_dir / f".{version}.tmp"
+        staging.mkdir()
+        write_fn(staging)
+
+        meta = dict(metadata or {}, version=version, trained_at=datetime.now().isoformat())
+        (staging / 'meta.json').write_text(json.dumps(meta))
+        os.replace(staging, kind_dir / version)
+
+        pointer = kind_dir / f".CURRENT.{version}.tmp"
+        pointer.write_text(json.dumps(meta))
+        os.replace(pointer, kind_dir / 'CURRENT')
+
+        self._prune(kind_dir, version)
+        return meta
+
+    def _prune(self, kind_dir: Path, current: str):
+        versions = sorted(p for p in kind_dir.iterdir() if p.is_dir() and not p.name.startswith('.'))
+        for path in versions[:-self.keep]:
+            if path.name != current:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def current(self, kind: str) -> Optional[Dict]:
+        """Metadata of the live version (with its 'path'), or None"""
+        pointer = self.root / kind / 'CURRENT'
+        try:
+            meta = json.loads(pointer.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        meta['path'] = str(self.root / kind / meta['version'])
+        return meta
+
+
+def _per_agent_points(rows: List[Dict]) -> List[Dict]:
+    """Hourly community metrics as average per-agent data points (forecast features)"""
+    points = []
+    for row in rows:
+        agents = max(1, row.get('active_agents') or 1)
+        production = (row.get('total_production') or 0) / agents
+        consumption = (row.get('total_consumption') or 0) / agents
+        points.append({
+            'simulation_id': row.get('simulation_id'),
+            'hour': (row.get('hour') or 0) % 24,
+            'production': production,
+            'consumption': consumption,
+            'battery_pct': (row.get('avg_battery_pct') or 0) / 100.0,
+            'net_energy': production - consumption,
+        })
+    return points
+
+
+def _agent_state_points(rows: List[Dict]) -> List[Dict]:
+    """
+    Per-agent state rows as anomaly data points
+
+    Same units the service scores at inference (``agent_columns``):
+    kWh per agent, battery_level in kWh, hour of day.
+    """
+    points = []
+    for row in rows:
+        production = row.get('production') or 0
+        consumption = row.get('consumption') or 0
+        points.append({
+            'agent_id': row.get('agent_id'),
+            'hour': (row.get('hour') or 0) % 24,
+            'production': production,
+            'consumption': consumption,
+            'battery_level': row.get('battery_level') or 0,
+            'net_energy': production - consumption,
+        })
+    return points
+
+
+def train_anomaly_model(points: List[Dict], registry: ModelRegistry) -> Optional[Dict]:
+    """Fit the IsolationForest on recent data points and publish it"""
+    from .anomaly_service import AnomalyDetectionService
+
+    service = AnomalyDetectionService()
+    service.train(points)
+    if service._model is None:
+        return None
+
+    def write(directory):
+        with open(directory / ANOMALY_ARTIFACT, 'wb') as f:
+            pickle.dump(service._model, f)
+
+    return registry.publish('anomaly', write, {'samples': len(points)})
+
+
+def train_forecast_model(points: List[Dict], registry: ModelRegistry, epochs: int = 5,
+                         sequence_length: int = 24) -> Optional[Dict]:
+    """Fit the LSTM on next-hour production per simulation and publish it"""
+    import torch
+    from torch import nn
+    from ..models.lstm_forecaster import SolarLSTM
+    from .forecasting_service import lstm_features
+
+    sequences, targets = [], []
+    by_simulation: Dict = {}
+    for point in points:
+        by_simulation.setdefault(point['simulation_id'], []).append(point)
+    for series in by_simulation.values():
+        features = np.array([lstm_features(p) for p in series], dtype=np.float32)
+        for end in range(sequence_length, len(series)):
+            sequences.append(features[end - sequence_length:end])
+            targets.append(series[end]['production'] / 10.0)
+
+    if not sequences:
+        return None
+
+    X = torch.from_numpy(np.stack(sequences))
+    y = torch.tensor(targets, dtype=torch.float32).unsqueeze(1)
+    model = SolarLSTM(input_size=10, hidden_size=64, num_layers=2)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    criterion = nn.MSELoss()
+
+    model.train()
+    for _ in range(epochs):
+        for start in range(0, len(X), 64):
+            optimizer.zero_grad()
+            loss = criterion(model(X[start:start + 64]), y[start:start + 64])
+            loss.backward()
+            optimizer.step()
+
+    def write(directory):
+        torch.save(model.state_dict(), directory / FORECAST_ARTIFACT)
+
+    return registry.publish('forecast', write, {'samples': len(X), 'loss': loss.item()})
+
+
+def run_training(storage: HistoricalStorage, registry: ModelRegistry,
+                 history_rows: int = 5000, lstm_epochs: int = 5, agent_rows: int = 50000) -> Dict:
+    """
+    One retraining pass over recent history; returns published metadata
+
+    The anomaly model trains on per-agent states (up to ``agent_rows``);
+    without any, the rule-based detector stays live.
+    """
+    agent_points = _agent_state_points(storage.get_recent_agent_states(agent_rows))
+    points = _per_agent_points(storage.get_recent_hourly_metrics(history_rows))
+    return {
+        'anomaly': train_anomaly_model(agent_points, registry),
+        'forecast': train_forecast_model(points, registry, epochs=lstm_epochs),
+    }
+
+
+def _training_loop(db_path, registry_root, interval, history_rows, lstm_epochs, stop_event):
+    """Trainer process entry point"""
+    storage = HistoricalStorage(db_path)
+    registry = ModelRegistry(registry_root)
+    while True:
+        try:
+            published = run_training(storage, registry, history_rows, lstm_epochs)
+            versions = {kind: meta['version'] for kind, meta in published.items() if meta}
+            print(f"✅ Background training published {versions or 'nothing (not enough data)'}")
+        except Exception as e:
+            print(f"⚠️ Background training failed: {e}")
+        if stop_event.wait(interval):
+            break
+
+
+class BackgroundModelTrainer:
+    """
+    Retrain models every ``interval`` seconds in a separate process
+
+    Training never runs in the API process; new versions are published to
+    the ModelRegistry and picked up by a ModelWatcher.
+    """
+
+    def __init__(self, db_path: str = "data/simulation_history.db",
+                 registry_root: str = "models/registry", interval: float = 3600.0,
+                 history_rows: int = 5000, lstm_epochs: int = 5, start_method: str = 'spawn'):
+        self.args = (db_path, registry_root, interval, history_rows, lstm_epochs)
+        self._ctx = mp.get_context(start_method)
+        self._stop = None
+        self.process = None
+
+    def start(self):
+        if self.process is not None and self.process.is_alive():
+            return
+        self._stop = self._ctx.Event()
+        self.process = self._ctx.Process(
+            target=_training_loop, args=self.args + (self._stop,),
+            name='model-trainer', daemon=True
+        )
+        self.process.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self.process is None:
+            return
+        self._stop.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+
+class ModelWatcher:
+    """
+    Poll the registry and hot-swap new versions into the live services
+
+    Artifacts are loaded in this thread; services only swap a reference,
+    so requests never wait on a model load.
+    """
+
+    def __init__(self, registry: ModelRegistry, interval: float = 30.0,
+                 anomaly_service=None, forecasting_service=None):
+        self.registry = registry
+        self.interval = interval
+        self.anomaly_service = anomaly_service
+        self.forecasting_service = forecasting_service
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self) -> List[str]:
+        """Load any version newer than the live one; returns the kinds swapped"""
+        swapped = []
+
+        meta = self.registry.current('anomaly')
+        service = self.anomaly_service
+        if meta and service is not None and meta['version'] != service.model_version:
+            service.load_model(Path(meta['path']) / ANOMALY_ARTIFACT, meta['version'], meta['trained_at'])
+            swapped.append('anomaly')
+
+        meta = self.registry.current('forecast')
+        service = self.forecasting_service
+        if meta and service is not None and meta['version'] != service.model_version:
+            service.load_lstm(Path(meta['path']) / FORECAST_ARTIFACT, meta['version'], meta['trained_at'])
+            swapped.append('forecast')
+
+        return swapped
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def run():
+            while True:
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"⚠️ Model reload failed: {e}")
+                if self._stop.wait(self.interval):
+                    break
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='model-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,280 @@
+"""
+Streaming Anomaly Detection
+Per-device rolling baselines updated as each reading arrives
+"""
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+from datetime import datetime
+
+from importlib.util import find_spec
+
+from ..utils.instrumentation import ANOMALY_DETECTION_SECONDS
+
+# sklearn is imported when a model is first trained, not at import time
+SKLEARN_AVAILABLE = find_spec('sklearn') is not None
+
+
+FEATURES = ('production', 'consumption', 'battery_level')
+
+_STREAMING_SECONDS = ANOMALY_DETECTION_SECONDS.labels('streaming')
+
+# (feature, direction) -> alert type used by AnomalyDetectionService
+_ALERT_TYPES = {
+    ('production', -1): 'low_production',
+    ('consumption', 1): 'high_consumption',
+    ('battery_level', -1): 'low_battery',
+}
+
+
+class StreamingAnomalyDetector:
+    """
+    Online anomaly detector with per-entity EWMA baselines
+
+    Every entity (agent or device) keeps an exponentially weighted mean and
+    variance per feature, plus the same statistics per hour of day, in
+    fixed-size arrays. Each reading is scored against its hour profile (or
+    the overall baseline until the profile has ``profile_warmup`` samples)
+    before being folded in, and flagged when its largest z-score exceeds
+    ``threshold``. Readings are processed in vectorized batches.
+
+    Recent readings are kept in a ring buffer so an IsolationForest can be
+    refit in a background thread; once fitted it flags readings as well.
+    """
+
+    def __init__(
+        self,
+        features: Sequence[str] = FEATURES,
+        alpha: float = 0.05,
+        profile_alpha: float = 0.2,
+        threshold: float = 4.0,
+        warmup: int = 24,
+        profile_warmup: int = 3,
+        min_std: float = 0.05,
+        sample_size: int = 10000,
+        initial_capacity: int = 1024
+    ):
+        self.features = tuple(features)
+        self.alpha = alpha
+        self.profile_alpha = profile_alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.profile_warmup = profile_warmup
+        self.min_std = min_std
+
+        num_features = len(self.features)
+        self._index: Dict = {}
+        self.mean = np.zeros((initial_capacity, num_features))
+        self.var = np.zeros((initial_capacity, num_features))
+        self.count = np.zeros(initial_capacity, dtype=np.int64)
+        self.profile_mean = np.zeros((initial_capacity, 24, num_features))
+        self.profile_var = np.zeros((initial_capacity, 24, num_features))
+        self.profile_count = np.zeros((initial_capacity, 24), dtype=np.int64)
+
+        # Ring buffer of recent [features..., hour / 24] rows for retraining
+        self._samples = np.zeros((sample_size, num_features + 1))
+        self._sample_pos = 0
+        self._sample_full = False
+
+        self._lock = threading.Lock()
+        self._model = None  # (scaler, isolation_forest)
+        self._retrain_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def num_entities(self) -> int:
+        return len(self._index)
+
+    def _grow(self, needed: int):
+        capacity = len(self.count)
+        while capacity < needed:
+            capacity *= 2
+        for name in ('mean', 'var', 'count', 'profile_mean', 'profile_var', 'profile_count'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _rows(self, entity_ids) -> np.ndarray:
+        rows = np.empty(len(entity_ids), dtype=np.int64)
+        for i, entity in enumerate(entity_ids):
+            row = self._index.get(entity)
+            if row is None:
+                row = self._index[entity] = len(self._index)
+            rows[i] = row
+        if len(self._index) > len(self.count):
+            self._grow(len(self._index))
+        return rows
+
+    def _update(self, rows, x, hours):
+        """Score then fold in readings for distinct rows"""
+        count = self.count[rows]
+        p_count = self.profile_count[rows, hours]
+        use_profile = (p_count >= self.profile_warmup)[:, None]
+
+        mean = np.where(use_profile, self.profile_mean[rows, hours], self.mean[rows])
+        var = np.where(use_profile, self.profile_var[rows, hours], self.var[rows])
+        deviation = (x - mean) / np.sqrt(np.maximum(var, self.min_std ** 2))
+        deviation[count < self.warmup] = 0.0
+
+        # EWMA mean / variance; the first reading initialises the baseline
+        for mean_arr, var_arr, idx, n, a in (
+            (self.mean, self.var, (rows,), count, self.alpha),
+            (self.profile_mean, self.profile_var, (rows, hours), p_count, self.profile_alpha),
+        ):
+            m = mean_arr[idx]
+            diff = x - m
+            first = (n == 0)[:, None]
+            mean_arr[idx] = np.where(first, x, m + a * diff)
+            var_arr[idx] = np.where(first, 0.0, (1 - a) * (var_arr[idx] + a * diff ** 2))
+
+        self.count[rows] += 1
+        self.profile_count[rows, hours] += 1
+        return deviation
+
+    def _record_samples(self, x, hours):
+        n = len(x)
+        size = len(self._samples)
+        if n >= size:
+            x, hours, n = x[-size:], hours[-size:], size
+        idx = (self._sample_pos + np.arange(n)) % size
+        self._samples[idx, :-1] = x
+        self._samples[idx, -1] = hours / 24.0
+        self._sample_full = self._sample_full or self._sample_pos + n >= size
+        self._sample_pos = (self._sample_pos + n) % size
+
+    def update(self, entity_ids: Sequence, values: np.ndarray, hours: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Score and absorb a batch of readings
+
+        Args:
+            entity_ids: entity per reading (repeats allowed, applied in order)
+            values: (n, num_features) readings in ``features`` order
+            hours: (n,) hour of day
+
+        Returns:
+            dict with per-reading 'deviation' (signed z-scores, n x F),
+            'score' (max |z|) and boolean 'anomaly'
+        """
+        start = time.perf_counter()
+        values = np.asarray(values, dtype=np.float64).reshape(len(entity_ids), len(self.features))
+        hours = np.asarray(hours, dtype=np.int64) % 24
+
+        with self._lock:
+            rows = self._rows(entity_ids)
+            deviation = np.empty_like(values)
+
+            # Repeated entities are applied in rounds so each update sees the previous one
+            order = np.argsort(rows, kind='stable')
+            sorted_rows = rows[order]
+            starts = np.r_[True, sorted_rows[1:] != sorted_rows[:-1]]
+            group_start = np.maximum.accumulate(np.where(starts, np.arange(len(rows)), 0))
+            occurrence = np.empty_like(rows)
+            occurrence[order] = np.arange(len(rows)) - group_start
+
+            for k in range(int(occurrence.max()) + 1 if len(rows) else 0):
+                sel = np.flatnonzero(occurrence == k)
+                deviation[sel] = self._update(rows[sel], values[sel], hours[sel])
+
+            self._record_samples(values, hours)
+            model = self._model
+
+        score = np.abs(deviation).max(axis=1) if len(values) else np.zeros(0)
+        anomaly = score > self.threshold
+
+        if model is not None:
+            scaler, forest = model
+            X = np.column_stack([values, hours / 24.0])
+            anomaly |= forest.predict(scaler.transform(X)) == -1
+
+        _STREAMING_SECONDS.observe(time.perf_counter() - start)
+        return {'deviation': deviation, 'score': score, 'anomaly': anomaly}
+
+    def process_points(self, data: List[Dict]) -> List[Dict]:
+        """
+        Update from data point dicts and return alerts for flagged readings
+        """
+        if not data:
+            return []
+
+        entity_ids = [point.get('agent_id', i) for i, point in enumerate(data)]
+        values = np.array([[point.get(name, 0) for name in self.features] for point in data], dtype=np.float64)
+        hours = np.fromiter((point.get('hour', 12) for point in data), dtype=np.int64, count=len(data))
+
+        result = self.update(entity_ids, values, hours)
+        return self.alerts(entity_ids, values, result)
+
+    def alerts(self, entity_ids: Sequence, values: np.ndarray, result: Dict[str, np.ndarray]) -> List[Dict]:
+        """Build alert dicts for the flagged readings of an update() result"""
+        alerts = []
+        timestamp = datetime.now().isoformat()
+
+        for i in np.flatnonzero(result['anomaly']):
+            j = int(np.abs(result['deviation'][i]).argmax())
+            feature = self.features[j]
+            direction = 1 if result['deviation'][i, j] > 0 else -1
+            score = float(result['score'][i])
+            alerts.append({
+                "agent_id": entity_ids[i],
+                "timestamp": timestamp,
+                "type": _ALERT_TYPES.get((feature, direction), "unusual_pattern"),
+                "severity": "high" if score > 2 * self.threshold else "medium",
+                "description": f"{feature} {'above' if direction > 0 else 'below'} baseline "
+                               f"({values[i, j]:.2f}, z={score:.1f})",
+                "score": score
+            })
+
+        return alerts
+
+    def retrain(self, min_samples: int = 100) -> bool:
+        """Refit the IsolationForest on the recent-readings buffer"""
+        if not SKLEARN_AVAILABLE:
+            return False
+
+        with self._lock:
+            n = len(self._samples) if self._sample_full else self._sample_pos
+            X = self._samples[:n].copy()
+        if n < min_samples:
+            return False
+
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        forest = IsolationForest(contamination=0.01, n_estimators=100, random_state=42)
+        forest.fit(scaler.fit_transform(X))
+        self._model = (scaler, forest)
+        return True
+
+    def start_background_retraining(self, interval: float = 300.0):
+        """Refit the IsolationForest every ``interval`` seconds in a daemon thread"""
+        if self._retrain_thread is not None and self._retrain_thread.is_alive():
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.retrain()
+                except Exception as e:
+                    print(f"⚠️ Streaming anomaly retraining failed: {e}")
+
+        self._stop.clear()
+        self._retrain_thread = threading.Thread(target=run, name='anomaly-retrain', daemon=True)
+        self._retrain_thread.start()
+
+    def stop_background_retraining(self):
+        self._stop.set()
+        if self._retrain_thread is not None:
+            self._retrain_thread.join(timeout=5)
+            self._retrain_thread = None
+
+# Global detector instance
+_streaming_detector = None
+
+def get_streaming_detector() -> StreamingAnomalyDetector:
+    """Get or create streaming anomaly detector singleton"""
+    global _streaming_detector
+    if _streaming_detector is None:
+        _streaming_detector = StreamingAnomalyDetector()
+    return _streaming_detector
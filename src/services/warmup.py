@@ -0,0 +1,135 @@
+"""
+Service Warm-up
+Import ML frameworks and build model services ahead of the first request
+"""
+import importlib
+import time
+import numpy as np
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .forecasting_service import get_forecasting_service
+from .anomaly_service import get_anomaly_service
+from .streaming_anomaly import get_streaming_detector
+
+
+def _import(*modules: str) -> Callable[[], None]:
+    def load():
+        for name in modules:
+            importlib.import_module(name, __package__)
+    return load
+
+
+# (name, step) in load order; frameworks first so service timings are their own
+WARMUP_STEPS: List[Tuple[str, Callable[[], object]]] = [
+    ('torch', _import('torch')),
+    ('sklearn', _import('sklearn.ensemble', 'sklearn.preprocessing')),
+    ('forecasting', get_forecasting_service),
+    ('anomaly', get_anomaly_service),
+    ('streaming_anomaly', get_streaming_detector),
+]
+
+RL_STEPS: List[Tuple[str, Callable[[], object]]] = [
+    ('rl', _import('stable_baselines3', 'gym', '..agents.rl_agent')),
+]
+
+
+def _forecast_inference():
+    """One 24h forecast so the LSTM (if loaded) allocates its buffers"""
+    history = [{'hour': hour, 'production': 1.0, 'consumption': 1.0, 'battery_pct': 0.5} for hour in range(24)]
+    get_forecasting_service().predict_24h(historical_data=history)
+
+
+def _anomaly_inference():
+    """One batch through the rules (and IsolationForest, if trained)"""
+    n = 8
+    get_anomaly_service().detect_anomalies_array(
+        production=np.ones(n), consumption=np.ones(n), battery_level=np.full(n, 50.0)
+    )
+
+
+# Dummy requests run after loading, before traffic is admitted
+INFERENCE_STEPS: List[Tuple[str, Callable[[], object]]] = [
+    ('forecast_inference', _forecast_inference),
+    ('anomaly_inference', _anomaly_inference),
+]
+
+
+def preload(include_rl: bool = False) -> Dict[str, float]:
+    """
+    Run the warm-up steps now instead of on first use
+
+    A step whose dependency is not installed is skipped (the service
+    falls back as it would at request time).
+
+    Returns:
+        seconds spent per completed step
+    """
+    timings = {}
+    for name, step in WARMUP_STEPS + (RL_STEPS if include_rl else []):
+        start = time.perf_counter()
+        try:
+            step()
+        except ImportError as e:
+            print(f"⚠️ Warm-up skipped {name}: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+class Readiness:
+    """
+    Warm-up progress, reported by /ready separately from /health liveness
+    """
+
+    def __init__(self):
+        self.status = 'pending'  # pending, warming, ready, failed
+        self.timings: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == 'ready'
+
+    def mark_ready(self):
+        self.status = 'ready'
+        self.finished_at = datetime.now().isoformat()
+
+    def to_dict(self) -> Dict:
+        return {
+            'status': self.status,
+            'steps': {name: round(seconds, 4) for name, seconds in self.timings.items()},
+            'error': self.error,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+def warm_up(readiness: Optional[Readiness] = None, extra_steps=(), include_rl: bool = False) -> Readiness:
+    """
+    Load frameworks and models, then run dummy inference
+
+    ``extra_steps`` are further (name, callable) steps run after the
+    dummy inference. Blocking; run it in a thread to keep the event loop
+    free. Any failure leaves ``readiness`` in the 'failed' state.
+    """
+    readiness = readiness or Readiness()
+    readiness.status = 'warming'
+    readiness.started_at = datetime.now().isoformat()
+    try:
+        readiness.timings.update(preload(include_rl))
+        for name, step in INFERENCE_STEPS + list(extra_steps):
+            start = time.perf_counter()
+            step()
+            readiness.timings[name] = time.perf_counter() - start
+    except Exception as e:
+        readiness.status = 'failed'
+        readiness.error = str(e)
+        readiness.finished_at = datetime.now().isoformat()
+        print(f"❌ Warm-up failed: {e}")
+        return readiness
+
+    readiness.mark_ready()
+    return readiness
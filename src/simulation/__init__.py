@@ -7,5 +7,7 @@ from .environment import SolarEnvironment
 from .battery import BatterySystem
 from .grid import GridConnection
 from .physics import SolarPhysics
+from .dispatch import EnergyDispatcher, DispatchResult
 
-__all__ = ['SolarEnvironment', 'BatterySystem', 'GridConnection', 'SolarPhysics']
+__all__ = ['SolarEnvironment', 'BatterySystem', 'GridConnection', 'SolarPhysics',
+           'EnergyDispatcher', 'DispatchResult']
@@ -0,0 +1,506 @@
+"""
+Device Store
+Sharded per-device command queues and telemetry history, persisted to SQLite
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from collections import deque
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from .instrumentation import SQLITE_ROWS_WRITTEN, SQLITE_WRITE_SECONDS
+
+TELEMETRY_FIELDS = ('voltage_v', 'current_a', 'power_w', 'temperature_c', 'battery_level_pct')
+
+# Hourly aggregates kept per device for forecasting
+HISTORY_HOURS = 24
+
+_SQLITE_WRITE_SECONDS = SQLITE_WRITE_SECONDS.labels('device_store')
+_SQLITE_ROWS_WRITTEN = SQLITE_ROWS_WRITTEN.labels('device_store')
+
+
+class _DeviceState:
+    """In-memory state of one device"""
+
+    __slots__ = ('telemetry', 'written', 'hour_bucket', 'hour_sum', 'hour_count', 'commands', 'last_seen')
+
+    def __init__(self, queue_size: int):
+        # Ring buffer of [timestamp, *TELEMETRY_FIELDS]; grows up to telemetry_size
+        self.telemetry = np.empty((8, len(TELEMETRY_FIELDS) + 1))
+        self.written = 0
+        self.hour_bucket = np.full(HISTORY_HOURS, -1, dtype=np.int64)
+        self.hour_sum = np.zeros((HISTORY_HOURS, len(TELEMETRY_FIELDS)))
+        self.hour_count = np.zeros(HISTORY_HOURS, dtype=np.int64)
+        self.commands = deque(maxlen=queue_size)
+        self.last_seen = 0.0
+
+
+class _Shard:
+    """Devices hashed to one lock, plus their unflushed writes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices: Dict[str, _DeviceState] = {}
+        self.telemetry_rows: List[tuple] = []
+        self.command_rows: List[tuple] = []
+
+
+class DeviceStore:
+    """
+    Per-device command queues and recent telemetry
+
+    Devices are spread over ``num_shards`` independently locked shards.
+    Each device keeps a ring buffer of its last ``telemetry_size`` readings,
+    hourly averages for the last 24 hours and a queue of its last
+    ``queue_size`` commands.
+
+    With a ``db_path`` every write is also buffered and flushed to SQLite
+    (WAL mode) in batches by a background thread, and the store is
+    restored from it on startup. Devices not seen for ``ttl_seconds`` are
+    evicted, along with persisted rows older than that.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = "data/device_store.db",
+        num_shards: int = 16,
+        telemetry_size: int = 256,
+        queue_size: int = 16,
+        ttl_seconds: float = 86400.0,
+        flush_interval: float = 1.0,
+        flush_batch: int = 1000
+    ):
+        self.db_path = db_path
+        self.telemetry_size = telemetry_size
+        self.queue_size = queue_size
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._shards = [_Shard() for _ in range(num_shards)]
+        self._command_ids = count(1)
+
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._flush_wanted = threading.Event()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if db_path is not None:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._init_db()
+            self._load()
+
+    # ------------------------------------------------------------------
+    # Persistence
+
+    def _init_db(self):
+        """Initialize database schema"""
+        columns = ', '.join(f"{name} REAL" for name in TELEMETRY_FIELDS)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS telemetry (
+                    device_id TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    {columns}
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_telemetry_device_ts ON telemetry(device_id, ts)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_telemetry_ts ON telemetry(ts)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS commands (
+                    device_id TEXT NOT NULL,
+                    command_id INTEGER NOT NULL,
+                    command TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (device_id, command_id)
+                )
+            """)
+
+    def _load(self):
+        """Restore recent telemetry, hourly history and command queues"""
+        cutoff = time.time() - self.ttl_seconds
+        fields = ', '.join(TELEMETRY_FIELDS)
+
+        rows = self._conn.execute(f"""
+            SELECT device_id, ts, {fields} FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY device_id ORDER BY ts DESC) AS rn
+                FROM telemetry WHERE ts >= ?
+            ) WHERE rn <= ? ORDER BY device_id, ts
+        """, (cutoff, self.telemetry_size))
+        for device_id, ts, *values in rows:
+            self._append(self._state(device_id), ts, values, aggregate=False)
+
+        sums = ', '.join(f"SUM({name})" for name in TELEMETRY_FIELDS)
+        rows = self._conn.execute(f"""
+            SELECT device_id, CAST(ts / 3600 AS INTEGER) AS bucket, COUNT(*), {sums}
+            FROM telemetry WHERE ts >= ? GROUP BY device_id, bucket ORDER BY device_id, bucket
+        """, (time.time() - HISTORY_HOURS * 3600,))
+        for device_id, bucket, n, *sums in rows:
+            state = self._state(device_id)
+            slot = bucket % HISTORY_HOURS
+            state.hour_bucket[slot] = bucket
+            state.hour_count[slot] = n
+            state.hour_sum[slot] = sums
+
+        rows = self._conn.execute("""
+            SELECT device_id, command_id, command, status, timestamp, updated FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY device_id ORDER BY command_id DESC) AS rn
+                FROM commands WHERE updated >= ?
+            ) WHERE rn <= ? ORDER BY device_id, command_id
+        """, (cutoff, self.queue_size))
+        for device_id, command_id, command, status, timestamp, updated in rows:
+            state = self._state(device_id)
+            state.commands.append({
+                'command_id': command_id,
+                'command': json.loads(command),
+                'status': status,
+                'timestamp': timestamp
+            })
+            state.last_seen = max(state.last_seen, updated)
+
+        max_id = self._conn.execute("SELECT MAX(command_id) FROM commands").fetchone()[0]
+        self._command_ids = count((max_id or 0) + 1)
+
+    def flush(self) -> int:
+        """Write buffered telemetry and command updates; returns rows written"""
+        if self._conn is None:
+            return 0
+
+        telemetry_rows, command_rows = [], []
+        for shard in self._shards:
+            with shard.lock:
+                telemetry_rows += shard.telemetry_rows
+                command_rows += shard.command_rows
+                shard.telemetry_rows = []
+                shard.command_rows = []
+
+        self._flush_rows(telemetry_rows, command_rows)
+        return len(telemetry_rows) + len(command_rows)
+
+    def _flush_rows(self, telemetry_rows: List[tuple], command_rows: List[tuple]):
+        if telemetry_rows or command_rows:
+            placeholders = ', '.join('?' * (len(TELEMETRY_FIELDS) + 2))
+            with self._db_lock:
+                start = time.perf_counter()
+                with self._conn:
+                    self._conn.executemany(f"INSERT INTO telemetry VALUES ({placeholders})", telemetry_rows)
+                    self._conn.executemany("INSERT OR REPLACE INTO commands VALUES (?, ?, ?, ?, ?, ?)", command_rows)
+                _SQLITE_WRITE_SECONDS.observe(time.perf_counter() - start)
+            _SQLITE_ROWS_WRITTEN.inc(len(telemetry_rows) + len(command_rows))
+
+    def start(self, evict_interval: float = 60.0):
+        """Flush every ``flush_interval`` seconds (or when a batch fills) and evict periodically"""
+        if self._conn is None or (self._flusher is not None and self._flusher.is_alive()):
+            return
+
+        def run():
+            last_evict = time.monotonic()
+            while not self._stop.is_set():
+                self._flush_wanted.wait(self.flush_interval)
+                self._flush_wanted.clear()
+                try:
+                    self.flush()
+                    if time.monotonic() - last_evict >= evict_interval:
+                        self.evict_stale()
+                        last_evict = time.monotonic()
+                except Exception as e:
+                    print(f"⚠️ Device store flush failed: {e}")
+
+        self._stop.clear()
+        self._flusher = threading.Thread(target=run, name='device-store-flush', daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        """Stop the flusher and write everything still buffered"""
+        self._stop.set()
+        self._flush_wanted.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+    # ------------------------------------------------------------------
+    # Devices
+
+    def _shard(self, device_id: str) -> _Shard:
+        return self._shards[zlib.crc32(device_id.encode('utf-8')) % len(self._shards)]
+
+    def _state(self, device_id: str) -> _DeviceState:
+        """Device state, created if missing (caller holds the shard lock)"""
+        devices = self._shard(device_id).devices
+        state = devices.get(device_id)
+        if state is None:
+            state = devices[device_id] = _DeviceState(self.queue_size)
+        return state
+
+    def _buffered(self, shard: _Shard):
+        """Wake the flusher once a shard's buffer holds a full batch (caller holds the shard lock)"""
+        if self._conn is not None and len(shard.telemetry_rows) + len(shard.command_rows) >= self.flush_batch:
+            self._flush_wanted.set()
+            if self._flusher is None:
+                # No background flusher: write this shard's batch now
+                self._flush_rows(shard.telemetry_rows, shard.command_rows)
+                shard.telemetry_rows = []
+                shard.command_rows = []
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._shard(device_id).devices
+
+    def __len__(self) -> int:
+        return sum(len(shard.devices) for shard in self._shards)
+
+    def devices(self) -> List[str]:
+        return [device_id for shard in self._shards for device_id in list(shard.devices)]
+
+    def evict_stale(self, now: Optional[float] = None) -> List[str]:
+        """Drop devices not seen within ``ttl_seconds`` and expired rows"""
+        cutoff = (now if now is not None else time.time()) - self.ttl_seconds
+        evicted = []
+        for shard in self._shards:
+            with shard.lock:
+                stale = [device_id for device_id, state in shard.devices.items() if state.last_seen < cutoff]
+                for device_id in stale:
+                    del shard.devices[device_id]
+            evicted += stale
+
+        if self._conn is not None:
+            with self._db_lock, self._conn:
+                self._conn.execute("DELETE FROM telemetry WHERE ts < ?", (cutoff,))
+                self._conn.execute("DELETE FROM commands WHERE updated < ?", (cutoff,))
+        return evicted
+
+    # ------------------------------------------------------------------
+    # Telemetry
+
+    def _append(self, state: _DeviceState, ts: float, values: Sequence[float], aggregate: bool = True):
+        buffer = state.telemetry
+        if state.written == len(buffer) and len(buffer) < self.telemetry_size:
+            # Still filling: grow instead of wrapping
+            grown = np.empty((min(2 * len(buffer), self.telemetry_size), buffer.shape[1]))
+            grown[:len(buffer)] = buffer
+            buffer = state.telemetry = grown
+        row = buffer[state.written % len(buffer)]
+        row[0] = ts
+        row[1:] = values
+        state.written += 1
+        state.last_seen = max(state.last_seen, ts)
+
+        if aggregate:
+            bucket = int(ts // 3600)
+            slot = bucket % HISTORY_HOURS
+            if state.hour_bucket[slot] != bucket:
+                state.hour_bucket[slot] = bucket
+                state.hour_sum[slot] = 0.0
+                state.hour_count[slot] = 0
+            state.hour_sum[slot] += row[1:]
+            state.hour_count[slot] += 1
+
+    def record_telemetry(self, device_id: str, reading: Dict, timestamp: Optional[float] = None):
+        """Store one reading (a sensor_data dict; missing fields are 0)"""
+        self.record_batch([device_id], {name: [reading.get(name, 0.0)] for name in TELEMETRY_FIELDS}, timestamp)
+
+    def record_batch(self, device_ids: Sequence[str], columns: Dict, timestamp: Optional[float] = None):
+        """Store readings given as TELEMETRY_FIELDS column arrays"""
+        n = len(device_ids)
+        if n == 0:
+            return
+        ts = timestamp if timestamp is not None else time.time()
+        values = np.zeros((n, len(TELEMETRY_FIELDS)))
+        for j, name in enumerate(TELEMETRY_FIELDS):
+            if name in columns:
+                values[:, j] = columns[name]
+
+        by_shard: Dict[int, List[int]] = {}
+        for i, device_id in enumerate(device_ids):
+            by_shard.setdefault(zlib.crc32(device_id.encode('utf-8')) % len(self._shards), []).append(i)
+
+        persist = self._conn is not None
+        for shard_index, indices in by_shard.items():
+            shard = self._shards[shard_index]
+            with shard.lock:
+                for i in indices:
+                    self._append(self._state(device_ids[i]), ts, values[i])
+                if persist:
+                    shard.telemetry_rows.extend(
+                        (device_ids[i], ts, *values[i].tolist()) for i in indices
+                    )
+                    self._buffered(shard)
+
+    def telemetry(self, device_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Recent readings, oldest first"""
+        shard = self._shard(device_id)
+        with shard.lock:
+            state = shard.devices.get(device_id)
+            if state is None:
+                return []
+            size = len(state.telemetry)
+            if state.written <= size:
+                rows = state.telemetry[:state.written].copy()
+            else:
+                start = state.written % size
+                rows = np.concatenate([state.telemetry[start:], state.telemetry[:start]])
+
+        if limit is not None:
+            rows = rows[-limit:] if limit > 0 else rows[:0]
+        return [
+            dict(zip(TELEMETRY_FIELDS, row[1:].tolist()), timestamp=datetime.fromtimestamp(row[0]).isoformat())
+            for row in rows
+        ]
+
+    def hourly_history(self, device_id: str, hours: int = HISTORY_HOURS) -> List[Dict]:
+        """
+        Hourly averages for the last ``hours`` hours with data, oldest first,
+        as forecasting / anomaly data points
+        """
+        shard = self._shard(device_id)
+        with shard.lock:
+            state = shard.devices.get(device_id)
+            if state is None:
+                return []
+            buckets = state.hour_bucket.copy()
+            sums = state.hour_sum.copy()
+            counts = state.hour_count.copy()
+
+        valid = (buckets >= 0) & (buckets > buckets.max() - HISTORY_HOURS)
+        order = np.flatnonzero(valid)[np.argsort(buckets[valid])][-hours:]
+        means = sums[order] / counts[order, None]
+        power = TELEMETRY_FIELDS.index('power_w')
+        battery = TELEMETRY_FIELDS.index('battery_level_pct')
+
+        points = []
+        for bucket, mean in zip(buckets[order], means):
+            production = mean[power] / 1000.0
+            points.append({
+                'agent_id': device_id,
+                'hour': datetime.fromtimestamp(int(bucket) * 3600).hour,
+                'production': production,
+                'consumption': 0.0,
+                'battery_level': mean[battery],
+                'battery_pct': mean[battery] / 100.0,
+                'net_energy': production
+            })
+        return points
+
+    # ------------------------------------------------------------------
+    # Commands
+
+    def _persist_command(self, shard: _Shard, device_id: str, record: Dict, updated: float):
+        if self._conn is not None:
+            shard.command_rows.append((
+                device_id, record['command_id'], json.dumps(record['command']),
+                record['status'], record['timestamp'], updated
+            ))
+            self._buffered(shard)
+
+    def push_command(self, device_id: str, command: Dict, timestamp: Optional[str] = None,
+                     supersede: bool = True) -> Dict:
+        """
+        Queue a command for the device and return its record
+
+        With ``supersede`` any commands still pending for the device are
+        marked 'superseded' (the latest decision replaces earlier ones).
+        """
+        now = time.time()
+        record = {
+            'command_id': next(self._command_ids),
+            'command': command,
+            'status': 'pending',
+            'timestamp': timestamp or datetime.now().isoformat()
+        }
+        shard = self._shard(device_id)
+        with shard.lock:
+            state = self._state(device_id)
+            if supersede:
+                for previous in state.commands:
+                    if previous['status'] == 'pending':
+                        previous['status'] = 'superseded'
+                        self._persist_command(shard, device_id, previous, now)
+            state.commands.append(record)
+            state.last_seen = max(state.last_seen, now)
+            self._persist_command(shard, device_id, record, now)
+        return record
+
+    def pending_commands(self, device_id: str) -> List[Dict]:
+        """Commands not yet delivered or acknowledged, oldest first"""
+        shard = self._shard(device_id)
+        with shard.lock:
+            state = shard.devices.get(device_id)
+            if state is None:
+                return []
+            return [record for record in state.commands if record['status'] == 'pending']
+
+    def commands(self, device_id: str) -> List[Dict]:
+        """The device's command queue, oldest first"""
+        shard = self._shard(device_id)
+        with shard.lock:
+            state = shard.devices.get(device_id)
+            return list(state.commands) if state is not None else []
+
+    def latest_command(self, device_id: str) -> Optional[Dict]:
+        commands = self.commands(device_id)
+        return commands[-1] if commands else None
+
+    def set_command_status(self, device_id: str, command_id: Optional[int], status: str,
+                           expected: Optional[str] = None) -> Optional[Dict]:
+        """
+        Update a command's status (the latest command if ``command_id`` is None)
+
+        With ``expected`` the update only applies from that status. Returns
+        the updated record, or None if nothing changed.
+        """
+        shard = self._shard(device_id)
+        with shard.lock:
+            state = shard.devices.get(device_id)
+            if state is None or not state.commands:
+                return None
+            if command_id is None:
+                record = state.commands[-1]
+            else:
+                record = next((r for r in state.commands if r['command_id'] == command_id), None)
+            if record is None or (expected is not None and record['status'] != expected):
+                return None
+            record['status'] = status
+            self._persist_command(shard, device_id, record, time.time())
+            return record
+
+
+# Global store instance
+_device_store = None
+_device_store_lock = threading.Lock()
+
+def get_device_store() -> DeviceStore:
+    """Get or create device store singleton (configured from the ``iot`` config section)"""
+    global _device_store
+    if _device_store is None:
+        # Startup may be restoring it on another thread
+        with _device_store_lock:
+            if _device_store is None:
+                from ..config import config
+                _device_store = DeviceStore(
+                    db_path=config.get('iot.device_store.path', 'data/device_store.db'),
+                    num_shards=config.get('iot.device_store.shards', 16),
+                    telemetry_size=config.get('iot.device_store.telemetry_size', 256),
+                    queue_size=config.get('iot.device_store.queue_size', 16),
+                    ttl_seconds=config.get('iot.device_store.ttl_seconds', 86400),
+                    flush_interval=config.get('iot.device_store.flush_interval_seconds', 1.0)
+                )
+    return _device_store
+
+def close_device_store():
+    """Close the singleton if it was ever created (without creating it)"""
+    with _device_store_lock:
+        if _device_store is not None:
+            _device_store.close()
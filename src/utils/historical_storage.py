@@ -4,10 +4,13 @@ Stores simulation results in SQLite database
 """
 import sqlite3
 import json
+import time
 from datetime import datetime
 from typing import Dict, List, Optional
 from pathlib import Path
 
+from .instrumentation import SQLITE_ROWS_WRITTEN, SQLITE_WRITE_SECONDS
+
 class HistoricalStorage:
     """Store and retrieve simulation history"""
     
@@ -97,6 +100,8 @@ class HistoricalStorage:
         step_results: List[Dict] = None
     ) -> int:
         """Save a complete simulation"""
+        start = time.perf_counter()
+        rows = 1
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
@@ -156,6 +161,7 @@ class HistoricalStorage:
                     result.get('avg_battery', 0),
                     result.get('active_agents', 0)
                 ))
+                rows += 1
                 
                 # Energy flows
                 for flow in result.get('energy_flows', []):
@@ -170,9 +176,34 @@ class HistoricalStorage:
                         flow.get('to'),
                         flow.get('amount', 0)
                     ))
+                    rows += 1
+                
+                # Per-agent state (kWh), for retraining the anomaly model
+                agent_states = result.get('agent_states', [])
+                cursor.executemany("""
+                    INSERT INTO agent_states (
+                        simulation_id, hour, agent_id, production, consumption,
+                        battery_level, battery_capacity, status
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (
+                        simulation_id,
+                        hour,
+                        state.get('id'),
+                        state.get('production', 0),
+                        state.get('consumption', 0),
+                        state.get('battery', 0),
+                        state.get('battery_capacity'),
+                        state.get('status')
+                    )
+                    for state in agent_states
+                ])
+                rows += len(agent_states)
         
         conn.commit()
         conn.close()
+        SQLITE_WRITE_SECONDS.labels('history').observe(time.perf_counter() - start)
+        SQLITE_ROWS_WRITTEN.labels('history').inc(rows)
         
         return simulation_id
     
@@ -246,6 +277,44 @@ class HistoricalStorage:
         conn.close()
         return simulation
     
+    def get_recent_hourly_metrics(self, limit: int = 5000) -> List[Dict]:
+        """Most recent hourly metrics rows, oldest first, for model retraining"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT * FROM (
+                SELECT * FROM hourly_metrics
+                ORDER BY id DESC
+                LIMIT ?
+            ) ORDER BY simulation_id, hour
+        """, (limit,))
+        
+        rows = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+        
+        conn.close()
+        return [dict(zip(columns, row)) for row in rows]
+    
+    def get_recent_agent_states(self, limit: int = 50000) -> List[Dict]:
+        """Most recent per-agent state rows, oldest first, for model retraining"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT * FROM (
+                SELECT * FROM agent_states
+                ORDER BY id DESC
+                LIMIT ?
+            ) ORDER BY simulation_id, hour, agent_id
+        """, (limit,))
+        
+        rows = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+        
+        conn.close()
+        return [dict(zip(columns, row)) for row in rows]
+    
     def get_metrics_history(self, hours: int = 24) -> Dict:
         """Get aggregated metrics over time"""
         conn = sqlite3.connect(self.db_path)
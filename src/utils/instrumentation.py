@@ -0,0 +1,368 @@
+"""
+Instrumentation
+Low-overhead counters, gauges and latency histograms for the hot paths,
+exported in the Prometheus text format
+"""
+import bisect
+import functools
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond rule checks up to multi-second LSTM runs
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class _Timer:
+    """Context manager / decorator observing elapsed seconds into a histogram"""
+
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, func):
+        histogram = self._histogram
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+
+
+class _CounterValue:
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class _GaugeValue:
+    __slots__ = ('_value', '_lock', '_function')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from ``function`` at scrape time (nothing on the hot path)"""
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return math.nan
+        return self._value
+
+
+class _HistogramValue:
+    __slots__ = ('_bounds', '_counts', '_sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        # Bucket ``le=b`` holds values <= b; cumulated at scrape time
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """(cumulative bucket counts including +Inf, sum)"""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = [], 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+
+class _Metric:
+    """
+    A metric family: one value per combination of label values
+
+    Without ``labelnames`` the family has a single value and the value
+    methods (inc, observe, ...) can be called on it directly. Hot paths
+    should resolve ``labels(...)`` once and keep the child.
+    """
+
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['MetricsRegistry'] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @property
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use labels(...)")
+        return self._children[()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class Counter(_Metric):
+    """Monotonic count (name it ``*_total``); graph it with rate()"""
+
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    @property
+    def value(self) -> float:
+        return self._default.value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time"""
+
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default.set_function(function)
+
+    @property
+    def value(self) -> float:
+        return self._default.value
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets (plus their sum and count)"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional['MetricsRegistry'] = None):
+        self.buckets = tuple(sorted(float(b) for b in buckets if not math.isinf(b)))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return _Timer(self._default)
+
+    @property
+    def count(self) -> int:
+        return self._default.count
+
+    @property
+    def sum(self) -> float:
+        return self._default.sum
+
+    def _render_child(self, key, child) -> List[str]:
+        names = self.labelnames + ('le',)
+        cumulative, total = child.snapshot()
+        lines = [
+            f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {count}"
+            for bound, count in zip(self.buckets + (math.inf,), cumulative)
+        ]
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metric families rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# ============================================================================
+# Hot-path metrics
+
+SIMULATION_STEP_SECONDS = Histogram(
+    'solar_simulation_step_seconds', 'Duration of one swarm simulation timestep'
+)
+DECISION_SECONDS = Histogram(
+    'solar_decision_seconds', 'Time spent making energy decisions per call', ['source']
+)
+ANOMALY_DETECTION_SECONDS = Histogram(
+    'solar_anomaly_detection_seconds', 'Anomaly detection latency per batch', ['detector']
+)
+FORECAST_SECONDS = Histogram(
+    'solar_forecast_seconds', '24h production forecast latency', ['model']
+)
+WEBSOCKET_BROADCAST_SECONDS = Histogram(
+    'solar_websocket_broadcast_seconds', 'Time to send one simulation update to every WebSocket client'
+)
+WEBSOCKET_SEND_FAILURES = Counter(
+    'solar_websocket_send_failures_total', 'WebSocket sends that failed and dropped the client'
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    'solar_websocket_connections', 'Open WebSocket connections', ['channel']
+)
+COMMAND_QUEUE_DEPTH = Gauge(
+    'solar_command_queue_depth', 'Commands queued for push delivery but not yet sent'
+)
+LONG_POLL_WAITING = Gauge(
+    'solar_long_poll_waiting_devices', 'Devices holding an /iot/command long-poll'
+)
+SQLITE_WRITE_SECONDS = Histogram(
+    'solar_sqlite_write_seconds', 'SQLite write transaction latency', ['store']
+)
+SQLITE_ROWS_WRITTEN = Counter(
+    'solar_sqlite_rows_written_total', 'Rows written to SQLite', ['store']
+)
+IOT_REQUESTS = Counter(
+    'solar_iot_requests_total', 'IoT ingestion requests (MQTT: batches)', ['endpoint']
+)
+IOT_READINGS = Counter(
+    'solar_iot_readings_total', 'IoT sensor readings ingested', ['endpoint']
+)
+IOT_REQUEST_SECONDS = Histogram(
+    'solar_iot_request_seconds', 'IoT ingestion pipeline latency per request', ['endpoint']
+)
+
+
+def record_iot_request(endpoint: str, readings: int, seconds: float):
+    """Count an ingestion request and its readings, and observe its latency"""
+    IOT_REQUESTS.labels(endpoint).inc()
+    IOT_READINGS.labels(endpoint).inc(readings)
+    IOT_REQUEST_SECONDS.labels(endpoint).observe(seconds)
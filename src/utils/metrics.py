@@ -1,5 +1,4 @@
 import numpy as np
-from sklearn.metrics import mean_squared_error, mean_absolute_error
 
 class PerformanceEvaluator:
     """
@@ -13,6 +12,8 @@ class PerformanceEvaluator:
         """
         Evaluate forecasting model accuracy
         """
+        from sklearn.metrics import mean_squared_error, mean_absolute_error
+        
         rmse = np.sqrt(mean_squared_error(y_true, y_pred))
         mae = mean_absolute_error(y_true, y_pred)
         mape = np.mean(np.abs((y_true - y_pred) / y_true)) * 100
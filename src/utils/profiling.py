@@ -0,0 +1,205 @@
+"""
+Profiling
+Optional tracing spans around simulation phases, aggregated into a per-run
+report and exportable as Chrome trace events
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class _NullSpan:
+    """Shared no-op span returned while profiling is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self._profiler = profiler
+        self._name = name
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self._profiler.record(self._name, self._start, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    """
+    Collects span timings for one run
+
+    Every span is aggregated by name (calls, total, min, max). With
+    ``trace=True`` each span is also kept as a Chrome trace event (up to
+    ``max_events``) for chrome://tracing or Perfetto. Spans may nest and
+    may come from several threads.
+    """
+
+    def __init__(self, trace: bool = False, max_events: int = 1_000_000):
+        self.trace = trace
+        self.max_events = max_events
+        self.events: List[Dict] = []
+        self.dropped_events = 0
+        self._stats: Dict[str, List[int]] = {}  # name -> [calls, total_ns, min_ns, max_ns]
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+        self._finished: Optional[int] = None
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def record(self, name: str, start_ns: int, end_ns: int):
+        duration = end_ns - start_ns
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = [1, duration, duration, duration]
+            else:
+                stats[0] += 1
+                stats[1] += duration
+                if duration < stats[2]:
+                    stats[2] = duration
+                if duration > stats[3]:
+                    stats[3] = duration
+            if self.trace:
+                if len(self.events) < self.max_events:
+                    self.events.append({
+                        'name': name,
+                        'ph': 'X',
+                        'ts': (start_ns - self._origin) / 1000.0,
+                        'dur': duration / 1000.0,
+                        'pid': os.getpid(),
+                        'tid': threading.get_ident(),
+                    })
+                else:
+                    self.dropped_events += 1
+
+    def finish(self):
+        """Stop the run clock used for the report's share of wall time"""
+        if self._finished is None:
+            self._finished = time.perf_counter_ns()
+
+    @property
+    def wall_seconds(self) -> float:
+        end = self._finished if self._finished is not None else time.perf_counter_ns()
+        return (end - self._origin) / 1e9
+
+    def report(self) -> Dict[str, Dict]:
+        """Per-span statistics, slowest total first"""
+        wall = self.wall_seconds
+        with self._lock:
+            stats = {name: list(values) for name, values in self._stats.items()}
+        report = {}
+        for name, (calls, total, low, high) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            report[name] = {
+                'calls': calls,
+                'total_s': total / 1e9,
+                'mean_ms': total / calls / 1e6,
+                'min_ms': low / 1e6,
+                'max_ms': high / 1e6,
+                'pct_of_run': 100.0 * total / 1e9 / wall if wall > 0 else 0.0,
+            }
+        return report
+
+    def format_report(self) -> str:
+        lines = [
+            f"Profile: {self.wall_seconds:.3f}s wall",
+            f"{'span':<32}{'calls':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}{'% run':>8}",
+        ]
+        for name, row in self.report().items():
+            lines.append(
+                f"{name:<32}{row['calls']:>8}{row['total_s']:>10.3f}{row['mean_ms']:>10.3f}"
+                f"{row['max_ms']:>10.3f}{row['pct_of_run']:>8.1f}"
+            )
+        return '\n'.join(lines)
+
+    def chrome_trace(self) -> Dict:
+        with self._lock:
+            events = list(self.events)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path: str):
+        """Write the trace-event JSON (requires ``trace=True``)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+# The profiler spans report to; None while profiling is off
+_active: Optional[Profiler] = None
+
+
+def span(name: str):
+    """
+    Time the enclosed block as ``name`` in the active profiler
+
+    While profiling is off this returns a shared no-op context manager,
+    so instrumented code pays one global lookup per span.
+    """
+    profiler = _active
+    if profiler is None:
+        return NULL_SPAN
+    return _Span(profiler, name)
+
+
+def traced(name: str):
+    """Decorator form of ``span`` for a whole function"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return func(*args, **kwargs)
+            with _Span(profiler, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def active_profiler() -> Optional[Profiler]:
+    return _active
+
+
+@contextmanager
+def profile(trace_path: Optional[str] = None, trace: bool = False) -> Iterator[Profiler]:
+    """
+    Profile the spans run inside the block
+
+    Usage:
+        with profile(trace_path='results/trace.json') as profiler:
+            simulator.run(hours=24)
+        print(profiler.format_report())
+
+    The Chrome trace is written to ``trace_path`` (if given) on exit.
+    """
+    global _active
+    profiler = Profiler(trace=trace or trace_path is not None)
+    previous, _active = _active, profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        profiler.finish()
+        if trace_path is not None:
+            profiler.write_chrome_trace(trace_path)
@@ -0,0 +1,242 @@
+"""
+Test Advanced Module
+"""
+
+import pytest
+import numpy as np
+import torch
+from src.advanced.blockchain import EnergyBlockchain, ProofOfAuthority
+from src.advanced.ledger_store import LedgerStore
+from src.advanced.federated_learning import (
+    FederatedLearning, QuantizeCompressor, TopKCompressor, encode_update, flatten_state
+)
+from src.advanced.graph_network import (
+    EnergyFlowGNN, NeighborhoodGraphBuilder, create_neighborhood_graph,
+    optimize_energy_flows, radius_graph_edges
+)
+from src.agents.base_agent import SolarPanelAgent
+
+
+class TestEnergyBlockchain:
+    """Test energy trading ledger"""
+    
+    def test_balance_index(self):
+        """Test balances are tracked as blocks are mined"""
+        chain = EnergyBlockchain()
+        chain.add_transaction('a', 'b', 2.0, 0.1)
+        chain.add_transaction('b', 'c', 1.0, 0.2)
+        chain.mine_pending_transactions('miner')
+        
+        assert chain.get_balance('a') == pytest.approx(-0.2)
+        assert chain.get_balance('b') == pytest.approx(0.0)
+        assert chain.get_balance('c') == pytest.approx(0.2)
+        assert chain.get_latest_block().hash.startswith('00')
+    
+    def test_tampering_detected(self):
+        """Test Merkle root catches edited transactions"""
+        chain = EnergyBlockchain()
+        chain.add_transaction('a', 'b', 2.0, 0.1)
+        chain.mine_pending_transactions('miner')
+        assert chain.is_chain_valid()
+        
+        chain.chain[1].transactions[0]['amount_kwh'] = 20.0
+        assert not chain.is_chain_valid()
+    
+    def test_validate_new_blocks(self):
+        """Test the incremental check covers only blocks added since the last pass"""
+        chain = EnergyBlockchain()
+        chain.add_transaction('a', 'b', 2.0, 0.1)
+        chain.mine_pending_transactions('miner')
+        assert chain.validate_new_blocks()
+        
+        chain.chain[1].transactions[0]['amount_kwh'] = 20.0
+        assert chain.validate_new_blocks()  # already validated, not rechecked
+        
+        chain.add_transaction('b', 'c', 1.0, 0.1)
+        chain.mine_pending_transactions('miner')
+        chain.chain[2].transactions[0]['amount_kwh'] = 5.0
+        assert not chain.validate_new_blocks()
+    
+    def test_proof_of_authority(self):
+        """Test authority consensus seals without mining"""
+        consensus = ProofOfAuthority({'utility': 'secret'}, signer='utility')
+        chain = EnergyBlockchain(consensus=consensus)
+        for _ in range(5):
+            chain.add_transaction('a', 'b', 1.0, 0.1)
+            chain.mine_pending_transactions('utility')
+        
+        assert chain.is_chain_valid()
+        assert all(block.nonce == 0 for block in chain.chain)
+        
+        chain.chain[3].signature = 'forged'
+        assert not chain.is_chain_valid()
+
+
+class TestLedgerStore:
+    """Test persistent ledger storage"""
+    
+    def test_chain_survives_restart(self, tmp_path):
+        """Test blocks and balances reload from disk"""
+        store = LedgerStore(tmp_path, segment_size=512)
+        chain = EnergyBlockchain(storage=store)
+        for i in range(4):
+            chain.add_transaction('a', 'b', 1.0 + i, 0.1)
+            chain.mine_pending_transactions('miner')
+        tip = chain.get_latest_block().hash
+        store.close()
+        
+        assert len(list(tmp_path.glob('segment_*.log'))) > 1
+        
+        store = LedgerStore(tmp_path, segment_size=512)
+        reloaded = EnergyBlockchain(storage=store)
+        assert len(reloaded.chain) == 5
+        assert reloaded.get_latest_block().hash == tip
+        assert reloaded.get_balance('b') == pytest.approx(1.0)
+        assert reloaded.is_chain_valid()
+        store.close()
+    
+    def test_torn_tail_recovery(self, tmp_path):
+        """Test a partial record and index entry are dropped on open"""
+        store = LedgerStore(tmp_path, fsync=False)
+        store.append({'index': 0, 'transactions': []})
+        store.append({'index': 1, 'transactions': [{'from': 'a', 'to': 'b'}]})
+        store.close()
+        
+        with open(tmp_path / 'segment_00000.log', 'ab') as f:
+            f.write(b'\x40\x00\x00\x00garbage')
+        with open(tmp_path / 'blocks.idx', 'ab') as f:
+            f.write(b'\x01\x02')
+        
+        store = LedgerStore(tmp_path, fsync=False)
+        assert len(store) == 2
+        assert store.read_block(-1)['index'] == 1
+        assert store.transaction_locations('b') == [(1, 0)]
+        
+        store.append({'index': 2, 'transactions': []})
+        assert store.read_block(2)['index'] == 2
+        store.close()
+
+
+class TestFederatedLearning:
+    """Test federated training"""
+    
+    @staticmethod
+    def make_client_data(num_clients, batches):
+        torch.manual_seed(0)
+        return [
+            [(torch.randn(8, 10), torch.randn(8, 1)) for _ in range(batches)]
+            for _ in range(num_clients)
+        ]
+    
+    def test_weighted_aggregation(self):
+        """Test FedAvg weights updates by sample count"""
+        fl = FederatedLearning(num_clients=2)
+        a = {key: torch.zeros_like(v) for key, v in fl.global_model.state_dict().items()}
+        b = {key: torch.ones_like(v) for key, v in fl.global_model.state_dict().items()}
+        
+        averaged = fl.aggregate_weights(iter([(a, 30), (b, 10)]))
+        
+        for value in averaged.values():
+            assert torch.allclose(value, torch.full_like(value, 0.25))
+    
+    def test_parallel_round_matches_sequential(self):
+        """Test process pool training gives the sequential result"""
+        data = self.make_client_data(4, batches=2)
+        
+        sequential = FederatedLearning(num_clients=4, local_epochs=1)
+        parallel = FederatedLearning(num_clients=4, num_workers=2, local_epochs=1)
+        parallel.global_model.load_state_dict(sequential.global_model.state_dict())
+        
+        sequential.train_round(data)
+        parallel.train_round(data)
+        parallel.close()
+        
+        # Adam's first step is ~lr * sign(grad), so allow one step of drift
+        # from thread-count dependent rounding on near-zero gradients
+        for key, value in sequential.global_model.state_dict().items():
+            assert torch.allclose(value, parallel.global_model.state_dict()[key], atol=1e-3)
+    
+    def test_client_sampling(self):
+        """Test only a subset of clients trains per round"""
+        fl = FederatedLearning(num_clients=10, clients_per_round=3, local_epochs=1, seed=0)
+        clients = fl.train_round(self.make_client_data(10, batches=1))
+        
+        assert len(clients) == 3
+        assert len(set(clients)) == 3
+    
+    def test_compressed_updates(self):
+        """Test compressed rounds shrink uploads and keep residuals"""
+        data = self.make_client_data(4, batches=1)
+        fl = FederatedLearning(num_clients=4, local_epochs=1, compressor=TopKCompressor(0.1))
+        initial = flatten_state(fl.global_model.state_dict())
+        
+        fl.train_round(data)
+        
+        stats = fl.communication_log[-1]
+        assert stats['upload_bytes'] * 4 < stats['dense_bytes']
+        assert set(fl.residuals) == {0, 1, 2, 3}
+        assert not torch.equal(flatten_state(fl.global_model.state_dict()), initial)
+    
+    def test_quantization_error_feedback(self):
+        """Test int8 round trip and that the residual carries the error"""
+        delta = torch.randn(1000)
+        payload, num_bytes, residual = encode_update(
+            {'w': torch.zeros(1000)}, {'w': delta}, QuantizeCompressor(chunk_size=100)
+        )
+        decoded = QuantizeCompressor(chunk_size=100).decompress(payload, 1000)
+        
+        assert num_bytes == 1000 + 10 * 4
+        assert torch.allclose(decoded + residual, delta)
+        assert residual.abs().max() < delta.abs().max() / 100
+
+
+class TestGraphNetwork:
+    """Test neighborhood graph construction and GNN inference"""
+    
+    @staticmethod
+    def make_agents(n):
+        agents = []
+        for i in range(n):
+            agent = SolarPanelAgent(i)
+            agent.update_state(production=i % 5, consumption=1.0)
+            agents.append(agent)
+        return agents
+    
+    def test_radius_graph_matches_pairwise(self):
+        """Test KD-tree edges equal the brute-force distance check"""
+        positions = np.random.default_rng(0).uniform(0, 20, size=(200, 2))
+        edge_index = radius_graph_edges(positions, radius=3.0)
+        
+        distance = np.linalg.norm(positions[:, None] - positions[None], axis=-1)
+        expected = {(i, j) for i, j in zip(*np.nonzero(distance < 3.0)) if i != j}
+        assert set(map(tuple, edge_index.t().tolist())) == expected
+    
+    def test_graph_cached_for_static_agents(self):
+        """Test edges are reused while positions are unchanged"""
+        builder = NeighborhoodGraphBuilder(radius=1.5)
+        agents = self.make_agents(25)
+        
+        first = create_neighborhood_graph(agents, builder)
+        agents[0].production = 9.0
+        second = create_neighborhood_graph(agents, builder)
+        
+        assert second.edge_index is first.edge_index
+        assert second.x[0, 0] == 9.0
+        assert first.x.shape == (25, 5)
+    
+    def test_sampled_inference_matches_full_graph(self):
+        """Test mini-batch inference is exact when sampling covers the graph"""
+        torch.manual_seed(0)
+        model = EnergyFlowGNN()
+        agents = self.make_agents(30)
+        builder = NeighborhoodGraphBuilder(radius=1.5)
+        
+        full = optimize_energy_flows(agents, model, builder=builder)
+        sampled = optimize_energy_flows(agents, model, batch_size=8,
+                                        num_neighbors=(-1, -1, -1, -1, -1, -1, -1, -1, -1, -1),
+                                        builder=builder)
+        bounded = optimize_energy_flows(agents, model, batch_size=8, num_neighbors=(2, 2, 2),
+                                        builder=builder)
+        
+        assert torch.allclose(full, sampled, atol=1e-5)
+        assert bounded.shape == full.shape
@@ -69,6 +69,16 @@ class TestSwarmSimulator:
         assert 'grid_import' in results
         assert len(results['solar_used']) == 2
 
+    
+    def test_dispatch_step(self):
+        """Test energy flows come from the dispatch stage when enabled"""
+        sim = SwarmSimulator(num_agents=8, dispatch=True)
+        result = sim.step(12)
+        
+        assert sim.last_dispatch is not None
+        assert result['energy_flows'] == sim.last_dispatch.flows
+        assert result['total_shared'] == pytest.approx(sim.last_dispatch.total_shared)
+
 
 class TestCommunication:
     """Test communication protocols"""
@@ -94,6 +104,41 @@ class TestCommunication:
         assert len(messages) == 1
         assert messages[0].sender_id == 0
     
+    def test_priority_and_broadcast_cursors(self):
+        """Test priority ordering and once-per-agent broadcast delivery"""
+        from src.agents.communication import Message
+        from datetime import datetime
+        
+        protocol = CommunicationProtocol()
+        now = datetime.now().timestamp()
+        protocol.send_message(Message(0, 1, 'status', {}, now, priority=0))
+        protocol.send_message(Message(2, 1, 'request', {}, now, priority=5))
+        protocol.broadcast(sender_id=3, message_type='status', content={'battery': 80})
+        
+        messages = protocol.get_messages_for_agent(1)
+        assert [m.priority for m in messages] == [5, 0, 0]
+        assert messages[-1].receiver_id == -1
+        
+        # Already delivered, and never echoed to the sender
+        assert protocol.get_messages_for_agent(1) == []
+        assert protocol.get_messages_for_agent(3) == []
+        assert len(protocol.get_messages_for_agent(4)) == 1
+    
+    def test_expiry_and_bounded_history(self, tmp_path):
+        """Test time-based expiry and history spill"""
+        from src.agents.communication import Message
+        
+        history_file = tmp_path / "history.jsonl"
+        protocol = CommunicationProtocol(history_size=10, history_path=str(history_file))
+        for i in range(25):
+            protocol.send_message(Message(0, 1, 'status', {'i': i}, 0.0))
+        
+        assert len(protocol.message_history) <= 10
+        assert len(history_file.read_text().splitlines()) + len(protocol.message_history) == 25
+        
+        protocol.clear_expired(max_age_seconds=60)
+        assert protocol.get_messages_for_agent(1) == []
+    
     def test_energy_negotiation(self):
         """Test energy trading"""
         negotiator = EnergyNegotiator()
@@ -105,6 +150,290 @@ class TestCommunication:
         assert len(negotiator.completed_trades) == 1
         assert negotiator.completed_trades[0]['energy_kwh'] == 2.0
 
+    
+    def test_market_clearing(self):
+        """Test batch double-auction clearing"""
+        negotiator = EnergyNegotiator()
+        cheap = negotiator.create_offer(seller_id=0, energy_kwh=2.0, price_per_kwh=0.08)
+        negotiator.create_offer(seller_id=1, energy_kwh=3.0, price_per_kwh=0.11)
+        negotiator.create_offer(seller_id=2, energy_kwh=5.0, price_per_kwh=0.20)
+        negotiator.create_bid(buyer_id=3, energy_kwh=4.0, max_price_per_kwh=0.14)
+        negotiator.create_bid(buyer_id=4, energy_kwh=1.0, max_price_per_kwh=0.05)
+        
+        trades = negotiator.clear_market()
+        
+        assert sum(t['energy_kwh'] for t in trades) == pytest.approx(4.0)
+        assert {t['seller_id'] for t in trades} == {0, 1}
+        assert len({t['price_per_kwh'] for t in trades}) == 1
+        assert cheap not in negotiator.active_offers
+        
+        offers = negotiator.get_available_offers()
+        assert [o['seller_id'] for o in offers] == [1, 2]
+        assert offers[0]['energy_kwh'] == pytest.approx(1.0)
+        assert len(negotiator.active_bids) == 1
+    
+    def test_no_self_trades(self):
+        """Test an agent's bid skips its own asks, which stay for other buyers"""
+        negotiator = EnergyNegotiator()
+        own = negotiator.create_offer(seller_id=0, energy_kwh=2.0, price_per_kwh=0.08)
+        negotiator.create_offer(seller_id=1, energy_kwh=2.0, price_per_kwh=0.10)
+        negotiator.create_bid(buyer_id=0, energy_kwh=2.0, max_price_per_kwh=0.15)
+        negotiator.create_bid(buyer_id=2, energy_kwh=1.0, max_price_per_kwh=0.12)
+        
+        trades = negotiator.clear_market()
+        
+        assert all(t['seller_id'] != t['buyer_id'] for t in trades)
+        assert [(t['buyer_id'], t['seller_id']) for t in trades] == [(0, 1), (2, 0)]
+        assert negotiator.active_offers[own]['energy_kwh'] == pytest.approx(1.0)
+        assert not negotiator.accept_offer(own, buyer_id=0, amount_kwh=1.0)
+    
+    def test_prices_within_limits_after_self_trade_skip(self):
+        """Test no trade settles below its ask or above its bid when a skipped ask fills later"""
+        negotiator = EnergyNegotiator()
+        negotiator.create_offer(seller_id=0, energy_kwh=1.0, price_per_kwh=0.08)
+        negotiator.create_offer(seller_id=1, energy_kwh=2.0, price_per_kwh=0.40)
+        negotiator.create_bid(buyer_id=0, energy_kwh=2.0, max_price_per_kwh=0.50)
+        negotiator.create_bid(buyer_id=2, energy_kwh=1.0, max_price_per_kwh=0.09)
+        asks, bids = {0: 0.08, 1: 0.40}, {0: 0.50, 2: 0.09}
+        
+        trades = negotiator.clear_market()
+        
+        assert [(t['buyer_id'], t['seller_id']) for t in trades] == [(0, 1), (2, 0)]
+        for trade in trades:
+            assert asks[trade['seller_id']] <= trade['price_per_kwh'] <= bids[trade['buyer_id']]
+    
+    def test_asks_up_to_price(self):
+        """Test asks come back in price order without sorting the whole book"""
+        negotiator = EnergyNegotiator()
+        prices = np.random.default_rng(0).uniform(0.05, 0.30, 200)
+        ids = [negotiator.create_offer(seller_id=i, energy_kwh=1.0, price_per_kwh=p) for i, p in enumerate(prices)]
+        for offer_id in ids[::3]:
+            negotiator.cancel_order(offer_id)
+        
+        live = sorted(p for i, p in enumerate(prices) if i % 3)
+        assert [o.price_per_kwh for o in negotiator.book.asks()] == live
+        assert [o.price_per_kwh for o in negotiator.book.asks(max_price=0.1)] == [p for p in live if p <= 0.1]
+
+
+class TestProfiling:
+    """Test per-phase profiling spans"""
+    
+    def test_disabled_spans_record_nothing(self):
+        """Without an active profiler spans are the shared no-op"""
+        from src.utils.profiling import NULL_SPAN, active_profiler, span
+        
+        assert active_profiler() is None
+        assert span("swarm.decide") is NULL_SPAN
+        SwarmSimulator(num_agents=3).run(hours=1)
+    
+    def test_simulation_profile_and_trace(self, tmp_path):
+        """Phases aggregate per run and are written as Chrome trace events"""
+        import json
+        from src.simulation.environment import SolarEnvironment
+        from src.utils.profiling import active_profiler, profile
+        
+        trace_path = tmp_path / "trace.json"
+        with profile(trace_path=str(trace_path)) as profiler:
+            sim = SwarmSimulator(num_agents=5)
+            sim.run(hours=3)
+            sim.step(12)
+            SolarEnvironment(num_houses=2).step([1.0, 1.0])
+        assert active_profiler() is None
+        
+        report = profiler.report()
+        for phase in ("update_state", "communicate", "broadcast", "decide"):
+            assert report[f"swarm.{phase}"]["calls"] == 4
+        assert report["swarm.timestep"]["calls"] == 4
+        assert report["swarm.step"]["calls"] == 1
+        assert report["swarm.metrics"]["calls"] == 1
+        assert report["environment.step"]["calls"] == 1
+        assert report["swarm.timestep"]["total_s"] >= report["swarm.decide"]["total_s"]
+        assert "swarm.timestep" in profiler.format_report()
+        
+        events = json.loads(trace_path.read_text())["traceEvents"]
+        assert len(events) == sum(row["calls"] for row in report.values())
+        assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+class TestVectorizedMultiAgentEnv:
+    """Test array-based multi-agent environment"""
+    
+    def test_step_shapes(self):
+        """Test observation, reward and done shapes"""
+        from src.agents.multi_agent_env import VectorizedMultiAgentSolarEnv
+        
+        env = VectorizedMultiAgentSolarEnv(num_agents=12)
+        obs = env.reset()
+        assert obs.shape == (12, 8)
+        
+        actions = np.tile([0.5, 1.0, 1.0], (12, 1))
+        obs, rewards, dones, info = env.step(actions)
+        
+        assert obs.shape == (12, 8)
+        assert rewards.shape == (12,)
+        assert dones.shape == (12,)
+        assert info['step'] == 1
+    
+    def test_matches_dict_environment(self):
+        """Test rewards and neighbor averages match the per-agent implementation"""
+        from src.agents.multi_agent_env import MultiAgentSolarEnv, VectorizedMultiAgentSolarEnv
+        
+        n = 15
+        rng = np.random.default_rng(0)
+        production = rng.uniform(0, 5, n)
+        consumption = rng.uniform(0, 5, n)
+        battery = rng.uniform(0, 60, n)
+        actions = rng.uniform(0, 2, (n, 3))
+        
+        env = MultiAgentSolarEnv(num_agents=n)
+        prod_iter, cons_iter = iter(production), iter(consumption)
+        env._simulate_production = lambda hour: next(prod_iter)
+        env._simulate_consumption = lambda hour: next(cons_iter)
+        for state, level in zip(env.agent_states, battery):
+            state['battery_level'] = level
+        obs, rewards, _, _ = env.step(list(actions))
+        
+        vec_env = VectorizedMultiAgentSolarEnv(num_agents=n)
+        vec_env._sample_production = lambda hour: production.copy()
+        vec_env._sample_consumption = lambda hour: consumption.copy()
+        vec_env.battery_level = battery.copy()
+        vec_obs, vec_rewards, _, _ = vec_env.step(actions)
+        
+        np.testing.assert_allclose(vec_rewards, rewards, rtol=1e-5)
+        np.testing.assert_allclose(vec_obs[:, :6], np.array(obs)[:, :6], rtol=1e-5)
+
+
+class TestVectorizedTraining:
+    """Test subprocess vectorized environments and batched PPO"""
+    
+    def test_shared_memory_vec_env(self):
+        """Test stepping batched environments across worker processes"""
+        from functools import partial
+        from src.agents.vec_env import MultiAgentBatchEnv, SharedMemoryVecEnv
+        
+        env = SharedMemoryVecEnv([partial(MultiAgentBatchEnv, num_agents=4, max_steps=3)] * 2)
+        try:
+            assert env.num_envs == 8
+            obs = env.reset()
+            assert obs.shape == (8, 8)
+            
+            for _ in range(3):
+                obs, rewards, dones, infos = env.step(np.zeros((8, 3)))
+            
+            assert obs.shape == (8, 8)
+            assert rewards.shape == (8,)
+            assert dones.all()
+            assert len(infos) == 8
+        finally:
+            env.close()
+    
+    def test_ppo_on_batch_env(self):
+        """Test PPO training with all agents as one batch"""
+        from src.agents.ppo_agent import train_ppo_agent
+        from src.agents.vec_env import MultiAgentBatchEnv
+        
+        env = MultiAgentBatchEnv(num_agents=6, max_steps=24)
+        agent = train_ppo_agent(env, episodes=2, max_steps=8)
+        
+        assert len(agent.buffer) == 0
+
+    
+    def test_vectorized_gae_matches_reference(self):
+        """Test vectorized GAE against the step-by-step recursion"""
+        from src.agents.ppo_agent import PPOAgent
+        
+        agent = PPOAgent(state_dim=8, action_dim=3)
+        rng = np.random.default_rng(1)
+        rewards = rng.normal(size=(20, 4))
+        values = rng.normal(size=(20, 4))
+        dones = rng.random((20, 4)) < 0.2
+        
+        expected = np.zeros((20, 4))
+        gae = np.zeros(4)
+        next_values = np.vstack([values[1:], np.zeros((1, 4))])
+        for t in reversed(range(20)):
+            delta = rewards[t] + agent.gamma * next_values[t] * (1 - dones[t]) - values[t]
+            gae = delta + agent.gamma * agent.gae_lambda * (1 - dones[t]) * gae
+            expected[t] = gae
+        
+        advantages = agent.compute_gae(rewards, values, dones, np.zeros(4))
+        np.testing.assert_allclose(advantages, expected, rtol=1e-4, atol=1e-5)
+    
+    def test_rollout_buffer_grows(self):
+        """Test rollout storage grows past its initial capacity"""
+        from src.agents.ppo_agent import RolloutBuffer
+        
+        buffer = RolloutBuffer(state_dim=8, action_dim=3, capacity=2)
+        for i in range(5):
+            buffer.add(np.full(8, i), np.zeros(3), 0.0, float(i), False)
+        
+        states, _, _, rewards, _ = buffer.get()
+        assert len(buffer) == 5
+        assert states.shape == (5, 8)
+        np.testing.assert_array_equal(rewards, np.arange(5))
+
+
+class TestReplayBuffers:
+    """Test preallocated and prioritized DQN replay"""
+    
+    def test_ring_buffer_wraps(self):
+        """Test oldest transitions are overwritten once full"""
+        from src.agents.dqn_agent import RingReplayBuffer
+        
+        buffer = RingReplayBuffer(capacity=4, state_size=3)
+        for i in range(6):
+            buffer.push(np.full(3, i), i, float(i), np.full(3, i + 1), False)
+        
+        assert len(buffer) == 4
+        assert sorted(buffer.actions.tolist()) == [2, 3, 4, 5]
+        
+        states, actions, rewards, next_states, dones = buffer.sample(8)
+        assert states.shape == (8, 3)
+        assert states.dtype == np.float32
+        np.testing.assert_array_equal(states[:, 0], actions)
+    
+    def test_prioritized_sampling(self):
+        """Test high-priority transitions dominate samples"""
+        from src.agents.dqn_agent import PrioritizedReplayBuffer
+        
+        buffer = PrioritizedReplayBuffer(capacity=10, state_size=2)
+        for i in range(10):
+            buffer.push(np.zeros(2), i, 0.0, np.zeros(2), False)
+        buffer.update_priorities(np.arange(10), np.r_[np.full(9, 0.01), 100.0])
+        
+        *_, weights, idx = buffer.sample(200)
+        assert (idx == 9).mean() > 0.9
+        assert weights.max() == pytest.approx(1.0)
+    
+    def test_snapshot_round_trip(self, tmp_path):
+        """Test saving and memory-mapping a buffer snapshot"""
+        from src.agents.dqn_agent import PrioritizedReplayBuffer
+        
+        buffer = PrioritizedReplayBuffer(capacity=8, state_size=2)
+        for i in range(5):
+            buffer.push(np.full(2, i), i, float(i), np.zeros(2), i == 4)
+        buffer.save(tmp_path / "replay")
+        
+        loaded = PrioritizedReplayBuffer.load(tmp_path / "replay")
+        assert len(loaded) == 5
+        assert isinstance(loaded.states, np.memmap)
+        np.testing.assert_array_equal(loaded.rewards[:5], np.arange(5))
+        assert loaded.tree.total() == pytest.approx(buffer.tree.total())
+        
+        loaded.push(np.zeros(2), 7, 7.0, np.zeros(2), False)
+        assert len(loaded) == 6
+    
+    def test_dqn_prioritized_training(self):
+        """Test DQN training step with prioritized replay"""
+        from src.agents.dqn_agent import DQNAgent
+        
+        agent = DQNAgent(state_size=4, action_size=3, batch_size=8, prioritized_replay=True)
+        for _ in range(16):
+            agent.store_transition(np.random.rand(4), np.random.randint(3), 1.0, np.random.rand(4), False)
+        
+        loss = agent.train()
+        assert loss >= 0
+
 
 def test_import():
     """Test module imports"""
@@ -2,9 +2,19 @@
 Test API Endpoints
 """
 
+import asyncio
+import json
+import subprocess
+import sys
+import time
 import pytest
 from fastapi.testclient import TestClient
 from src.api.main import app
+from src.api.iot_batch import encode_binary_readings
+from src.api.command_dispatcher import CommandDispatcher
+from src.api.mqtt_broker import InProcessBroker, MQTTServer, encode_packet, encode_publish, encode_string, read_packet, topic_matches
+from src.api.mqtt_ingest import MQTTIngestionAdapter
+from src.api.routes import make_iot_decision, make_iot_decisions
 
 client = TestClient(app)
 
@@ -47,6 +57,454 @@ class TestAPIEndpoints:
             json={"num_agents": -1, "hours": 2}
         )
         assert response.status_code == 422  # Validation error
+    
+    def test_models_status(self):
+        """Test live model version endpoint"""
+        response = client.get("/api/v1/models/status")
+        assert response.status_code == 200
+        data = response.json()
+        assert "version" in data["anomaly"]
+        assert "trained_at" in data["forecasting"]
+
+
+class TestIoTBatch:
+    """Test batch IoT ingestion"""
+    
+    def test_json_batch(self):
+        """Test many devices in one JSON request get one command each"""
+        readings = [
+            {"device_id": f"esp32_{i}", "sensor_data": {"power_w": 100.0 * i, "voltage_v": 12.5, "battery_level_pct": 10.0 * i}}
+            for i in range(10)
+        ]
+        response = client.post("/api/v1/iot/data/batch", json={"readings": readings})
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["count"] == 10
+        assert set(data["commands"]) == {f"esp32_{i}" for i in range(10)}
+        
+        command = client.get("/api/v1/iot/command", params={"device_id": "esp32_9"})
+        assert command.json()["command"] == data["commands"]["esp32_9"]
+    
+    def test_repeated_device_gets_one_command(self):
+        """Test a device sending several readings in one batch gets only its last decision"""
+        from src.api.routes import command_dispatcher
+        
+        readings = [
+            {"device_id": "esp32_repeat", "sensor_data": {"power_w": 3000.0, "voltage_v": 12.5, "battery_level_pct": 90.0}},
+            {"device_id": "esp32_other", "sensor_data": {"power_w": 100.0, "voltage_v": 12.5, "battery_level_pct": 50.0}},
+            {"device_id": "esp32_repeat", "sensor_data": {"power_w": 50.0, "voltage_v": 12.5, "battery_level_pct": 10.0}},
+        ]
+        before = len(command_dispatcher.history("esp32_repeat"))
+        response = client.post("/api/v1/iot/data/batch", json={"readings": readings})
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["count"] == 3
+        assert len(command_dispatcher.history("esp32_repeat")) == before + 1
+        assert data["commands"]["esp32_repeat"]["action"] == "disable_load"
+        assert command_dispatcher.pending("esp32_repeat")["command"] == data["commands"]["esp32_repeat"]
+    
+    def test_binary_batch(self):
+        """Test compact binary records decode like JSON readings"""
+        body = encode_binary_readings(
+            ["gw_a", "gw_b"], power_w=[900.0, 50.0], battery_level_pct=[50.0, 90.0], voltage_v=12.0
+        )
+        response = client.post(
+            "/api/v1/iot/data/batch", content=body,
+            headers={"content-type": "application/octet-stream"}
+        )
+        
+        assert response.status_code == 200
+        commands = response.json()["commands"]
+        assert commands["gw_b"]["action"] == "discharge_battery"
+        assert commands["gw_a"]["action"] in ("charge_battery", "stop_battery")
+        
+        bad = client.post(
+            "/api/v1/iot/data/batch", content=body[:-1],
+            headers={"content-type": "application/octet-stream"}
+        )
+        assert bad.status_code == 400
+    
+    def test_batch_forecasts_use_device_history(self, tmp_path):
+        """Test each device is forecast from its own hourly history"""
+        import numpy as np
+        import torch
+        from src.api import routes
+        from src.api.iot_batch import parse_json_readings
+        from src.models.lstm_forecaster import SolarLSTM
+        from src.services.forecasting_service import get_forecasting_service
+        
+        store = routes.command_dispatcher.store
+        now = time.time()
+        for hours_ago in range(30, 0, -1):
+            power = 400.0 * max(0.0, np.sin(((30 - hours_ago) % 24 - 6) / 12 * np.pi))
+            store.record_batch(["hist_dev"], {"power_w": np.array([power]), "battery_level_pct": np.array([60.0])},
+                               now - hours_ago * 3600)
+        
+        torch.manual_seed(0)
+        torch.save(SolarLSTM(input_size=10, hidden_size=64, num_layers=2).state_dict(), tmp_path / 'lstm.pth')
+        service = get_forecasting_service()
+        saved = dict(vars(service))
+        try:
+            service.load_lstm(tmp_path / 'lstm.pth')
+            readings = [{"device_id": device_id, "sensor_data": {"power_w": 300.0, "battery_level_pct": 60.0}}
+                        for device_id in ("hist_dev", "new_dev")]
+            response = routes.process_iot_readings(parse_json_readings(readings))
+            single = [service.predict_24h(historical_data=store.hourly_history(device_id))[0]['predicted_kwh']
+                      for device_id in ("hist_dev", "new_dev")]
+        finally:
+            vars(service).update(saved)
+        
+        assert len(store.hourly_history("hist_dev")) == 24
+        assert response.forecast_next_hour == pytest.approx(np.mean(single), abs=0.011)
+    
+    def test_batch_decisions_match_single(self):
+        """Test vectorized decisions equal the per-device rules"""
+        cases = [(0.05, 10, False), (0.3, 50, True), (1.0, 50, False), (3.0, 90, False),
+                 (0.1, 60, False), (0.1, 25, False), (0.3, 50, False), (0.6, 15, False)]
+        production, battery, anomaly = map(list, zip(*cases))
+        
+        batch = make_iot_decisions(production, 0.0, battery, 12.0, anomaly)
+        
+        assert [d["action"] for d in batch] == [
+            "disable_load", "stop_battery", "charge_battery", "export_to_grid",
+            "discharge_battery", "disable_load", "enable_load", "charge_battery"
+        ]
+        assert batch[2]["amount"] == pytest.approx(0.8)
+        assert batch[2]["reason"] == "High production (1.00kW), charging battery"
+        assert make_iot_decision(3.0, 0.0, 90, 12.0, False) == batch[3]
+
+
+class TestCommandDelivery:
+    """Test long-poll and WebSocket command delivery"""
+    
+    def test_long_poll_wakes_on_publish(self):
+        """A waiting poll returns the command published while it waits"""
+        async def scenario():
+            dispatcher = CommandDispatcher()
+            waiter = asyncio.create_task(dispatcher.wait_for_command("dev", 5.0))
+            await asyncio.sleep(0.01)
+            command_id = dispatcher.publish("dev", {"action": "charge_battery"})
+            record = await asyncio.wait_for(waiter, 1.0)
+            timed_out = await dispatcher.wait_for_command("other", 0.01)
+            return command_id, record, timed_out, dispatcher.waiting_devices
+        
+        command_id, record, timed_out, waiting = asyncio.run(scenario())
+        
+        assert record["command_id"] == command_id
+        assert record["command"] == {"action": "charge_battery"}
+        assert timed_out is None
+        assert waiting == 0
+    
+    def test_poll_and_confirm_by_command_id(self):
+        """Polling returns the command id and confirm acknowledges it"""
+        device_id = "esp32_poll_test"
+        client.post("/api/v1/iot/data", json={
+            "device_id": device_id,
+            "sensor_data": {"power_w": 800, "battery_level_pct": 40}
+        })
+        
+        response = client.get("/api/v1/iot/command", params={"device_id": device_id, "wait": 1})
+        assert response.status_code == 200
+        command_id = response.json()["command_id"]
+        
+        client.post("/api/v1/iot/command/confirm", json={
+            "device_id": device_id, "command_id": command_id, "executed": True
+        })
+        response = client.get("/api/v1/iot/command", params={"device_id": device_id})
+        assert response.status_code == 204
+    
+    def test_websocket_push_and_ack(self):
+        """Commands are pushed over the device socket and acked by id"""
+        from src.api import routes
+        device_id = "esp32_ws_test"
+        
+        with client.websocket_connect(f"/api/v1/iot/ws/{device_id}") as ws:
+            client.post("/api/v1/iot/data", json={
+                "device_id": device_id,
+                "sensor_data": {"power_w": 800, "battery_level_pct": 40}
+            })
+            message = ws.receive_json()
+            assert "action" in message["command"]
+            assert routes.command_dispatcher.store.latest_command(device_id)["status"] == "delivered"
+            
+            ws.send_json({"ack": message["command_id"], "executed": False})
+            ws.send_json({"ack": -1})
+        
+        assert routes.command_dispatcher.store.latest_command(device_id)["status"] == "failed"
+        assert routes.command_dispatcher.connected_devices == 0
+
+
+class TestMQTTIngestion:
+    """Test the pub/sub broker and MQTT ingestion adapter"""
+    
+    def test_topic_filters(self):
+        """Wildcards match like MQTT and the trie agrees with topic_matches"""
+        broker = InProcessBroker()
+        received = {}
+        patterns = ["solar/+/telemetry", "solar/#", "solar/dev1/command", "+/+", "#"]
+        handles = [broker.subscribe(p, lambda t, m, p=p: received.setdefault(p, []).append(t)) for p in patterns]
+        
+        for topic in ["solar/dev1/telemetry", "solar/dev1/command", "solar", "other/x", "solar/a/b/c"]:
+            broker.publish(topic, b"")
+        
+        for pattern in patterns:
+            expected = [t for t in ["solar/dev1/telemetry", "solar/dev1/command", "solar", "other/x", "solar/a/b/c"]
+                        if topic_matches(pattern, t)]
+            assert received.get(pattern, []) == expected
+        
+        for handle in handles:
+            broker.unsubscribe(handle)
+        assert broker.num_subscriptions == 0
+        assert broker.publish("solar/dev1/telemetry", b"") == 0
+    
+    def test_batches_telemetry_and_publishes_commands(self):
+        """Telemetry is processed in batches and commands reach device topics"""
+        from src.api import routes
+        
+        async def scenario():
+            broker = InProcessBroker()
+            dispatcher = CommandDispatcher()
+            batches = []
+            
+            def process(columns):
+                batches.append(list(columns['device_id']))
+                for device_id, power in zip(columns['device_id'], columns['power_w']):
+                    dispatcher.publish(device_id, {"action": "charge_battery", "power_w": float(power)})
+            
+            adapter = MQTTIngestionAdapter(broker, dispatcher, process=process, batch_size=3, batch_interval=0.01)
+            adapter.start()
+            commands = []
+            broker.subscribe("solar/+/command", lambda topic, payload: commands.append((topic, json.loads(payload))))
+            
+            for i in range(4):
+                broker.publish(f"solar/dev{i}/telemetry", json.dumps({"power_w": 100.0 * i}).encode())
+            broker.publish("solar/dev9/telemetry", b"not json")
+            await asyncio.sleep(0.05)
+            
+            topic, message = commands[0]
+            broker.publish("solar/dev0/ack", json.dumps({"command_id": message["command_id"]}).encode())
+            adapter.stop()
+            return batches, commands, adapter.stats, dispatcher.store
+        
+        batches, commands, stats, store = asyncio.run(scenario())
+        
+        assert batches == [["dev0", "dev1", "dev2"], ["dev3"]]
+        assert [topic for topic, _ in commands] == [f"solar/dev{i}/command" for i in range(4)]
+        assert commands[3][1]["command"]["power_w"] == 300.0
+        assert stats["invalid"] == 1 and stats["commands_sent"] == 4
+        assert store.latest_command("dev0")["status"] == "executed"
+        assert store.latest_command("dev1")["status"] == "delivered"
+        
+        # Default pipeline stores the readings and decides with make_iot_decisions
+        async def default_pipeline():
+            broker = InProcessBroker()
+            adapter = MQTTIngestionAdapter(broker, routes.command_dispatcher)
+            adapter.start()
+            broker.publish("solar/esp32_mqtt/telemetry", json.dumps({"power_w": 900, "battery_level_pct": 40}).encode())
+            adapter.stop()
+        
+        asyncio.run(default_pipeline())
+        assert routes.command_dispatcher.store.telemetry("esp32_mqtt")[-1]["power_w"] == 900.0
+        assert routes.command_dispatcher.store.latest_command("esp32_mqtt")["command"]["action"] == "charge_battery"
+    
+    def test_http_devices_keep_pending_commands(self):
+        """Commands for HTTP-polling devices stay pending alongside the MQTT adapter"""
+        async def scenario():
+            broker = InProcessBroker()
+            dispatcher = CommandDispatcher()
+            adapter = MQTTIngestionAdapter(broker, dispatcher, process=lambda columns: None)
+            adapter.start()
+            logged = []
+            broker.subscribe("#", lambda topic, payload: logged.append(topic))  # e.g. a dashboard
+            
+            broker.publish("solar/mqtt_dev/telemetry", json.dumps({"power_w": 50.0}).encode())
+            dispatcher.publish("mqtt_dev", {"action": "charge_battery"})
+            dispatcher.publish("http_dev", {"action": "discharge_battery"})
+            command = await dispatcher.wait_for_command("http_dev", 0.0)
+            adapter.stop()
+            return dispatcher, command, logged
+        
+        dispatcher, command, logged = asyncio.run(scenario())
+        
+        assert "solar/http_dev/command" in logged
+        assert command["command"]["action"] == "discharge_battery"
+        assert dispatcher.pending("http_dev") is not None
+        assert dispatcher.store.latest_command("mqtt_dev")["status"] == "delivered"
+    
+    def test_embedded_server_speaks_mqtt(self):
+        """A raw MQTT client can connect, publish and receive over TCP"""
+        async def scenario():
+            broker = InProcessBroker()
+            server = MQTTServer(broker, port=0)
+            await server.start()
+            received = []
+            broker.subscribe("solar/+/telemetry", lambda topic, payload: received.append((topic, payload)))
+            
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            connect = encode_string("MQTT") + bytes([4, 0x02, 0, 60]) + encode_string("esp32_01")
+            writer.write(encode_packet(1, connect))
+            connack = await read_packet(reader)
+            
+            writer.write(encode_packet(8, b"\x00\x01" + encode_string("solar/esp32_01/command") + b"\x00", flags=2))
+            suback = await read_packet(reader)
+            
+            writer.write(encode_publish("solar/esp32_01/telemetry", b'{"power_w": 5}', qos=1, packet_id=7))
+            puback = await read_packet(reader)
+            
+            broker.publish("solar/esp32_01/command", b'{"action": "stop_battery"}')
+            command = await read_packet(reader)
+            
+            writer.write(encode_packet(14, b""))
+            await writer.drain()
+            writer.close()
+            await server.stop()
+            return connack, suback, puback, command, received
+        
+        connack, suback, puback, command, received = asyncio.run(scenario())
+        
+        assert connack == (2, 0, b"\x00\x00")
+        assert suback == (9, 0, b"\x00\x01\x00")
+        assert puback == (4, 0, b"\x00\x07")
+        assert command[0] == 3 and command[2].endswith(b'{"action": "stop_battery"}')
+        assert received == [("solar/esp32_01/telemetry", b'{"power_w": 5}')]
+
+
+class TestStartup:
+    """Test that API startup does not import ML frameworks"""
+    
+    def test_api_import_is_lazy(self):
+        """Importing the app leaves torch / sklearn / RL libraries unloaded"""
+        heavy = ('torch', 'sklearn', 'gym', 'stable_baselines3', 'prophet', 'pandas')
+        code = f"import sys, src.api.main; print([m for m in {heavy!r} if m in sys.modules])"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        
+        assert output.strip().splitlines()[-1] == "[]"
+    
+    def test_rl_exports_resolve_on_access(self):
+        """Lazy package attributes still resolve"""
+        import src.agents
+        
+        assert "SwarmSimulator" in src.agents.__all__
+        with pytest.raises(AttributeError):
+            src.agents.NotAnAgent
+
+
+class TestReadiness:
+    """Test startup warm-up and readiness reporting"""
+    
+    def test_not_ready_without_warmup(self):
+        """Liveness passes while readiness reports 503"""
+        assert client.get("/health").status_code == 200
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "pending"
+    
+    def test_ready_after_warmup(self):
+        """The lifespan warms models in the background, then /ready is 200"""
+        with TestClient(app) as warm_client:
+            deadline = time.time() + 120
+            response = warm_client.get("/ready")
+            while response.status_code == 503 and time.time() < deadline:
+                assert response.json()["status"] in ("pending", "warming")
+                time.sleep(0.1)
+                response = warm_client.get("/ready")
+            
+            assert response.status_code == 200
+            steps = response.json()["steps"]
+            assert {"forecasting", "forecast_inference", "anomaly_inference", "device_store"} <= set(steps)
+    
+    def test_failed_warmup_is_reported(self):
+        """A failing step leaves the service unready with the error"""
+        from src.services.warmup import warm_up
+        
+        def broken():
+            raise RuntimeError("model file corrupt")
+        
+        readiness = warm_up(extra_steps=[("broken", broken)])
+        assert not readiness.ready
+        assert readiness.to_dict()["status"] == "failed"
+        assert readiness.error == "model file corrupt"
+    
+    def test_failed_warmup_still_starts_device_store(self, monkeypatch, tmp_path):
+        """The device store flusher runs even when model warm-up fails"""
+        import src.api.main as api_main
+        import src.utils.device_store as device_store
+        
+        store = device_store.DeviceStore(db_path=str(tmp_path / "devices.db"))
+        monkeypatch.setattr(device_store, "_device_store", store)
+        def failing_warm_up(readiness):
+            readiness.status = 'failed'
+            readiness.error = "model file corrupt"
+            return readiness
+        
+        monkeypatch.setattr(api_main, "warm_up", failing_warm_up)
+        with TestClient(app) as cold_client:
+            deadline = time.time() + 30
+            while "device_store" not in app.state.readiness.timings and time.time() < deadline:
+                time.sleep(0.05)
+            
+            assert cold_client.get("/ready").json()["status"] == "failed"
+            assert store._flusher is not None and store._flusher.is_alive()
+    
+    def test_close_does_not_create_device_store(self, monkeypatch):
+        """Shutdown leaves an unused device store uncreated"""
+        import src.utils.device_store as device_store
+        
+        monkeypatch.setattr(device_store, "_device_store", None)
+        device_store.close_device_store()
+        assert device_store._device_store is None
+
+
+class TestMetrics:
+    """Test the Prometheus metrics endpoint and instrumentation primitives"""
+    
+    def test_histogram_rendering(self):
+        """Buckets are cumulative and labelled, with sum and count"""
+        from src.utils.instrumentation import Counter, Histogram, MetricsRegistry
+        
+        registry = MetricsRegistry()
+        latency = Histogram("test_seconds", "Test latency", ["path"], buckets=(0.1, 1.0), registry=registry)
+        requests = Counter("test_requests_total", "Test requests", registry=registry)
+        for value in (0.05, 0.1, 0.5, 2.0):
+            latency.labels("a").observe(value)
+        with latency.labels("b").time():
+            pass
+        requests.inc(3)
+        
+        text = registry.render()
+        assert '# TYPE test_seconds histogram' in text
+        assert 'test_seconds_bucket{path="a",le="0.1"} 2' in text
+        assert 'test_seconds_bucket{path="a",le="1.0"} 3' in text
+        assert 'test_seconds_bucket{path="a",le="+Inf"} 4' in text
+        assert 'test_seconds_count{path="a"} 4' in text
+        assert 'test_seconds_count{path="b"} 1' in text
+        assert 'test_requests_total 3.0' in text
+        with pytest.raises(ValueError):
+            Counter("test_requests_total", "Duplicate", registry=registry)
+    
+    def test_metrics_endpoint(self):
+        """IoT requests and decisions show up in /metrics"""
+        from src.utils.instrumentation import IOT_REQUESTS
+        
+        before = IOT_REQUESTS.labels("data").value
+        client.post("/api/v1/iot/data", json={
+            "device_id": "metrics_test_device",
+            "sensor_data": {"voltage_v": 12.5, "power_w": 600.0, "battery_level_pct": 50.0}
+        })
+        assert IOT_REQUESTS.labels("data").value == before + 1
+        
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = response.text
+        assert 'solar_iot_requests_total{endpoint="data"}' in text
+        assert 'solar_decision_seconds_count{source="iot"}' in text
+        assert 'solar_anomaly_detection_seconds_bucket{detector=' in text
+        assert 'solar_forecast_seconds_count{model=' in text
+        assert 'solar_websocket_connections{channel="simulation"} 0.0' in text
+        assert 'solar_command_queue_depth 0.0' in text
 
 
 class TestAPISchemas:
@@ -0,0 +1,311 @@
+"""
+Test Services Module
+"""
+
+import pytest
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from src.services.anomaly_service import AnomalyDetectionService
+from src.services.forecasting_service import ForecastingService
+from src.services.model_trainer import ModelRegistry, ModelWatcher, run_training
+from src.services.streaming_anomaly import StreamingAnomalyDetector
+from src.utils.device_store import DeviceStore
+from src.utils.historical_storage import HistoricalStorage
+from src.agents.base_agent import SwarmSimulator
+from src.api.routes import agent_columns
+
+
+class TestStreamingAnomalyDetector:
+    """Test online per-device anomaly detection"""
+    
+    def feed_normal(self, detector, devices, days=3, seed=0):
+        rng = np.random.default_rng(seed)
+        for day in range(days):
+            for hour in range(24):
+                production = max(0.0, np.sin((hour - 6) / 12 * np.pi)) * 3
+                values = np.column_stack([
+                    production + rng.normal(0, 0.05, len(devices)),
+                    np.full(len(devices), 1.0) + rng.normal(0, 0.05, len(devices)),
+                    np.full(len(devices), 5.0)
+                ])
+                detector.update(devices, values, np.full(len(devices), hour))
+    
+    def test_flags_deviation_from_hourly_profile(self):
+        """Test a reading normal overall but wrong for its hour is flagged"""
+        detector = StreamingAnomalyDetector()
+        devices = [f'esp32_{i}' for i in range(20)]
+        self.feed_normal(detector, devices)
+        
+        # Midday production of zero on one device, normal on another
+        result = detector.update(['esp32_3', 'esp32_4'], [[0.0, 1.0, 5.0], [3.0, 1.0, 5.0]], [12, 12])
+        
+        assert result['anomaly'].tolist() == [True, False]
+        assert result['deviation'][0, 0] < 0
+        assert detector.num_entities == 20
+    
+    def test_repeated_entities_match_sequential(self):
+        """Test a batch with repeated devices equals one-by-one updates"""
+        rng = np.random.default_rng(1)
+        ids = list(rng.integers(0, 5, 200))
+        values = rng.normal(2, 1, size=(200, 3))
+        hours = rng.integers(0, 24, 200)
+        
+        batched = StreamingAnomalyDetector(warmup=5, profile_warmup=2)
+        sequential = StreamingAnomalyDetector(warmup=5, profile_warmup=2)
+        batch_scores = batched.update(ids, values, hours)['score']
+        single_scores = [sequential.update([e], v[None], [h])['score'][0] for e, v, h in zip(ids, values, hours)]
+        
+        assert np.allclose(batch_scores, single_scores)
+        assert np.allclose(batched.mean[:5], sequential.mean[:5])
+    
+    def test_alerts_and_retraining(self):
+        """Test alert dicts and IsolationForest refit on recent readings"""
+        detector = StreamingAnomalyDetector(sample_size=500)
+        self.feed_normal(detector, ['a', 'b'], days=5)
+        
+        alerts = detector.process_points([
+            {'agent_id': 'a', 'production': 3.0, 'consumption': 9.0, 'battery_level': 5.0, 'hour': 12}
+        ])
+        assert len(alerts) == 1
+        assert alerts[0]['type'] == 'high_consumption'
+        assert alerts[0]['agent_id'] == 'a'
+        
+        assert detector.retrain()
+        result = detector.update(['b'], [[3.0, 1.0, 5.0]], [12])
+        assert result['anomaly'].shape == (1,)
+
+
+class TestAnomalyDetectionService:
+    """Test batch anomaly detection"""
+    
+    @staticmethod
+    def make_points(n, seed=0):
+        rng = np.random.default_rng(seed)
+        return [
+            {
+                'agent_id': i,
+                'production': float(rng.uniform(0, 4)),
+                'consumption': float(rng.choice([0.05, 2.0, 9.0])),
+                'battery_level': float(rng.uniform(0, 1)),
+                'net_energy': 0.0,
+                'hour': int(rng.integers(0, 24))
+            }
+            for i in range(n)
+        ]
+    
+    def test_array_rules_match_dict_rules(self):
+        """Test array, DataFrame and dict inputs give the same alerts"""
+        service = AnomalyDetectionService()
+        points = self.make_points(300)
+        frame = pd.DataFrame(points)
+        
+        from_dicts = service.detect_anomalies(points)
+        from_arrays = service.detect_anomalies_array(
+            frame['production'], frame['consumption'], frame['battery_level'],
+            hour=frame['hour'], agent_ids=list(frame['agent_id'])
+        )
+        from_frame = service.detect_anomalies_frame(frame)
+        
+        strip = lambda alerts: [{k: v for k, v in a.items() if k != 'timestamp'} for a in alerts]
+        assert len(from_dicts) > 0
+        assert strip(from_dicts) == strip(from_arrays) == strip(from_frame)
+        
+        # Alerts stay grouped by data point, rules in evaluation order
+        assert [a['agent_id'] for a in from_dicts] == sorted(a['agent_id'] for a in from_dicts)
+    
+    def test_isolation_forest_path(self):
+        """Test trained model flags rows from arrays"""
+        service = AnomalyDetectionService()
+        service.train(self.make_points(500, seed=1))
+        
+        frame = pd.DataFrame(self.make_points(200, seed=2))
+        
+        alerts = service.detect_anomalies_frame(frame)
+        X = service.scaler.transform(service._features({
+            name: frame[name].to_numpy(dtype=float)
+            for name in ('production', 'consumption', 'battery_level', 'net_energy', 'hour')
+        }))
+        
+        expected = np.flatnonzero(service.isolation_forest.predict(X) == -1).tolist()
+        assert len(expected) > 0
+        assert [a['agent_id'] for a in alerts] == expected
+        assert all(a['type'] in {'low_production', 'high_consumption', 'low_battery', 'unusual_pattern'}
+                   for a in alerts)
+
+
+class TestForecastingService:
+    """Test per-device forecasting"""
+    
+    def test_batch_matches_single_device_forecasts(self, tmp_path):
+        """Test one batched LSTM pass gives each device its own next-hour forecast"""
+        import torch
+        from src.models.lstm_forecaster import SolarLSTM
+        
+        torch.manual_seed(0)
+        torch.save(SolarLSTM(input_size=10, hidden_size=64, num_layers=2).state_dict(), tmp_path / 'lstm.pth')
+        service = ForecastingService()
+        service.load_lstm(tmp_path / 'lstm.pth')
+        
+        rng = np.random.default_rng(0)
+        histories = [
+            [{'hour': h % 24, 'production': scale * max(0.0, np.sin((h % 24 - 6) / 12 * np.pi)) + rng.normal(0, 0.1),
+              'consumption': 0.0, 'battery_pct': 0.5} for h in range(hours)]
+            for scale, hours in [(1.0, 24), (4.0, 30), (8.0, 48), (2.0, 5), (6.0, 0)]
+        ]
+        
+        batch = service.predict_next_hour_batch(histories)
+        single = [service.predict_24h(historical_data=history)[0]['predicted_kwh'] for history in histories]
+        
+        assert batch.shape == (5,)
+        assert batch == pytest.approx(single, abs=0.011)
+        assert batch[3] == batch[4] == service._predict_simple([datetime.now()])[0]['predicted_kwh']
+
+
+class TestBackgroundTraining:
+    """Test versioned retraining and hot-swap"""
+    
+    @staticmethod
+    def simulate(num_agents=10, hours=48):
+        """Step results with per-agent states, as the API's simulation loop records them"""
+        simulator = SwarmSimulator(num_agents=num_agents)
+        steps = []
+        for hour in range(hours):
+            result = simulator.step(hour)
+            result['agent_states'] = [
+                {
+                    'id': agent.id,
+                    'production': agent.production,
+                    'consumption': agent.consumption,
+                    'battery': agent.battery_level,
+                    'battery_capacity': agent.battery_capacity
+                }
+                for agent in simulator.agents
+            ]
+            steps.append(result)
+        return simulator, steps
+    
+    @classmethod
+    def make_storage(cls, tmp_path, simulations=1, num_agents=10, hours=48):
+        np.random.seed(0)
+        storage = HistoricalStorage(str(tmp_path / 'history.db'))
+        for _ in range(simulations):
+            _, steps = cls.simulate(num_agents, hours)
+            storage.save_simulation(num_agents=num_agents, hours=hours, step_results=steps)
+        return storage
+    
+    def test_retrain_publishes_and_swaps(self, tmp_path):
+        """Test a training pass publishes versions the watcher swaps in"""
+        registry = ModelRegistry(str(tmp_path / 'registry'))
+        published = run_training(self.make_storage(tmp_path), registry, lstm_epochs=1)
+        
+        assert registry.current('anomaly')['version'] == published['anomaly']['version']
+        assert registry.current('forecast')['samples'] == 24
+        
+        anomaly_service = AnomalyDetectionService()
+        forecasting_service = ForecastingService()
+        watcher = ModelWatcher(registry, anomaly_service=anomaly_service,
+                               forecasting_service=forecasting_service)
+        
+        assert sorted(watcher.check()) == ['anomaly', 'forecast']
+        assert watcher.check() == []
+        assert anomaly_service.model_version == published['anomaly']['version']
+        assert forecasting_service.model_type == 'lstm'
+        
+        history = [{'hour': h, 'production': 1.0, 'consumption': 0.8, 'battery_pct': 0.5} for h in range(24)]
+        assert len(forecasting_service.predict_24h(historical_data=history)) == 24
+    
+    def test_retrained_model_keeps_sane_alert_rate(self, tmp_path):
+        """Test a hot-swapped anomaly model scores a normal simulation like the data it learned from"""
+        registry = ModelRegistry(str(tmp_path / 'registry'))
+        storage = self.make_storage(tmp_path, simulations=5, num_agents=50)
+        assert len(storage.get_recent_agent_states()) == 5 * 48 * 50
+        run_training(storage, registry, lstm_epochs=1)
+        
+        service = AnomalyDetectionService()
+        ModelWatcher(registry, anomaly_service=service).check()
+        assert service.model_type == 'isolation_forest'
+        
+        simulator, _ = self.simulate(num_agents=50, hours=0)
+        alerts = 0
+        for hour in range(48):
+            simulator.step(hour)
+            alerts += len(service.detect_anomalies_array(**agent_columns(simulator.agents), hour=hour % 24))
+        
+        # contamination=0.1: roughly one agent-hour in ten, not most of them
+        assert alerts / (48 * 50) < 0.2
+    
+    def test_registry_keeps_recent_versions(self, tmp_path):
+        """Test old versions are pruned and CURRENT points at the newest"""
+        registry = ModelRegistry(str(tmp_path), keep=2)
+        versions = [
+            registry.publish('demo', lambda d, i=i: (d / 'model.txt').write_text(str(i)))['version']
+            for i in range(4)
+        ]
+        
+        kept = sorted(p.name for p in (tmp_path / 'demo').iterdir() if p.is_dir())
+        assert kept == versions[-2:]
+        assert registry.current('demo')['version'] == versions[-1]
+
+
+class TestDeviceStore:
+    """Test sharded device telemetry and command queues"""
+    
+    def test_telemetry_ring_and_hourly_history(self):
+        """Keeps the last readings in order and averages them per hour"""
+        store = DeviceStore(db_path=None, telemetry_size=10)
+        start = 1_700_000_000.0 - 1_700_000_000.0 % 3600
+        for i in range(30):
+            store.record_telemetry("dev", {"power_w": 1000.0 * (i // 10), "battery_level_pct": 50.0},
+                                   timestamp=start + i * 360)
+        
+        readings = store.telemetry("dev")
+        assert [r["power_w"] for r in readings] == [2000.0] * 10
+        assert len(store.telemetry("dev", limit=3)) == 3
+        
+        history = store.hourly_history("dev")
+        assert [p["production"] for p in history] == pytest.approx([0.0, 1.0, 2.0])
+        assert history[0]["battery_pct"] == pytest.approx(0.5)
+        assert store.hourly_history("missing") == []
+    
+    def test_commands_supersede_and_acknowledge(self):
+        """A new command supersedes pending ones; acks update by id"""
+        store = DeviceStore(db_path=None)
+        first = store.push_command("dev", {"action": "charge_battery"})
+        second = store.push_command("dev", {"action": "export_to_grid"})
+        
+        assert first["status"] == "superseded"
+        assert store.pending_commands("dev") == [second]
+        assert store.set_command_status("dev", first["command_id"], "executed", expected="pending") is None
+        assert store.set_command_status("dev", second["command_id"], "executed")["status"] == "executed"
+        assert store.pending_commands("dev") == []
+    
+    def test_persists_across_restarts(self, tmp_path):
+        """Flushed telemetry, history and commands are restored on open"""
+        path = str(tmp_path / "devices.db")
+        store = DeviceStore(db_path=path, num_shards=4)
+        devices = [f"dev{i}" for i in range(20)]
+        store.record_batch(devices, {"power_w": np.arange(20.0) * 100})
+        record = store.push_command("dev3", {"action": "stop_battery"})
+        store.close()
+        
+        restored = DeviceStore(db_path=path, num_shards=8)
+        assert len(restored) == 20
+        assert restored.telemetry("dev7")[0]["power_w"] == 700.0
+        assert restored.hourly_history("dev7")[0]["production"] == pytest.approx(0.7)
+        assert restored.latest_command("dev3") == record
+        assert restored.push_command("dev3", {})["command_id"] > record["command_id"]
+        restored.close()
+    
+    def test_evicts_stale_devices(self, tmp_path):
+        """Devices idle past the TTL are dropped from memory and disk"""
+        path = str(tmp_path / "devices.db")
+        store = DeviceStore(db_path=path, ttl_seconds=60)
+        now = 1_700_000_000.0
+        store.record_telemetry("old", {"power_w": 1.0}, timestamp=now - 120)
+        store.record_telemetry("new", {"power_w": 1.0}, timestamp=now)
+        store.flush()
+        
+        assert store.evict_stale(now=now) == ["old"]
+        assert "old" not in store and "new" in store
+        store.close()